@@ -0,0 +1,403 @@
+import math
+import numpy
+
+class MomentAccumulator:
+    # Running count, mean, sum of squared differences from the mean (m2),
+    # minimum & maximum of a stream of values. Values are added a chunk at a
+    # time & accumulators merge exactly, using the parallel form of
+    # Welford's algorithm (Chan et al.)
+
+    __slots__ = ("count", "mean", "m2", "minimum", "maximum")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, values):
+        # Adds a chunk of values
+
+        if len(values) == 0:
+            return
+
+        values = numpy.asarray(values, dtype=numpy.float64)
+        mean = values.mean()
+        m2 = numpy.square(values - mean).sum()
+
+        self.merge_moments(len(values), mean, m2, values.min(), values.max())
+
+    def merge(self, other):
+        # Merges another accumulator into this one
+
+        if other.count:
+            self.merge_moments(other.count, other.mean, other.m2, \
+                    other.minimum, other.maximum)
+
+    def merge_moments(self, count, mean, m2, minimum, maximum):
+        # Merges the moments of another set of values into this one
+
+        total = self.count + count
+        delta = mean - self.mean
+
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+        if self.minimum is None or minimum < self.minimum:
+            self.minimum = float(minimum)
+        if self.maximum is None or maximum > self.maximum:
+            self.maximum = float(maximum)
+
+    @staticmethod
+    def from_partials(counts, means, m2s, minimums, maximums):
+        # Returns the accumulator of the values behind arrays of partial
+        # moments (e.g. one per file), merged all at once. Partials with a
+        # count of 0 are ignored
+
+        accumulator = MomentAccumulator()
+
+        non_empty = numpy.asarray(counts) > 0
+        if not non_empty.any():
+            return accumulator
+
+        counts = numpy.asarray(counts, dtype=numpy.float64)[non_empty]
+        means = numpy.asarray(means, dtype=numpy.float64)[non_empty]
+        m2s = numpy.asarray(m2s, dtype=numpy.float64)[non_empty]
+
+        total = counts.sum()
+        mean = (counts * means).sum() / total
+
+        accumulator.count = int(total)
+        accumulator.mean = float(mean)
+        accumulator.m2 = float(m2s.sum() + \
+                (counts * numpy.square(means - mean)).sum())
+        accumulator.minimum = float(numpy.asarray(minimums)[non_empty].min())
+        accumulator.maximum = float(numpy.asarray(maximums)[non_empty].max())
+
+        return accumulator
+
+    def variance(self):
+        # Population variance, like numpy.var
+
+        if self.count == 0:
+            return float("nan")
+
+        return self.m2 / self.count
+
+    def std(self):
+        # Population standard deviation, like numpy.std
+
+        return math.sqrt(self.variance())
+
+class QuantileSketch:
+    # KLL quantile sketch: a stack of compactors where level h holds values
+    # standing for 2^h values each. A level over its capacity is sorted &
+    # every other value is promoted to the next level, so memory stays
+    # around 3k values while queries are off by roughly relative_error in
+    # normalized rank
+
+    __slots__ = ("k", "count", "levels", "random")
+
+    # Capacity decay between successive levels
+    decay = 2.0 / 3.0
+
+    def __init__(self, relative_error=0.001, seed=0):
+        self.k = max(8, int(math.ceil(3.3 / relative_error)))
+        self.count = 0
+        self.levels = [numpy.empty(0, dtype=numpy.float64)]
+        self.random = numpy.random.default_rng(seed)
+
+    def capacity(self, level):
+        # Amount of values a level may hold before it gets compacted
+
+        depth = len(self.levels) - level - 1
+
+        return max(2, int(math.ceil(self.k * self.decay ** depth)))
+
+    def add(self, values):
+        # Adds a chunk of values
+
+        if len(values) == 0:
+            return
+
+        values = numpy.asarray(values, dtype=numpy.float64)
+        self.levels[0] = numpy.concatenate((self.levels[0], values))
+        self.count += len(values)
+        self.compress()
+
+    def merge(self, other):
+        # Merges another sketch into this one
+
+        for level, values in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(numpy.empty(0, dtype=numpy.float64))
+            self.levels[level] = numpy.concatenate((self.levels[level], \
+                    values))
+
+        self.count += other.count
+        self.compress()
+
+    def compress(self):
+        # Compacts every level over its capacity, bottom up
+
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self.capacity(level):
+                self.compact(level)
+            level += 1
+
+    def compact(self, level):
+        # Promotes every other sorted value of a level to the next one,
+        # starting at a random offset. An odd value out stays behind
+
+        if level + 1 == len(self.levels):
+            self.levels.append(numpy.empty(0, dtype=numpy.float64))
+
+        values = numpy.sort(self.levels[level])
+        leftover = len(values) % 2
+        offset = leftover + int(self.random.integers(2))
+
+        self.levels[level + 1] = numpy.concatenate((self.levels[level + 1], \
+                values[offset::2]))
+        self.levels[level] = values[:leftover]
+
+    def quantile(self, q):
+        # Approximate q-quantile of the values added so far
+
+        if self.count == 0:
+            return float("nan")
+
+        values = numpy.concatenate(self.levels)
+        weights = numpy.concatenate([numpy.full(len(level_values), \
+                2 ** level, dtype=numpy.float64) \
+                for level, level_values in enumerate(self.levels)])
+
+        order = numpy.argsort(values, kind="stable")
+        ranks = numpy.cumsum(weights[order])
+        index = numpy.searchsorted(ranks, q * ranks[-1], side="left")
+
+        return float(values[order[min(index, len(order) - 1)]])
+
+    def median(self):
+        # Approximate median of the values added so far
+
+        return self.quantile(0.5)
+
+    def deviations(self, center):
+        # Sketch of the absolute deviations of the values from center, e.g.
+        # to approximate their median absolute deviation without another
+        # pass over the values
+
+        sketch = QuantileSketch()
+        sketch.k = self.k
+        sketch.count = self.count
+        sketch.levels = [numpy.abs(level_values - center) \
+                for level_values in self.levels]
+
+        return sketch
+
+    def cdf(self, points):
+        # Approximate fraction of the values added so far that are <= each
+        # of the points
+
+        points = numpy.asarray(points, dtype=numpy.float64)
+        if self.count == 0:
+            return numpy.full(points.shape, numpy.nan)
+
+        values = numpy.concatenate(self.levels)
+        weights = numpy.concatenate([numpy.full(len(level_values), \
+                2 ** level, dtype=numpy.float64) \
+                for level, level_values in enumerate(self.levels)])
+
+        order = numpy.argsort(values, kind="stable")
+        values = values[order]
+        ranks = numpy.concatenate(([0.0], numpy.cumsum(weights[order])))
+
+        return ranks[numpy.searchsorted(values, points, side="right")] / \
+                ranks[-1]
+
+    def serialize(self):
+        # Returns the sketch as bytes, see deserialize
+
+        level_sizes = [len(level_values) for level_values in self.levels]
+        header = numpy.array([self.k, self.count] + level_sizes, \
+                dtype=numpy.int64)
+
+        return numpy.int64(len(header)).tobytes() + header.tobytes() + \
+                numpy.concatenate(self.levels).tobytes()
+
+    @staticmethod
+    def deserialize(data):
+        # Rebuilds a sketch from the bytes of serialize
+
+        header_size = int(numpy.frombuffer(data, numpy.int64, 1)[0])
+        header = numpy.frombuffer(data, numpy.int64, header_size, 8)
+        values = numpy.frombuffer(data, numpy.float64, \
+                offset=8 * (header_size + 1))
+
+        sketch = QuantileSketch()
+        sketch.k = int(header[0])
+        sketch.count = int(header[1])
+        bounds = numpy.concatenate(([0], numpy.cumsum(header[2:])))
+        sketch.levels = [values[start:stop].copy() \
+                for start, stop in zip(bounds[:-1], bounds[1:])]
+
+        return sketch
+
+class LogLinearHistogram:
+    # HDR style histogram of integer values with log-linear buckets: values
+    # below 2^precision get a bucket each, past that every power of two is
+    # split into 2^(precision - 1) buckets of equal width. Buckets are never
+    # wider than 2^-(precision - 1) of their values, so the percentiles read
+    # off of their midpoints are off by at most relative_error, & memory
+    # follows the range of the values rather than their amount. Histograms
+    # of the same precision merge by adding their counts. Negative values
+    # are counted apart, by magnitude
+
+    __slots__ = ("precision", "counts", "negative_counts", "count", \
+            "minimum", "maximum")
+
+    def __init__(self, relative_error=0.001):
+        if not 0 < relative_error < 1:
+            raise ValueError("The relative error of a histogram must be " + \
+                    "within (0, 1): %s" % relative_error)
+
+        self.precision = max(1, int(math.ceil(-math.log2(relative_error))))
+        self.counts = numpy.zeros(0, dtype=numpy.int64)
+        self.negative_counts = numpy.zeros(0, dtype=numpy.int64)
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+
+    def bucket_indexes(self, magnitudes):
+        # Index of the bucket of each of the (non-negative) values
+
+        bit_lengths = numpy.frexp(magnitudes)[1].astype(numpy.int64)
+        # Values past 2^53 may round up to the next power of two as floats
+        bit_lengths -= ((magnitudes >> numpy.maximum(bit_lengths - 1, 0)) \
+                == 0) & (magnitudes > 0)
+        shifts = numpy.maximum(bit_lengths - self.precision, 0)
+
+        return (shifts << (self.precision - 1)) + (magnitudes >> shifts)
+
+    def bucket_bounds(self, indexes):
+        # Lowest & highest (non-negative) value of each of the buckets
+
+        shifts = numpy.maximum(indexes >> (self.precision - 1), 1) - 1
+        lowers = (indexes - (shifts << (self.precision - 1))) << shifts
+
+        return lowers, lowers + (numpy.int64(1) << shifts) - 1
+
+    def add(self, values):
+        # Adds a chunk of values, truncated to integers
+
+        if len(values) == 0:
+            return
+
+        values = numpy.asarray(values).astype(numpy.int64, copy=False)
+        self.merge_extremes(len(values), int(values.min()), \
+                int(values.max()))
+
+        negative = values < 0
+        if negative.any():
+            self.negative_counts = LogLinearHistogram.add_counts(\
+                    self.negative_counts, numpy.bincount(\
+                    self.bucket_indexes(-values[negative])))
+            values = values[~negative]
+
+        self.counts = LogLinearHistogram.add_counts(self.counts, \
+                numpy.bincount(self.bucket_indexes(values)))
+
+    def merge(self, other):
+        # Merges another histogram of the same precision into this one
+
+        if other.precision != self.precision:
+            raise ValueError("Histograms of different precisions can't " + \
+                    "be merged: %s & %s" % (self.precision, other.precision))
+        if other.count == 0:
+            return
+
+        self.counts = LogLinearHistogram.add_counts(self.counts, \
+                other.counts)
+        self.negative_counts = LogLinearHistogram.add_counts(\
+                self.negative_counts, other.negative_counts)
+        self.merge_extremes(other.count, other.minimum, other.maximum)
+
+    def merge_extremes(self, count, minimum, maximum):
+        # Updates the count, minimum & maximum with those of more values
+
+        if self.count == 0:
+            self.minimum, self.maximum = minimum, maximum
+        else:
+            self.minimum = min(self.minimum, minimum)
+            self.maximum = max(self.maximum, maximum)
+        self.count += count
+
+    @staticmethod
+    def add_counts(counts, other_counts):
+        # Sum of two bucket count arrays, as long as the longest
+
+        if len(other_counts) > len(counts):
+            counts, other_counts = other_counts, counts
+        counts = counts.copy()
+        counts[:len(other_counts)] += other_counts
+
+        return counts
+
+    def get_buckets(self):
+        # Lowest & highest value & count of the buckets holding values, in
+        # order of value
+
+        indexes = numpy.flatnonzero(self.negative_counts)[::-1]
+        lowers, uppers = self.bucket_bounds(indexes)
+        negative_buckets = (-uppers, -lowers, self.negative_counts[indexes])
+
+        indexes = numpy.flatnonzero(self.counts)
+        lowers, uppers = self.bucket_bounds(indexes)
+        buckets = (lowers, uppers, self.counts[indexes])
+
+        return tuple(numpy.concatenate(pair) \
+                for pair in zip(negative_buckets, buckets))
+
+    def quantiles(self, quantiles):
+        # Approximate quantiles of the values added so far: the midpoint of
+        # the bucket holding each rank, within the minimum & maximum
+
+        quantiles = numpy.asarray(quantiles, dtype=numpy.float64)
+        if self.count == 0:
+            return numpy.full(quantiles.shape, numpy.nan)
+
+        lowers, uppers, counts = self.get_buckets()
+        ranks = numpy.maximum(numpy.ceil(quantiles * self.count), 1)
+        indexes = numpy.minimum(numpy.searchsorted(numpy.cumsum(counts), \
+                ranks, side="left"), len(counts) - 1)
+
+        # Halved apart, as the sum of the bounds may overflow
+        return numpy.clip(lowers[indexes] / 2.0 + uppers[indexes] / 2.0, \
+                self.minimum, self.maximum)
+
+    def quantile(self, q):
+        # Approximate q-quantile of the values added so far
+
+        return float(self.quantiles([q])[0])
+
+    def median(self):
+        # Approximate median of the values added so far
+
+        return self.quantile(0.5)
+
+    def cdf(self, points):
+        # Approximate fraction of the values added so far that are <= each
+        # of the points, counting the buckets below each point in full
+
+        points = numpy.asarray(points, dtype=numpy.float64)
+        if self.count == 0:
+            return numpy.full(points.shape, numpy.nan)
+
+        lowers, uppers, counts = self.get_buckets()
+        ranks = numpy.concatenate(([0], numpy.cumsum(counts)))
+
+        return ranks[numpy.searchsorted(uppers, points, side="right")] / \
+                float(self.count)
@@ -0,0 +1,468 @@
+import io
+import os
+import hmac
+import json
+import logging
+import secrets
+import traceback
+import contextlib
+import collections
+import http.server
+import urllib.parse
+import urllib.request
+from utils import Utils
+from objects import FileDataSet
+from profiler import Profiler
+from load_analysis_lib import LoadAnalysisLib
+from results_writer import ResultsWriter
+from diagnostics import Diagnostics
+
+class WarmDataset:
+    # The file data of a set of data directories kept in memory by the
+    # AnalysisServer, along with the size & mtime of each file (or archive)
+    # listed in them & the amount of files parsed out of it, in listing
+    # order, to tell which files changed since they were parsed
+
+    __slots__ = ("data_dirs", "recursive", "file_data", "sources")
+
+    def __init__(self, data_dirs, recursive):
+        self.data_dirs = data_dirs
+        self.recursive = recursive
+        self.file_data = FileDataSet()
+        self.sources = collections.OrderedDict()
+
+    def nbytes(self):
+        # Memory held by the columns of the file data
+
+        return self.file_data.timestamps.nbytes + \
+                self.file_data.deltas.nbytes
+
+class LogCapture(logging.Handler):
+    # Collects the formatted log lines of a command of the AnalysisServer,
+    # to send them back to the client
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.setFormatter(logging.Formatter(\
+                '%(asctime)s %(levelname)s: %(message)s', \
+                '%Y-%m-%d %H:%M:%S'))
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.extend(self.format(record).split("\n"))
+
+class AnalysisServer:
+    # Long running server for iterating on the cleanup, trimming & plots of
+    # the same data directories. The file data of the data directories
+    # analyzed stays in memory between commands, up to memory_limit bytes
+    # (the least recently used data directories are dropped first), & each
+    # command only reparses the files changed, added or removed since. A
+    # command is a load_analysis.py command line sent by --server, run with
+    # run_command(server, argv) one at a time in the client's directory,
+    # its log & exit status being sent back. Files are (re)parsed with
+    # parse_file_data(parser, options, args), extra headers are thus only
+    # reported when a file is reparsed. Commands write files & read the data
+    # of any directory, so every request must carry the random token of the
+    # server, which it writes to a file only its user can read
+
+    default_host = "127.0.0.1"
+    default_memory_limit = 4096 * 1024 * 1024
+    # Token file of the server on each port
+    token_path = os.path.join("~", ".load_analysis", "server-%s.token")
+
+    def __init__(self, run_command, parse_file_data, memory_limit=None):
+        if memory_limit is None:
+            memory_limit = AnalysisServer.default_memory_limit
+
+        self.run_command = run_command
+        self.parse_file_data = parse_file_data
+        self.memory_limit = memory_limit
+        # Warm datasets by (data directories, recursive), least recently
+        # used first
+        self.datasets = collections.OrderedDict()
+        self.stopped = False
+        self.token = secrets.token_hex(32)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def parse_address(address):
+        # Parses [host:]port into (host, port), on localhost by default
+
+        host, separator, port = address.rpartition(":")
+        if not port.isdigit():
+            raise ValueError("invalid server address, expected " + \
+                    "[host:]port: %s" % address)
+
+        return host or AnalysisServer.default_host, int(port)
+
+#-------------------------------------------------------------------------------
+    def serve(self, host, port):
+        # Serves the commands sent to host:port until stopped
+
+        httpd = http.server.HTTPServer((host, port), AnalysisRequestHandler)
+        httpd.analysis_server = self
+        token_path = AnalysisServer.write_token(httpd.server_port, \
+                self.token)
+
+        logging.info(LoadAnalysisLib.line_break)
+        logging.info("Analysis server listening on http://%s:%s" % \
+                (host, httpd.server_port))
+        logging.info("Token of the server written to: %s" % token_path)
+
+        try:
+            while not self.stopped:
+                httpd.handle_request()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+            try:
+                os.remove(token_path)
+            except OSError:
+                pass
+
+        logging.info("Stopped the analysis server")
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def write_token(port, token):
+        # Writes the token of the server on port to its token file, which
+        # only the user can read. Returns the path of the file
+
+        token_path = os.path.expanduser(AnalysisServer.token_path % port)
+        os.makedirs(os.path.dirname(token_path), mode=0o700, exist_ok=True)
+
+        token_fd = os.open(token_path, os.O_WRONLY | os.O_CREAT | \
+                os.O_TRUNC, 0o600)
+        # The file may be left over from a server of another umask
+        os.fchmod(token_fd, 0o600)
+        with os.fdopen(token_fd, "w") as token_file:
+            token_file.write(token)
+
+        return token_path
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def read_token(url):
+        # Reads the token of the server at url from its token file
+
+        port = urllib.parse.urlsplit(url).port
+        with open(os.path.expanduser(AnalysisServer.token_path % port)) as \
+                token_file:
+            return token_file.read().strip()
+
+#-------------------------------------------------------------------------------
+    def run(self, argv, cwd):
+        # Runs a command line in the directory cwd, returning its exit status
+        # & log lines
+
+        capture = LogCapture()
+        output = io.StringIO()
+        root_logger = logging.getLogger()
+        logging_level = root_logger.level
+        previous_cwd = os.getcwd()
+        status = 0
+
+        root_logger.addHandler(capture)
+        try:
+            # optparse writes its errors & help to stdout/stderr
+            with contextlib.redirect_stdout(output), \
+                    contextlib.redirect_stderr(output):
+                os.chdir(cwd)
+                self.run_command(self, argv)
+        except SystemExit as e:
+            status = e.code
+            if not isinstance(status, int):
+                status = 0 if status is None else 1
+        except Exception:
+            logging.error("Command failed: %s\n%s" % (" ".join(argv), \
+                    traceback.format_exc()))
+            status = 1
+        finally:
+            os.chdir(previous_cwd)
+            root_logger.removeHandler(capture)
+            root_logger.setLevel(logging_level)
+            Diagnostics.refresh()
+            AnalysisServer.reset_state()
+
+        return {"status": status, \
+                "log": capture.lines + output.getvalue().splitlines()}
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def reset_state():
+        # Undoes what a command set up for itself, so the next one starts
+        # from scratch
+
+        ResultsWriter.close()
+        LoadAnalysisLib.output_to_file = False
+        Utils.filepath = None
+        Profiler.disable()
+        Diagnostics.counters.clear()
+
+        # The plots draw on the current figure
+        if Utils.pyplot is not None:
+            Utils.pyplot.close('all')
+
+#-------------------------------------------------------------------------------
+    def load_file_data(self, parser, options, args):
+        # Returns the file data of the data directories given, reparsing the
+        # files changed since the last command over them. Each command gets
+        # its own FileData views of the warm columns, which it may trim,
+        # named relative to its directory like in a regular run
+
+        key = (tuple(os.path.abspath(arg) for arg in args), \
+                bool(options.recursive))
+
+        # Now the most recently used
+        dataset = self.datasets.pop(key, None)
+        if dataset is None:
+            dataset = WarmDataset(*key)
+        self.datasets[key] = dataset
+
+        prefixes = AnalysisServer.get_prefixes(args, dataset.data_dirs)
+        self.reload(dataset, parser, options, prefixes)
+        self.evict()
+
+        file_data = dataset.file_data
+        file_ids = AnalysisServer.rename_files([file_data_entry.file_id \
+                for file_data_entry in file_data], prefixes, False)
+        return FileDataSet(file_ids, file_data.timestamps, \
+                file_data.deltas, file_data.offsets)
+
+#-------------------------------------------------------------------------------
+    def reload(self, dataset, parser, options, prefixes):
+        # Reparses the files of a dataset that were changed or added since
+        # it was last loaded & drops the removed ones. Files are parsed by
+        # the names the command gives them (see get_prefixes), so they are
+        # reported like in a regular run, but kept by their absolute paths,
+        # which every command shares
+
+        signatures = collections.OrderedDict()
+        for data_dir in dataset.data_dirs:
+            for dirname, filename in Utils.get_dir_listing(data_dir, \
+                    dataset.recursive):
+                filepath = Utils.fix_filepath(dirname, filename)
+                stat = os.stat(filepath)
+                signatures[filepath] = (stat.st_size, stat.st_mtime_ns)
+
+        changed_filepaths = [filepath \
+                for filepath, signature in signatures.items() \
+                if filepath not in dataset.sources or \
+                dataset.sources[filepath][0] != signature]
+        total_removed = len(set(dataset.sources) - set(signatures))
+        if not changed_filepaths and not total_removed:
+            logging.debug("Warm file data is up to date")
+            return
+
+        if not dataset.sources:
+            # First load, parsed like a regular run
+            filepaths = [prefix for absolute_prefix, prefix in prefixes]
+        else:
+            filepaths = AnalysisServer.rename_files(changed_filepaths, \
+                    prefixes, False)
+        parsed_file_data = self.parse_file_data(parser, options, filepaths)
+        parsed_file_data = FileDataSet(AnalysisServer.rename_files(\
+                [file_data.file_id for file_data in parsed_file_data], \
+                prefixes, True), parsed_file_data.timestamps, \
+                parsed_file_data.deltas, parsed_file_data.offsets)
+
+        # The file data of each file (or archive) listed, old or new
+        parsed_groups = AnalysisServer.group_file_data(parsed_file_data, \
+                changed_filepaths)
+        groups = {}
+        start = 0
+        for filepath, (signature, total_files) in dataset.sources.items():
+            groups[filepath] = dataset.file_data[start:start + total_files]
+            start += total_files
+        groups.update(parsed_groups)
+
+        file_data_list = [file_data for filepath in signatures \
+                for file_data in groups[filepath]]
+        dataset.file_data = FileDataSet.pack(file_data_list)
+        dataset.sources = collections.OrderedDict((filepath, \
+                (signature, len(groups[filepath]))) \
+                for filepath, signature in signatures.items())
+
+        logging.info(LoadAnalysisLib.line_break)
+        logging.info("Warm file data: %s file(s) parsed, %s removed, " \
+                "%s in total (%.1f MB)" % (len(changed_filepaths), \
+                total_removed, len(signatures), \
+                dataset.nbytes() / 1024.0 ** 2))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def get_prefixes(args, data_dirs):
+        # Returns the (absolute prefix, prefix) of the files of each data
+        # directory: the start of their paths when listed from its absolute
+        # path & from the data directory as given in args, which is how a
+        # regular run names them
+
+        prefixes = []
+        for arg, data_dir in zip(args, data_dirs):
+            if os.path.isdir(data_dir):
+                prefixes.append((Utils.fix_filepath(data_dir, ""), \
+                        Utils.fix_filepath(arg, "")))
+            else:
+                # A file given on its own (see Utils.get_dir_listing)
+                dirname, filename = os.path.split(arg)
+                prefixes.append((data_dir, \
+                        Utils.fix_filepath(dirname or ".", filename)))
+
+        return prefixes
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def rename_files(filepaths, prefixes, absolute):
+        # Swaps the prefix of each filepath for its absolute prefix if
+        # absolute is set, or back otherwise. Filepaths are in order of data
+        # directory, like they are listed
+
+        source, target = (1, 0) if absolute else (0, 1)
+
+        renamed_filepaths = []
+        index = 0
+        for filepath in filepaths:
+            while not filepath.startswith(prefixes[index][source]):
+                index += 1
+            renamed_filepaths.append(prefixes[index][target] + \
+                    filepath[len(prefixes[index][source]):])
+
+        return renamed_filepaths
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def group_file_data(file_data_list, filepaths):
+        # Splits the file data parsed out of filepaths (in order) by the
+        # file or archive it came from
+
+        groups = dict((filepath, []) for filepath in filepaths)
+        filepaths = iter(filepaths)
+        filepath = None
+
+        for file_data in file_data_list:
+            # Members of archives are named after the archive
+            while filepath is None or (file_data.file_id != filepath and \
+                    not file_data.file_id.startswith(filepath + "/")):
+                filepath = next(filepaths)
+            groups[filepath].append(file_data)
+
+        return groups
+
+#-------------------------------------------------------------------------------
+    def evict(self):
+        # Drops the least recently used datasets while over the memory
+        # limit, keeping the one in use
+
+        while len(self.datasets) > 1 and \
+                self.get_memory_use() > self.memory_limit:
+            key, dataset = self.datasets.popitem(last=False)
+            logging.info("Dropped the warm file data of: %s" % \
+                    ", ".join(dataset.data_dirs))
+
+        if self.get_memory_use() > self.memory_limit:
+            logging.warning("The file data in use alone exceeds the " + \
+                    "memory limit of the analysis server")
+
+#-------------------------------------------------------------------------------
+    def get_memory_use(self):
+        # Memory held by the warm datasets, in bytes
+
+        return sum(dataset.nbytes() for dataset in self.datasets.values())
+
+#-------------------------------------------------------------------------------
+    def get_status(self):
+        # The warm datasets & memory use of the server
+
+        return {"datasets": [{"data_dirs": list(dataset.data_dirs), \
+                "recursive": dataset.recursive, \
+                "files": len(dataset.file_data), \
+                "rows": len(dataset.file_data.deltas), \
+                "memory_mb": dataset.nbytes() / 1024.0 ** 2} \
+                for dataset in reversed(list(self.datasets.values()))], \
+                "memory_mb": self.get_memory_use() / 1024.0 ** 2, \
+                "memory_limit_mb": self.memory_limit / 1024.0 ** 2}
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def send_command(url, argv):
+        # Runs a command line on the server at url, from the current
+        # directory. Returns the exit status & log lines of the command
+
+        request = urllib.request.Request(url.rstrip("/") + "/command", \
+                json.dumps({"argv": argv, "cwd": os.getcwd()}).encode(), \
+                {"Content-Type": "application/json", \
+                "Authorization": "Bearer " + AnalysisServer.read_token(url)})
+
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read().decode())
+
+#-------------------------------------------------------------------------------
+
+class AnalysisRequestHandler(http.server.BaseHTTPRequestHandler):
+    # HTTP interface of the AnalysisServer:
+    #   POST /command   {"argv": [...], "cwd": "..."} runs a command line,
+    #                   answering {"status": exit status, "log": [lines]}
+    #   GET /status     lists the warm datasets & the memory they use
+    #   POST /shutdown  stops the server
+    # Every request needs an "Authorization: Bearer <token>" header holding
+    # the token of the server, & every POST an application/json body, which
+    # web pages can't send to another origin without the server's consent
+
+    def do_GET(self):
+        if not self.is_authorized():
+            self.send_error(403, "Missing or wrong token")
+            return
+        if self.path != "/status":
+            self.send_error(404)
+            return
+
+        self.send_json(self.server.analysis_server.get_status())
+
+    def do_POST(self):
+        analysis_server = self.server.analysis_server
+
+        if not self.is_authorized():
+            self.send_error(403, "Missing or wrong token")
+            return
+        if self.headers.get_content_type() != "application/json":
+            self.send_error(415, "Expected an application/json request")
+            return
+
+        if self.path == "/shutdown":
+            analysis_server.stopped = True
+            self.send_json({"status": 0, "log": []})
+            return
+        if self.path != "/command":
+            self.send_error(404)
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode())
+            argv = [str(arg) for arg in request["argv"]]
+            cwd = request.get("cwd") or os.getcwd()
+        except (ValueError, KeyError, TypeError):
+            self.send_error(400)
+            return
+
+        self.send_json(analysis_server.run(argv, cwd))
+
+    def is_authorized(self):
+        # Checks the token sent, in constant time
+
+        authorization = self.headers.get("Authorization", "").encode()
+        return hmac.compare_digest(authorization, \
+                ("Bearer " + self.server.analysis_server.token).encode())
+
+    def send_json(self, response):
+        body = json.dumps(response).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("%s - " + format, self.address_string(), *args)
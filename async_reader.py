@@ -0,0 +1,147 @@
+import os
+import asyncio
+import logging
+import concurrent.futures
+from data_parser import DataParser
+from data_cache import DataCache
+from compressed_input import CompressedInput
+
+class ByteBudget:
+    # Amount of bytes that may be held at once by the reads in flight
+
+    __slots__ = ("capacity", "available", "condition")
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.available = capacity
+        self.condition = asyncio.Condition()
+
+    async def acquire(self, amount):
+        # Waits until amount bytes are available & takes them. Amounts over
+        # the capacity are capped, so a file bigger than the whole budget is
+        # still read, only on its own. Returns the amount taken
+
+        amount = min(amount, self.capacity)
+
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.available >= amount)
+            self.available -= amount
+
+        return amount
+
+    async def release(self, amount):
+        # Gives back bytes taken by acquire
+
+        async with self.condition:
+            self.available += amount
+            self.condition.notify_all()
+
+class AsyncReader:
+    # Reads & parses data files through an asyncio pipeline, for storage
+    # where every request pays a round trip (e.g. NFS). A bounded pool of
+    # threads stats & reads the files concurrently while another thread
+    # parses the ones already read. A ByteBudget caps the amount of data
+    # read but not parsed yet, so readers wait on the parser instead of
+    # filling up memory
+
+    # Default amount of reading threads
+    threads = 8
+    # Default amount of bytes read ahead of the parser
+    max_buffered = 256 * 1024 * 1024
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def parse_files(filepaths, threads=None, max_buffered=None, \
+            use_cache=False, rebuild_cache=False):
+        # Returns the (timestamps, deltas, total_headers_found) of each file,
+        # in order, like mapping DataParser.parse_file (or DataCache.parse_file
+        # if use_cache is set) over the filepaths would
+
+        if threads is None:
+            threads = AsyncReader.threads
+        if max_buffered is None:
+            max_buffered = AsyncReader.max_buffered
+
+        return asyncio.run(AsyncReader.parse_files_async(filepaths, \
+                threads, max_buffered, use_cache, rebuild_cache))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    async def parse_files_async(filepaths, threads, max_buffered, \
+            use_cache, rebuild_cache):
+        # Coroutine behind parse_files
+
+        loop = asyncio.get_running_loop()
+        budget = ByteBudget(max_buffered)
+        read_pool = concurrent.futures.ThreadPoolExecutor(threads)
+        parse_pool = concurrent.futures.ThreadPoolExecutor(1)
+
+        try:
+            # Stat every file up front, overlapping the metadata round trips
+            stats = await asyncio.gather(*[loop.run_in_executor(read_pool, \
+                    os.stat, filepath) for filepath in filepaths])
+
+            # Start the reads in order, as the budget allows
+            tasks = []
+            for filepath, stat in zip(filepaths, stats):
+                amount = await budget.acquire(stat.st_size)
+                tasks.append(asyncio.ensure_future(AsyncReader.parse_file(\
+                        filepath, stat, amount, budget, read_pool, \
+                        parse_pool, use_cache, rebuild_cache)))
+
+            return await asyncio.gather(*tasks)
+        finally:
+            read_pool.shutdown()
+            parse_pool.shutdown()
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    async def parse_file(filepath, stat, amount, budget, read_pool, \
+            parse_pool, use_cache, rebuild_cache):
+        # Reads & parses a file, or loads its cache entry, then gives back
+        # the bytes it took from the budget
+
+        loop = asyncio.get_running_loop()
+        cache_path = DataCache.get_cache_path(filepath)
+        parsed_file = None
+
+        try:
+            if use_cache and not rebuild_cache:
+                parsed_file = await loop.run_in_executor(read_pool, \
+                        DataCache.load, cache_path, stat)
+
+            if parsed_file is None:
+                logging.debug("Reading file: %s", filepath)
+                data = await loop.run_in_executor(read_pool, \
+                        AsyncReader.read_file, filepath)
+                parsed_file = await loop.run_in_executor(parse_pool, \
+                        AsyncReader.parse_data, data, filepath)
+                del data
+
+                if use_cache:
+                    await loop.run_in_executor(read_pool, DataCache.store, \
+                            cache_path, stat, parsed_file)
+        finally:
+            await budget.release(amount)
+
+        return parsed_file
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def parse_data(data, filepath):
+        # Parses the contents read from filepath, decompressing them first
+        # if it is a compressed file
+
+        if CompressedInput.is_compressed(filepath):
+            return CompressedInput.parse_data(data, filepath)
+
+        return DataParser.parse_data(data)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def read_file(filepath):
+        # Reads the whole file in one request
+
+        with open(filepath, "rb") as file_input:
+            return file_input.read()
+
+#-------------------------------------------------------------------------------
@@ -0,0 +1,536 @@
+#!/usr/bin/env python
+#-------------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import optparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import logging
+import numpy
+from utils import Utils
+from objects import FileDataSet
+from diagnostics import Diagnostics
+from load_analysis_lib import LoadAnalysisLib
+
+class Benchmark:
+    # Reproducible benchmark of the parsing & statistics of load_analysis.
+    # Synthetic data directories are generated from a seed, then the whole
+    # load_analysis.py pipeline & each LoadAnalysisLib stage are timed at
+    # several scales. Every measurement is appended as a JSON line to a
+    # results file, so runs of different versions can be compared
+
+    # Amount of files & rows per file of each scale
+    scales = {"small": (4, 10000),
+              "medium": (8, 100000),
+              "large": (16, 1000000),
+              "files": (5000, 200)}
+    # Timestamp offset between the files of a scale, in place of --skew.
+    # The files of the files scale are too short to be offset & trimmed
+    scale_skews = {"files": 0}
+    # Logging levels the per file stages are timed at by run_logging
+    logging_levels = [("off", None), ("info", logging.INFO), \
+            ("debug", logging.DEBUG)]
+    # Least amount of runs per measurement of run_logging, whose stages
+    # take milliseconds
+    logging_repeats = 20
+    default_results_file = "results/benchmark.jsonl"
+    # Mean & std of the generated deltas & how far off outliers land
+    delta_mean = 100
+    delta_std = 20
+    outlier_factor = 50
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def generate_data_dir(directory, total_files, rows_per_file, skew=1000, \
+            header_noise=0.0, outlier_rate=0.0, seed=0):
+        # Writes total_files synthetic data files to directory. Each starts
+        # with a header & holds rows_per_file increasing timestamps with
+        # their deltas. The first timestamp of file i is i * skew, a
+        # header_noise fraction of the rows are followed by a garbage line &
+        # an outlier_rate fraction of the deltas are outliers. The same
+        # arguments always produce the same files
+
+        random = numpy.random.default_rng(seed)
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        for file_index in range(total_files):
+            timestamps = file_index * skew + \
+                    numpy.cumsum(random.integers(1, 10, rows_per_file))
+            deltas = numpy.abs(random.normal(Benchmark.delta_mean, \
+                    Benchmark.delta_std, rows_per_file)).astype(numpy.int64)
+
+            outliers = random.random(rows_per_file) < outlier_rate
+            deltas[outliers] *= Benchmark.outlier_factor
+
+            noise_rows = numpy.flatnonzero(\
+                    random.random(rows_per_file) < header_noise)
+            columns = numpy.column_stack((timestamps, deltas))
+
+            filepath = os.path.join(directory, "host%03d.txt" % file_index)
+            with open(filepath, "w") as data_file:
+                data_file.write("timestamp delta\n")
+
+                start = 0
+                for noise_row in noise_rows:
+                    Benchmark.write_rows(data_file, \
+                            columns[start:noise_row + 1])
+                    data_file.write("timestamp delta\n")
+                    start = noise_row + 1
+                Benchmark.write_rows(data_file, columns[start:])
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def write_rows(data_file, columns, rows_per_write=100000):
+        # Writes the rows of a 2 column array, formatting a batch of rows
+        # per string operation (several times faster than numpy.savetxt)
+
+        for start in range(0, len(columns), rows_per_write):
+            rows = columns[start:start + rows_per_write]
+            data_file.write(("%d %d\n" * len(rows)) % tuple(rows.ravel()))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def get_data_dir(root, scale, options):
+        # Generates the data directory of a scale under root, unless an
+        # earlier run already did
+
+        total_files, rows_per_file = Benchmark.scales[scale]
+        skew = Benchmark.scale_skews.get(scale, int(options.skew))
+        name = "%s-%s-%s-%s-%s-%s" % (scale, skew, \
+                options.header_noise, options.outlier_rate, options.seed, \
+                total_files * rows_per_file)
+        directory = os.path.join(root, name)
+        done_marker = os.path.join(root, name + ".done")
+
+        if not os.path.exists(done_marker):
+            logging.info("Generating %s data: %s files of %s rows" % \
+                    (scale, total_files, rows_per_file))
+            Benchmark.generate_data_dir(directory, total_files, \
+                    rows_per_file, skew, \
+                    float(options.header_noise), \
+                    float(options.outlier_rate), int(options.seed))
+            open(done_marker, "w").close()
+
+        return directory
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def time_stage(run_stage, repeats):
+        # Returns the best wall time of run_stage over repeats runs & the
+        # peak memory it allocates, traced in one more run
+
+        best_time = None
+        for repeat in range(repeats):
+            start = time.perf_counter()
+            run_stage()
+            elapsed = time.perf_counter() - start
+
+            if best_time is None or elapsed < best_time:
+                best_time = elapsed
+
+        tracemalloc.start()
+        try:
+            run_stage()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024.0 ** 2
+        finally:
+            tracemalloc.stop()
+
+        return best_time, peak_mb
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def run_stages(directory, cleanup_level, repeats):
+        # Times each LoadAnalysisLib stage in process, each one fed the
+        # output of the previous one like main() does
+
+        measurements = []
+        parse = lambda: LoadAnalysisLib.parse_data_files([directory])
+
+        all_file_data = parse()
+        median, std = LoadAnalysisLib.analyze(all_file_data, "original")
+        clean_file_data = LoadAnalysisLib.cleanup_file_data(all_file_data, \
+                cleanup_level, median, std)
+
+        # Each trim gets its own FileData, as trimming replaces their columns
+        clean_file_ids = [file_data.file_id for file_data in clean_file_data]
+        copy_clean_file_data = lambda: FileDataSet(clean_file_ids, \
+                clean_file_data.timestamps, clean_file_data.deltas, \
+                clean_file_data.offsets)
+        trimmed_file_data = LoadAnalysisLib.trim_lists_by_common_threshold(\
+                copy_clean_file_data())
+
+        stage_runs = [
+            ("parse", all_file_data, parse),
+            ("analyze", all_file_data, \
+                lambda: LoadAnalysisLib.analyze(all_file_data, "original")),
+            ("histogram", all_file_data, \
+                lambda: LoadAnalysisLib.compute_histogram(all_file_data)),
+            ("file_stats", all_file_data, \
+                lambda: LoadAnalysisLib.compute_file_statistics(\
+                all_file_data)),
+            ("cleanup", all_file_data, \
+                lambda: LoadAnalysisLib.cleanup_file_data(all_file_data, \
+                cleanup_level, median, std)),
+            ("trim", clean_file_data, \
+                lambda: LoadAnalysisLib.trim_lists_by_common_threshold(\
+                copy_clean_file_data())),
+            ("stds", trimmed_file_data, \
+                lambda: LoadAnalysisLib.compute_mean_of_file_data_stds(\
+                trimmed_file_data))]
+
+        for stage, file_data_list, run_stage in stage_runs:
+            seconds, peak_mb = Benchmark.time_stage(run_stage, repeats)
+            rows = sum(len(file_data.deltas) for file_data in file_data_list)
+            measurements.append((stage, rows, seconds, peak_mb))
+
+        return measurements
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def run_logging(directory, cleanup_level, repeats):
+        # Times the stages looping over the files at each of logging_levels,
+        # logging to os.devnull ("off" disables logging altogether), to
+        # measure what the logging of the hot paths costs. Returns a
+        # measurement per stage & level
+
+        all_file_data = LoadAnalysisLib.parse_data_files([directory])
+        median, std = LoadAnalysisLib.analyze(all_file_data, "original")
+        rows = len(all_file_data.deltas)
+
+        # Each trim gets its own FileData, as trimming replaces their columns
+        file_ids = [file_data.file_id for file_data in all_file_data]
+        copy_file_data = lambda: FileDataSet(file_ids, \
+                all_file_data.timestamps, all_file_data.deltas, \
+                all_file_data.offsets)
+
+        stage_runs = [
+            ("list", lambda: Utils.get_dir_listing(directory)),
+            ("thresholds", lambda: LoadAnalysisLib.compute_common_thresholds(\
+                all_file_data, True)),
+            ("cleanup", lambda: LoadAnalysisLib.cleanup_file_data(\
+                all_file_data, cleanup_level, median, std)),
+            ("trim", lambda: LoadAnalysisLib.trim_lists_by_common_threshold(\
+                copy_file_data())),
+            ("debug_dump", lambda: LoadAnalysisLib.log_debug_file_data(\
+                "original", all_file_data))]
+
+        root_logger = logging.getLogger()
+        handlers = root_logger.handlers[:]
+        logging_level = root_logger.level
+        measurements = []
+
+        with open(os.devnull, "w") as devnull:
+            output_handler = logging.StreamHandler(devnull)
+            root_logger.handlers = [output_handler]
+            try:
+                for level_name, level in Benchmark.logging_levels:
+                    if level is None:
+                        logging.disable(logging.CRITICAL)
+                    else:
+                        logging.disable(logging.NOTSET)
+                        root_logger.setLevel(level)
+                    Diagnostics.refresh()
+
+                    for stage, run_stage in stage_runs:
+                        seconds, peak_mb = Benchmark.time_stage(run_stage, \
+                                repeats)
+                        Diagnostics.flush(stage)
+                        measurements.append(("%s:%s" % (stage, level_name), \
+                                rows, seconds, peak_mb))
+            finally:
+                logging.disable(logging.NOTSET)
+                root_logger.handlers = handlers
+                root_logger.setLevel(logging_level)
+                Diagnostics.refresh()
+
+        return measurements
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def run_main(directory, cleanup_level, repeats):
+        # Times the whole load_analysis.py pipeline in a fresh interpreter,
+        # startup included. The peak RSS comes from its --profile-json
+        # report
+
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+                "load_analysis.py")
+        fd, report_path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+
+        command = [sys.executable, script, "--no-cache", "-c", \
+                str(cleanup_level), "--profile-json", report_path, directory]
+
+        best_time = None
+        try:
+            for repeat in range(repeats):
+                start = time.perf_counter()
+                subprocess.check_call(command, stdout=subprocess.DEVNULL, \
+                        stderr=subprocess.DEVNULL)
+                elapsed = time.perf_counter() - start
+
+                if best_time is None or elapsed < best_time:
+                    best_time = elapsed
+
+            with open(report_path) as report_file:
+                report = json.load(report_file)
+        finally:
+            os.remove(report_path)
+
+        rows = report["phases"][0]["rows"]
+
+        return rows, best_time, report["total"]["peak_rss_mb"]
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def run_startup(repeats):
+        # Times the startup of load_analysis in fresh interpreters: importing
+        # its modules & printing its --help, which loads no data. Returns a
+        # measurement per command, with the best of repeats runs
+
+        directory = os.path.dirname(os.path.abspath(__file__))
+        commands = [
+            ("bare", [sys.executable, "-c", "pass"]),
+            ("import", [sys.executable, "-c", "import load_analysis"]),
+            ("help", [sys.executable, os.path.join(directory, \
+                "load_analysis.py"), "--help"])]
+
+        measurements = []
+        for stage, command in commands:
+            best_time = None
+            for repeat in range(repeats):
+                start = time.perf_counter()
+                subprocess.check_call(command, cwd=directory, \
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                elapsed = time.perf_counter() - start
+
+                if best_time is None or elapsed < best_time:
+                    best_time = elapsed
+
+            measurements.append((stage, best_time))
+
+        return measurements
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def get_revision():
+        # Git revision of the code being benchmarked, if known
+
+        try:
+            return subprocess.check_output(["git", "rev-parse", "--short", \
+                    "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), \
+                    stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def run(options):
+        # Runs the benchmark at each scale requested & appends the
+        # measurements to the results file
+
+        root = options.data_dir or os.path.join(tempfile.gettempdir(), \
+                "load_analysis_benchmark")
+        cleanup_level = float(options.cleanup_level)
+        repeats = int(options.repeats)
+
+        run_info = {"label": options.label, \
+                "revision": Benchmark.get_revision(), \
+                "date": time.strftime("%Y-%m-%d %H:%M:%S"), \
+                "python": platform.python_version(), \
+                "numpy": numpy.__version__, \
+                "skew": int(options.skew), \
+                "header_noise": float(options.header_noise), \
+                "outlier_rate": float(options.outlier_rate), \
+                "seed": int(options.seed)}
+
+        records = []
+        if options.startup:
+            for stage, seconds in Benchmark.run_startup(repeats):
+                records.append(dict(run_info, scale="startup", stage=stage, \
+                        rows=None, seconds=seconds, rows_per_second=None, \
+                        peak_mb=None))
+                logging.info("%-8s %-10s %9.4fs" % ("startup", stage, \
+                        seconds))
+
+        if options.logging:
+            directory = Benchmark.get_data_dir(root, "files", options)
+            measurements = Benchmark.run_logging(directory, cleanup_level, \
+                    max(repeats, Benchmark.logging_repeats))
+            seconds_off = dict((stage.split(":")[0], seconds) \
+                    for stage, rows, seconds, peak_mb in measurements \
+                    if stage.endswith(":off"))
+
+            for stage, rows, seconds, peak_mb in measurements:
+                records.append(dict(run_info, scale="logging", stage=stage, \
+                        rows=rows, seconds=seconds, \
+                        rows_per_second=rows / seconds, peak_mb=peak_mb))
+                # Overhead against the same stage with logging disabled
+                logging.info("%-8s %-17s %9.4fs %+9.4fs" % ("logging", \
+                        stage, seconds, \
+                        seconds - seconds_off[stage.split(":")[0]]))
+
+        for scale in options.scales.split(","):
+            if not scale:
+                continue
+
+            directory = Benchmark.get_data_dir(root, scale, options)
+
+            # Keep the stages quiet while they are timed
+            logging.disable(logging.ERROR)
+            try:
+                measurements = Benchmark.run_stages(directory, \
+                        cleanup_level, repeats)
+            finally:
+                logging.disable(logging.NOTSET)
+            measurements.append(("main",) + \
+                    Benchmark.run_main(directory, cleanup_level, repeats))
+
+            for stage, rows, seconds, peak_mb in measurements:
+                record = dict(run_info, scale=scale, stage=stage, rows=rows, \
+                        seconds=seconds, rows_per_second=rows / seconds, \
+                        peak_mb=peak_mb)
+                records.append(record)
+                logging.info("%-8s %-10s %10s rows %9.4fs %14.0f rows/s " \
+                        "%9.1f MB" % (scale, stage, rows, seconds, \
+                        record["rows_per_second"], peak_mb))
+
+        with open(options.results_file, "a") as results_file:
+            for record in records:
+                results_file.write(json.dumps(record) + "\n")
+        logging.info("Results appended to: %s" % options.results_file)
+
+        return records
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def load_results(filepath, label=None):
+        # Returns the latest record of each (scale, stage) in a results file,
+        # only considering the records of label if given
+
+        latest = {}
+        with open(filepath) as results_file:
+            for line in results_file:
+                record = json.loads(line)
+                if label is None or record["label"] == label:
+                    latest[(record["scale"], record["stage"])] = record
+
+        return latest
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def compare(baseline_records, records):
+        # Logs the speedup of each measurement over the baseline
+
+        logging.info("%-8s %-10s %14s %14s %8s" % ("scale", "stage", \
+                "baseline rows/s", "rows/s", "speedup"))
+
+        for key in sorted(records):
+            if key not in baseline_records:
+                continue
+
+            # Startup measurements have no rows, their speedup comes from
+            # their times
+            if records[key]["rows_per_second"] is None:
+                baseline = baseline_records[key]["seconds"]
+                current = records[key]["seconds"]
+                logging.info("%-8s %-10s %13.4fs %13.4fs %7.2fx" % (key[0], \
+                        key[1], baseline, current, baseline / current))
+                continue
+
+            baseline = baseline_records[key]["rows_per_second"]
+            current = records[key]["rows_per_second"]
+            logging.info("%-8s %-10s %14.0f %14.0f %7.2fx" % (key[0], key[1], \
+                    baseline, current, current / baseline))
+
+#-------------------------------------------------------------------------------
+def setup_parser_options():
+    # Create parser flag options
+
+    parser = optparse.OptionParser("usage: %prog [options]" + \
+            "\n\nDescription:" + \
+            "\n------------" + \
+            "\n'%prog' times load_analysis on generated data at several " + \
+            "\nscales & appends the results to a file that can be " + \
+            "\ncompared across versions.")
+    parser.add_option('--scales', dest="scales", default="small,medium",
+            help="Comma separated scales to run: " + \
+                ", ".join("%s (%s files x %s rows)" % ((scale,) + \
+                Benchmark.scales[scale]) for scale in ["small", "medium", \
+                "large", "files"]) + ". The files of the files scale " + \
+                "start together. Default is small,medium, an empty " + \
+                "value runs none")
+    parser.add_option('--startup', dest="startup", action="store_true",
+            default=False, help="Also time the startup of load_analysis: " + \
+                "a bare interpreter, importing it & printing its --help")
+    parser.add_option('--logging', dest="logging", action="store_true",
+            default=False, help="Also time the stages looping over the " + \
+                "files of the files scale with logging off, at the info " + \
+                "(default) & at the debug level, to measure the cost of " + \
+                "the logging on the hot paths")
+    parser.add_option('--skew', dest="skew", default="1000",
+            help="Timestamp offset between the first rows of successive " + \
+                "files. Default is 1000")
+    parser.add_option('--header-noise', dest="header_noise", default="0",
+            help="Fraction of rows followed by a stray header line. " + \
+                "Default is 0")
+    parser.add_option('--outlier-rate', dest="outlier_rate", default="0.001",
+            help="Fraction of deltas that are outliers. Default is 0.001")
+    parser.add_option('--seed', dest="seed", default="0",
+            help="Seed of the data generator. Default is 0")
+    parser.add_option('-c', '--cleanup-level', dest="cleanup_level",
+            default="2", help="Cleanup level used. Default is 2")
+    parser.add_option('--repeats', dest="repeats", default="3",
+            help="Runs per measurement, the best one is kept. Default is 3")
+    parser.add_option('--data-dir', dest="data_dir",
+            help="Where the generated data is kept between runs. Default " + \
+                "is a directory in the system's temp directory")
+    parser.add_option('--label', dest="label",
+            help="Label stored with the results, e.g. the version tested")
+    parser.add_option('--results-file', dest="results_file",
+            default=Benchmark.default_results_file,
+            help="JSON lines file the results are appended to. Default " + \
+                "is " + Benchmark.default_results_file)
+    parser.add_option('--compare', dest="compare",
+            help="Compare the results of this run with the latest ones " + \
+                "found in this results file (of --compare-label, if given)")
+    parser.add_option('--compare-label', dest="compare_label",
+            help="Label of the baseline results to compare with")
+
+    return parser
+
+#-------------------------------------------------------------------------------
+def main():
+
+    parser = setup_parser_options()
+    (options, args) = parser.parse_args()
+
+    for scale in options.scales.split(","):
+        if scale and scale not in Benchmark.scales:
+            parser.error("unknown scale: %s" % scale)
+
+    logging.basicConfig(level=logging.INFO,
+        format='%(asctime)s %(levelname)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S')
+
+    # Read the baseline before this run's results are appended to the file
+    baseline_records = None
+    if options.compare:
+        baseline_records = Benchmark.load_results(options.compare, \
+                options.compare_label)
+
+    records = Benchmark.run(options)
+
+    if baseline_records is not None:
+        Benchmark.compare(baseline_records, dict(((record["scale"], \
+                record["stage"]), record) for record in records))
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    main()
+
+#-------------------------------------------------------------------------------
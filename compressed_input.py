@@ -0,0 +1,258 @@
+import io
+import os
+import gzip
+import lzma
+import queue
+import itertools
+import threading
+from data_parser import DataParser
+from diagnostics import Diagnostics
+
+try:
+    import zstandard
+except ImportError:
+    # Optional, only needed to read .zst files
+    zstandard = None
+
+class CompressedInput:
+    # Reads gzip, xz & zstd compressed data files, & tar archives of data
+    # files, straight into the parser without temporary files. Given a spare
+    # CPU, a thread decompresses the next chunks while the current ones are
+    # tokenized (the decompressors release the GIL), queueing at most
+    # prefetch chunks ahead of the parser so memory stays bounded
+
+    # Compression of each extension, archives included
+    compressions = {".gz": "gz", ".tgz": "gz", ".xz": "xz", ".txz": "xz", \
+            ".zst": "zst", ".tzst": "zst"}
+    archive_extensions = (".tar", ".tar.gz", ".tgz", ".tar.xz", ".txz", \
+            ".tar.zst", ".tzst")
+    # Decompressed chunks queued ahead of the parser
+    prefetch = 4
+    # Decompress in a thread of its own, which only pays off with more than
+    # one CPU to run it on
+    threaded = (os.cpu_count() or 1) > 1
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def get_compression(filepath):
+        # Compression of a file from its extension: gz, xz, zst or None
+
+        return CompressedInput.compressions.get(\
+                os.path.splitext(filepath)[1].lower())
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def is_compressed(filepath):
+        # Whether a file is a single compressed data file (not an archive)
+
+        return CompressedInput.get_compression(filepath) is not None and \
+                not CompressedInput.is_archive(filepath)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def is_archive(filepath):
+        # Whether a file is a tar archive, compressed or not
+
+        return filepath.lower().endswith(CompressedInput.archive_extensions)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def open_file(filepath, fileobj=None):
+        # Opens a decompressing binary stream over a file, or over the
+        # compressed bytes of fileobj if given. Uncompressed files (e.g.
+        # plain .tar archives) are opened as is
+
+        compression = CompressedInput.get_compression(filepath)
+
+        if compression == "gz":
+            if fileobj is not None:
+                return gzip.GzipFile(fileobj=fileobj, mode="rb")
+            return gzip.open(filepath, "rb")
+        if compression == "xz":
+            return lzma.open(fileobj if fileobj is not None else filepath, \
+                    "rb")
+        if compression == "zst":
+            if zstandard is None:
+                raise IOError("The zstandard module is needed to read " + \
+                        "%s: pip install zstandard" % filepath)
+            if fileobj is None:
+                fileobj = open(filepath, "rb")
+            # Frames of concatenated files are all read, like gzip does
+            return zstandard.ZstdDecompressor().stream_reader(fileobj, \
+                    read_across_frames=True, closefd=True)
+
+        if fileobj is not None:
+            return fileobj
+        return open(filepath, "rb")
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def iter_blocks(filepath, fileobj=None):
+        # Same as DataParser.iter_blocks, for a compressed file (or its
+        # compressed bytes in fileobj)
+
+        chunks = CompressedInput.iter_prefetched(\
+                CompressedInput.read_chunks(filepath, fileobj))
+
+        for parsed_block in DataParser.iter_chunk_blocks(chunks):
+            yield parsed_block
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def parse_file(filepath):
+        # Same as DataParser.parse_file, for a compressed file
+
+        return DataParser.join_blocks(CompressedInput.iter_blocks(filepath))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def parse_data(data, filepath):
+        # Same as DataParser.parse_data, for the compressed contents of
+        # filepath already read into memory
+
+        return DataParser.join_blocks(CompressedInput.iter_blocks(filepath, \
+                io.BytesIO(data)))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def read_chunks(filepath, fileobj=None):
+        # Yields the decompressed contents of a file chunk by chunk
+
+        stream = CompressedInput.open_file(filepath, fileobj)
+        try:
+            while True:
+                chunk = stream.read(DataParser.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            stream.close()
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def iter_archive(filepath):
+        # Parses each regular file of a tar archive in a single pass over
+        # it, yielding the member's name & its (timestamps, deltas,
+        # total_headers_found), in archive order
+
+        items = CompressedInput.iter_prefetched(\
+                CompressedInput.read_archive(filepath))
+
+        for member_name, chunk in items:
+            chunks = iter(())
+            if chunk is not None:
+                chunks = itertools.chain([chunk], \
+                        CompressedInput.iter_member_chunks(items))
+
+            yield member_name, DataParser.join_blocks(\
+                    DataParser.iter_chunk_blocks(chunks))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def read_archive(filepath):
+        # Yields (member name, chunk) for the decompressed contents of each
+        # data file of a tar archive, ending each member with a None chunk.
+        # Files under hidden directories (e.g. a parse cache) are skipped
+
+        import tarfile
+
+        stream = CompressedInput.open_file(filepath)
+        try:
+            # Stream mode reads the archive front to back without seeking
+            with tarfile.open(fileobj=stream, mode="r|") as archive:
+                for member in archive:
+                    member_name = os.path.normpath(member.name)
+                    directories = member_name.split("/")[:-1]
+                    if not member.isfile() or any(directory.startswith(".") \
+                            for directory in directories):
+                        continue
+
+                    if Diagnostics.enabled:
+                        Diagnostics.count("archived files found")
+                    member_file = archive.extractfile(member)
+                    while True:
+                        chunk = member_file.read(DataParser.chunk_size)
+                        if not chunk:
+                            break
+                        yield member_name, chunk
+                    yield member_name, None
+        finally:
+            stream.close()
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def iter_member_chunks(items):
+        # Yields the chunks of the current member of an archive, up to its
+        # closing None chunk
+
+        for member_name, chunk in items:
+            if chunk is None:
+                return
+            yield chunk
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def iter_prefetched(items):
+        # Runs the items generator in a thread & yields what it produces. At
+        # most prefetch items wait in between, pausing the thread while the
+        # consumer catches up. Errors of the thread are raised here. Unless
+        # threaded is set, the items are passed through as is
+
+        if not CompressedInput.threaded:
+            for item in items:
+                yield item
+            return
+
+        prefetched = queue.Queue(CompressedInput.prefetch)
+        stopped = threading.Event()
+        done = object()
+
+        producer = threading.Thread(target=CompressedInput.produce, \
+                args=(items, prefetched, stopped, done))
+        producer.daemon = True
+        producer.start()
+
+        try:
+            while True:
+                item, error = prefetched.get()
+                if error is not None:
+                    raise error
+                if item is done:
+                    break
+                yield item
+        finally:
+            # Lets the thread stop early if the consumer stopped reading
+            stopped.set()
+            producer.join()
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def produce(items, prefetched, stopped, done):
+        # Thread of iter_prefetched: queues each item, then done (or the
+        # error raised)
+
+        try:
+            for item in items:
+                if not CompressedInput.put(prefetched, stopped, (item, None)):
+                    return
+            CompressedInput.put(prefetched, stopped, (done, None))
+        except Exception as e:
+            CompressedInput.put(prefetched, stopped, (None, e))
+        finally:
+            items.close()
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def put(prefetched, stopped, entry):
+        # Queues an entry, waiting for room unless the consumer stopped.
+        # Returns whether it was queued
+
+        while not stopped.is_set():
+            try:
+                prefetched.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+#-------------------------------------------------------------------------------
@@ -0,0 +1,124 @@
+import os
+import logging
+import tempfile
+import numpy
+
+class DataCache:
+    # Binary cache of the parsed columns of each data file, kept in a hidden
+    # directory next to the data. Entries are invalidated by the size & mtime
+    # of the file they were parsed from
+
+    directory_name = ".load_analysis_cache"
+    extension = ".npz"
+    version = 1
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def get_cache_path(filepath):
+        # Path of the cache entry of a data file
+
+        dirname, filename = os.path.split(filepath)
+
+        return os.path.join(dirname, DataCache.directory_name, \
+                filename + DataCache.extension)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def parse_file(filepath, parse_file, rebuild=False):
+        # Returns the cached columns of the file if they are still fresh,
+        # else parses the file with parse_file & caches the result
+
+        stat = os.stat(filepath)
+        cache_path = DataCache.get_cache_path(filepath)
+
+        if not rebuild:
+            parsed_file = DataCache.load(cache_path, stat)
+            if parsed_file is not None:
+                return parsed_file
+
+        parsed_file = parse_file(filepath)
+        DataCache.store(cache_path, stat, parsed_file)
+
+        return parsed_file
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def load(cache_path, stat):
+        # Loads a cache entry, returning None if it is missing, unreadable or
+        # was made from a different version of the data file
+
+        try:
+            with numpy.load(cache_path) as entry:
+                if int(entry["version"]) != DataCache.version or \
+                        int(entry["size"]) != stat.st_size or \
+                        int(entry["mtime"]) != stat.st_mtime_ns:
+                    return None
+
+                parsed_file = entry["timestamps"], entry["deltas"], \
+                        int(entry["headers"])
+
+            # Mark the entry as recently used for the LRU eviction
+            os.utime(cache_path)
+        except (OSError, ValueError, KeyError):
+            return None
+
+        return parsed_file
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def store(cache_path, stat, parsed_file):
+        # Atomically writes a cache entry. Failing to write it (e.g. on a
+        # read-only data directory) only costs the cache
+
+        timestamps, deltas, total_headers_found = parsed_file
+        cache_dir = os.path.dirname(cache_path)
+
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, exist_ok=True)
+
+            fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as temp_file:
+                    numpy.savez(temp_file, version=DataCache.version, \
+                            size=stat.st_size, mtime=stat.st_mtime_ns, \
+                            timestamps=timestamps, deltas=deltas, \
+                            headers=total_headers_found)
+                os.replace(temp_path, cache_path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        except OSError as e:
+            logging.debug("Could not cache %s: %s", cache_path, e)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def evict(directory, max_size):
+        # Removes the least recently used entries of a directory's cache
+        # until it holds at most max_size bytes
+
+        cache_dir = os.path.join(directory, DataCache.directory_name)
+        if not os.path.isdir(cache_dir):
+            return
+
+        entries = []
+        total_size = 0
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(DataCache.extension) and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        # Oldest first
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= max_size:
+                break
+
+            logging.debug("Evicting cache entry: %s", path)
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+
+#-------------------------------------------------------------------------------
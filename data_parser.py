@@ -0,0 +1,413 @@
+import os
+import mmap
+import numpy
+
+NEWLINE = ord("\n")
+CARRIAGE_RETURN = ord("\r")
+SPACE = numpy.uint8(ord(" "))
+
+# Largest amount of digits an int64 column value can hold
+MAX_DIGITS = 19
+INT64_MAX = numpy.iinfo(numpy.int64).max
+
+class DataParser:
+    # Bytes read per block, blocks are always cut on a line boundary
+    chunk_size = 1024 * 1024
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def empty_columns():
+        # Returns empty timestamp & delta columns
+
+        return numpy.empty(0, dtype=numpy.int64), \
+                numpy.empty(0, dtype=numpy.int64)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def parse_file(filepath):
+        # Parses the timestamp & delta columns of a file into int64 arrays,
+        # block by block. Returns the columns and the total amount of lines
+        # that could not be parsed (headers)
+
+        return DataParser.join_blocks(DataParser.iter_blocks(filepath))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def parse_mapped_file(filepath):
+        # Same as parse_file, but tokenizes the blocks straight from a memory
+        # map of the file. Parsed blocks are released from the process' pages
+        # while the OS page cache keeps them around for later runs
+
+        return DataParser.join_blocks(DataParser.iter_mapped_blocks(filepath))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def iter_blocks(filepath):
+        # Reads a file block by block, yielding the timestamps, deltas &
+        # total headers found of each block. Compressed files are
+        # decompressed on the fly (see CompressedInput)
+
+        from compressed_input import CompressedInput
+        if CompressedInput.is_compressed(filepath):
+            for parsed_block in CompressedInput.iter_blocks(filepath):
+                yield parsed_block
+            return
+
+        file_input = open(filepath, "rb")
+        try:
+            chunks = iter(lambda: file_input.read(DataParser.chunk_size), b"")
+            for parsed_block in DataParser.iter_chunk_blocks(chunks):
+                yield parsed_block
+        finally:
+            file_input.close()
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def iter_chunk_blocks(chunks):
+        # Parses a stream of byte chunks cut anywhere (e.g. the output of a
+        # decompressor), yielding the timestamps, deltas & total headers
+        # found of each block of complete lines
+
+        remainder = b""
+
+        for block in chunks:
+            # Only hand complete lines to the tokenizer & carry over the
+            # partial line at the end of the block
+            block = remainder + block
+            last_newline = block.rfind(b"\n")
+            if last_newline < 0:
+                remainder = block
+                continue
+            remainder = block[last_newline + 1:]
+
+            buf = numpy.frombuffer(block, dtype=numpy.uint8, \
+                    count=last_newline + 1)
+            yield DataParser.parse_buffer(buf)
+
+        # The last line may not be terminated by a newline
+        if remainder:
+            buf = numpy.frombuffer(remainder + b"\n", dtype=numpy.uint8)
+            yield DataParser.parse_buffer(buf)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def iter_appended_blocks(filepath, offset=0, stop=None):
+        # Reads the complete lines of a file between offset & stop (the end
+        # of the file if None) block by block, yielding the timestamps,
+        # deltas & total headers found of each block along with the offset
+        # right past its last line. A trailing partial line (e.g. one still
+        # being written) is left for a later read
+
+        remainder = b""
+        position = offset
+
+        file_input = open(filepath, "rb")
+        try:
+            file_input.seek(offset)
+
+            while stop is None or position < stop:
+                size = DataParser.chunk_size
+                if stop is not None:
+                    size = min(size, stop - position)
+
+                block = file_input.read(size)
+                if not block:
+                    break
+                position += len(block)
+
+                block = remainder + block
+                last_newline = block.rfind(b"\n")
+                if last_newline < 0:
+                    remainder = block
+                    continue
+                remainder = block[last_newline + 1:]
+                offset += last_newline + 1
+
+                buf = numpy.frombuffer(block, dtype=numpy.uint8, \
+                        count=last_newline + 1)
+                timestamps, deltas, headers = DataParser.parse_buffer(buf)
+                yield timestamps, deltas, headers, offset
+        finally:
+            file_input.close()
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def iter_mapped_blocks(filepath):
+        # Same as iter_blocks, but the blocks are tokenized straight from a
+        # memory map of the file
+
+        # Compressed files can't be mapped, they are read as a stream
+        from compressed_input import CompressedInput
+        if CompressedInput.is_compressed(filepath):
+            for parsed_block in DataParser.iter_blocks(filepath):
+                yield parsed_block
+            return
+
+        file_input = open(filepath, "rb")
+        try:
+            size = os.fstat(file_input.fileno()).st_size
+            if size == 0:
+                return
+
+            # The mapping stays valid after the file is closed
+            mapping = mmap.mmap(file_input.fileno(), 0, \
+                    access=mmap.ACCESS_READ)
+        finally:
+            file_input.close()
+
+        try:
+            if hasattr(mapping, "madvise"):
+                mapping.madvise(mmap.MADV_SEQUENTIAL)
+
+            for start, stop in DataParser.cut_blocks(mapping, size):
+                parsed_block = DataParser.parse_slice(mapping, start, stop)
+                DataParser.release_pages(mapping, start, stop)
+
+                yield parsed_block
+        finally:
+            mapping.close()
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def parse_data(data):
+        # Same as parse_file, but for the contents of a file already read
+        # into memory (e.g. bytes), tokenized block by block without copies
+
+        return DataParser.join_blocks(DataParser.parse_slice(data, start, \
+                stop) for start, stop in DataParser.cut_blocks(data, \
+                len(data)))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def cut_blocks(data, size):
+        # Yields the start & stop of the successive blocks of a buffer
+        # supporting find & rfind (bytes, mmap), cut on line boundaries &
+        # stretched if a line is longer than a block
+
+        start = 0
+        while start < size:
+            stop = min(start + DataParser.chunk_size, size)
+            if stop < size:
+                last_newline = data.rfind(b"\n", start, stop)
+                if last_newline < 0:
+                    last_newline = data.find(b"\n", stop)
+                stop = size if last_newline < 0 else last_newline + 1
+
+            yield start, stop
+            start = stop
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def parse_slice(data, start, stop):
+        # Tokenizes data[start:stop] in place
+
+        block = numpy.frombuffer(data, dtype=numpy.uint8, \
+                count=stop - start, offset=start)
+
+        # The last line may not be terminated by a newline
+        if block[-1] != NEWLINE:
+            block = numpy.append(block, numpy.uint8(NEWLINE))
+
+        return DataParser.parse_buffer(block)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def release_pages(mapping, start, stop):
+        # Drops the whole pages between start & stop from the process'
+        # resident set, where the platform supports it
+
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+
+        page_start = start - start % mmap.PAGESIZE
+        page_stop = stop - stop % mmap.PAGESIZE
+        if page_stop > page_start:
+            mapping.madvise(mmap.MADV_DONTNEED, page_start, \
+                    page_stop - page_start)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def join_blocks(parsed_blocks):
+        # Joins the columns & header counts parsed from each block, avoiding
+        # a copy when the file fit in a single block
+
+        timestamp_blocks = []
+        delta_blocks = []
+        total_headers_found = 0
+
+        for timestamps, deltas, headers in parsed_blocks:
+            timestamp_blocks.append(timestamps)
+            delta_blocks.append(deltas)
+            total_headers_found += headers
+
+        if not timestamp_blocks:
+            timestamps, deltas = DataParser.empty_columns()
+        elif len(timestamp_blocks) == 1:
+            timestamps, deltas = timestamp_blocks[0], delta_blocks[0]
+        else:
+            timestamps = numpy.concatenate(timestamp_blocks)
+            deltas = numpy.concatenate(delta_blocks)
+
+        return timestamps, deltas, total_headers_found
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def parse_buffer(buf):
+        # Tokenizes a uint8 buffer of newline terminated lines. A line holds
+        # data if its first two whitespace separated columns are integers,
+        # any other line (including blank ones) is counted as a header
+
+        is_newline = buf == NEWLINE
+
+        # Like text mode files, a lone carriage return also ends a line
+        is_lone_return = buf[:-1] == CARRIAGE_RETURN
+        if is_lone_return.any():
+            is_lone_return &= ~is_newline[1:]
+            is_newline[:-1] |= is_lone_return
+        del is_lone_return
+
+        total_lines = int(numpy.count_nonzero(is_newline))
+        if total_lines == 0:
+            timestamps, deltas = DataParser.empty_columns()
+            return timestamps, deltas, 0
+
+        # Separators are the ASCII characters str.split() separates on
+        is_separator = buf == SPACE
+        is_separator |= (buf >= 9) & (buf <= 13)
+        # The information separators (\x1c-\x1f), which numpy doesn't split
+        # on
+        is_information_separator = (buf >= 28) & (buf <= 31)
+        has_information_separators = bool(is_information_separator.any())
+        is_separator |= is_information_separator
+        del is_information_separator
+
+        # Tokens start after a separator & end right before one. The buffer
+        # ends with a newline, so every token start has a matching end
+        token_starts = numpy.flatnonzero(~is_separator[1:] & \
+                is_separator[:-1]) + 1
+        if not is_separator[0]:
+            token_starts = numpy.concatenate(([0], token_starts))
+        token_ends = numpy.flatnonzero(~is_separator[:-1] & \
+                is_separator[1:]) + 1
+
+        # Keep the 1st and 2nd token of every line
+        first_in_line = DataParser.find_line_heads(buf, is_newline, \
+                token_starts, token_ends)
+        second_tokens = numpy.flatnonzero(~first_in_line[1:] & \
+                first_in_line[:-1]) + 1
+        first_tokens = second_tokens - 1
+        del is_newline, first_in_line
+
+        invalid_tokens = DataParser.find_invalid_tokens(buf, is_separator, \
+                token_starts, token_ends)
+        del is_separator
+
+        valid = ~invalid_tokens[first_tokens] & ~invalid_tokens[second_tokens]
+        total_data_lines = int(numpy.count_nonzero(valid))
+        total_headers_found = total_lines - total_data_lines
+
+        if total_data_lines == 0:
+            timestamps, deltas = DataParser.empty_columns()
+            return timestamps, deltas, total_headers_found
+
+        # Every line holds exactly two valid columns, numpy can convert the
+        # buffer as is, once the separators it doesn't know are blanked out
+        if total_headers_found == 0 and len(token_starts) == 2 * total_lines:
+            if has_information_separators:
+                buf = numpy.where((buf >= 28) & (buf <= 31), SPACE, buf)
+            columns = numpy.fromstring(buf.tobytes(), dtype=numpy.int64, \
+                    sep=" ")
+        else:
+            columns = DataParser.parse_columns(buf, \
+                    token_starts[first_tokens[valid]], \
+                    token_ends[first_tokens[valid]], \
+                    token_starts[second_tokens[valid]], \
+                    token_ends[second_tokens[valid]])
+
+        return columns[0::2].copy(), columns[1::2].copy(), total_headers_found
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def find_line_heads(buf, is_newline, starts, ends):
+        # Flags the tokens that open a line, i.e. the tokens whose preceding
+        # separator run holds a newline
+
+        first_in_line = numpy.empty(len(starts), dtype=bool)
+        if len(starts) == 0:
+            return first_in_line
+
+        first_in_line[0] = True
+        gap_starts = ends[:-1]
+        gap_ends = starts[1:]
+
+        # Most runs are a single byte, check the byte right before each token
+        heads = first_in_line[1:]
+        heads[:] = is_newline[gap_ends - 1]
+
+        # Longer runs (" \n", "\r\n", ...) are looked up among the newlines
+        long_gaps = numpy.flatnonzero(gap_ends - gap_starts > 1)
+        if len(long_gaps):
+            line_ends = numpy.flatnonzero(is_newline)
+            heads[long_gaps] = \
+                    numpy.searchsorted(line_ends, gap_starts[long_gaps]) < \
+                    numpy.searchsorted(line_ends, gap_ends[long_gaps])
+
+        return first_in_line
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def find_invalid_tokens(buf, is_separator, starts, ends):
+        # Flags the tokens that int() would reject: tokens holding anything
+        # but digits after an optional sign, or values that overflow int64
+
+        invalid_tokens = numpy.zeros(len(starts), dtype=bool)
+        if len(starts) == 0:
+            return invalid_tokens
+
+        is_sign = (buf == ord("+")) | (buf == ord("-"))
+        is_other = (buf - numpy.uint8(ord("0"))) >= 10
+        is_other &= ~is_separator
+        is_other &= ~is_sign
+
+        # Bad bytes are rare (headers), so locate them & their tokens directly
+        misplaced_signs = numpy.flatnonzero(is_sign[1:] & ~is_separator[:-1])
+        for bad_positions in (numpy.flatnonzero(is_other), \
+                misplaced_signs + 1):
+            if len(bad_positions):
+                invalid_tokens[numpy.searchsorted(starts, bad_positions, \
+                        side="right") - 1] = True
+
+        signed = is_sign[starts]
+        total_digits = ends - starts - signed
+        invalid_tokens |= (total_digits < 1) | (total_digits > MAX_DIGITS)
+
+        # Only the longest values leading with a 9 can overflow, check those
+        # one by one
+        longest = numpy.flatnonzero(total_digits == MAX_DIGITS)
+        longest = longest[buf[starts[longest] + signed[longest]] == ord("9")]
+        for index in longest:
+            value = int(buf[starts[index]:ends[index]].tobytes())
+            if value > INT64_MAX or value < -INT64_MAX - 1:
+                invalid_tokens[index] = True
+
+        return invalid_tokens
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def parse_columns(buf, first_starts, first_ends, second_starts, \
+            second_ends):
+        # Blanks out every byte outside of the given column tokens & lets
+        # numpy convert what is left. Returns the values interleaved
+
+        marks = numpy.zeros(len(buf) + 1, dtype=numpy.int8)
+        marks[first_starts] = 1
+        marks[first_ends] = -1
+        marks[second_starts] = 1
+        marks[second_ends] = -1
+        keep = numpy.cumsum(marks[:-1], dtype=numpy.int8).view(bool)
+
+        columns = numpy.where(keep, buf, SPACE)
+
+        return numpy.fromstring(columns.tobytes(), dtype=numpy.int64, \
+                sep=" ")
+
+#-------------------------------------------------------------------------------
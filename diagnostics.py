@@ -0,0 +1,44 @@
+import logging
+import collections
+
+class Diagnostics:
+    # Debug diagnostics of the hot paths, costing nothing unless debug
+    # logging is on: loops check the enabled flag (a class attribute kept
+    # in sync with the logging level by refresh) before building anything,
+    # & rather than logging a line per file they add to counters, which are
+    # logged in one line at the end of each phase (see Profiler.phase)
+
+    enabled = False
+    # Counters of the current phase, in order of first use
+    counters = collections.OrderedDict()
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def refresh():
+        # Syncs enabled with the level of the root logger, to be called
+        # whenever it changes
+
+        Diagnostics.enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def count(name, amount=1):
+        # Adds amount to a counter of the current phase. Callers check
+        # enabled first, so nothing is counted otherwise
+
+        Diagnostics.counters[name] = Diagnostics.counters.get(name, 0) + \
+                amount
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def flush(phase_name):
+        # Logs the counters of the phase that just ended & resets them
+
+        if not Diagnostics.counters:
+            return
+
+        logging.debug("Counters - (%s) phase: %s", phase_name, \
+                ", ".join("%s = %s" % counter \
+                for counter in Diagnostics.counters.items()))
+        Diagnostics.counters.clear()
+
+#-------------------------------------------------------------------------------
@@ -0,0 +1,266 @@
+import os
+import time
+import logging
+import numpy
+from utils import Utils
+from objects import FileData
+from data_parser import DataParser
+from accumulators import MomentAccumulator, QuantileSketch
+from load_analysis_lib import LoadAnalysisLib
+from streaming_analysis import StreamingAnalysis
+from compressed_input import CompressedInput
+from results_writer import ResultsWriter
+from diagnostics import Diagnostics
+
+class FollowedFile:
+    # Incremental state of a data file being followed: how far it has been
+    # read, its head & tail timestamps & the moments of its deltas past the
+    # common timestamp threshold
+
+    __slots__ = ("file_id", "offset", "total_headers_found", \
+            "headers_reported", "head", "tail", "trimmed_moments")
+
+    def __init__(self, file_id):
+        self.file_id = file_id
+        self.offset = 0
+        self.total_headers_found = 0
+        self.headers_reported = False
+        self.head = None
+        self.tail = None
+        self.trimmed_moments = MomentAccumulator()
+
+class FollowAnalysis:
+    # Incremental version of the analysis in load_analysis.py for tests that
+    # are still running. Each refresh only reads the lines appended to the
+    # data files since the previous one (plus any new file), updating the
+    # running median sketch, moments & common timestamp threshold, so its
+    # cost follows the amount of new data rather than the total. Cleanup &
+    # tail trimming are not supported. recursive also follows the files of
+    # subdirectories
+
+    # Default amount of seconds between refreshes
+    interval = 5.0
+
+    def __init__(self, args, relative_error=None, recursive=False):
+        if relative_error is None:
+            relative_error = StreamingAnalysis.relative_error
+
+        self.args = args
+        self.recursive = recursive
+        self.relative_error = relative_error
+        self.reset()
+
+#-------------------------------------------------------------------------------
+    def reset(self):
+        # Forgets everything read so far
+
+        self.files = []
+        self.file_ids = set()
+        self.moments = MomentAccumulator()
+        self.sketch = QuantileSketch(self.relative_error)
+        self.threshold = None
+
+#-------------------------------------------------------------------------------
+    def run(self, interval=None, max_refreshes=None):
+        # Refreshes the analysis every interval seconds until interrupted
+        # (or max_refreshes are done)
+
+        if interval is None:
+            interval = FollowAnalysis.interval
+
+        total_refreshes = 0
+        try:
+            while max_refreshes is None or total_refreshes < max_refreshes:
+                if total_refreshes:
+                    time.sleep(interval)
+                self.refresh()
+                total_refreshes += 1
+        except KeyboardInterrupt:
+            logging.info("Stopped following the data files")
+
+#-------------------------------------------------------------------------------
+    def discover_files(self):
+        # Starts following the data files not seen so far
+
+        for arg in self.args:
+            for dirname, filename in Utils.get_dir_listing(arg, \
+                    self.recursive):
+                file_id = Utils.fix_filepath(dirname, filename)
+
+                if file_id in self.file_ids:
+                    continue
+                self.file_ids.add(file_id)
+
+                # Appended lines are found by byte offset, which compressed
+                # files don't map to
+                if CompressedInput.is_compressed(file_id) or \
+                        CompressedInput.is_archive(file_id):
+                    logging.warning("Compressed files can't be " + \
+                            "followed, skipping: %s" % file_id)
+                    continue
+
+                logging.debug("Following data file: %s", file_id)
+                self.files.append(FollowedFile(file_id))
+
+#-------------------------------------------------------------------------------
+    def is_truncated(self):
+        # Checks whether a followed file shrank, i.e. it was truncated or
+        # replaced. Deleted files are just not read anymore
+
+        for followed_file in self.files:
+            try:
+                size = os.path.getsize(followed_file.file_id)
+            except OSError:
+                continue
+
+            if size < followed_file.offset:
+                logging.warning("Data file shrank, restarting the " + \
+                        "analysis: %s" % followed_file.file_id)
+                return True
+
+        return False
+
+#-------------------------------------------------------------------------------
+    def read_new_blocks(self, followed_file):
+        # Reads the complete lines appended to a file since the last refresh,
+        # returning the timestamps & deltas of each block read
+
+        new_blocks = []
+
+        try:
+            for timestamps, deltas, headers, offset in \
+                    DataParser.iter_appended_blocks(followed_file.file_id, \
+                    followed_file.offset):
+                followed_file.offset = offset
+                followed_file.total_headers_found += headers
+
+                if len(timestamps):
+                    new_blocks.append((timestamps, deltas))
+        except (IOError, OSError) as e:
+            logging.warning("Could not read %s: %s" % \
+                    (followed_file.file_id, e))
+
+        return new_blocks
+
+#-------------------------------------------------------------------------------
+    def refresh(self):
+        # Reads the new data & logs the refreshed analysis, if any
+
+        if self.is_truncated():
+            self.reset()
+        self.discover_files()
+
+        # Read the new lines of every file, keeping the previous offsets in
+        # case the trimmed moments have to be rebuilt
+        previous_offsets = [followed_file.offset \
+                for followed_file in self.files]
+        all_new_blocks = [self.read_new_blocks(followed_file) \
+                for followed_file in self.files]
+
+        total_new_rows = 0
+        for followed_file, new_blocks in zip(self.files, all_new_blocks):
+            for timestamps, deltas in new_blocks:
+                self.moments.add(deltas)
+                self.sketch.add(deltas)
+
+                if followed_file.head is None:
+                    followed_file.head = timestamps[0]
+                followed_file.tail = timestamps[-1]
+                total_new_rows += len(deltas)
+
+        self.report_extra_headers()
+
+        if total_new_rows == 0:
+            logging.debug("No new data found")
+            return
+
+        logging.info(LoadAnalysisLib.line_break)
+        logging.info("Read %s new row(s), %s in total" % \
+                (total_new_rows, self.moments.count))
+        LoadAnalysisLib.log_analysis("original", self.sketch.median(), \
+                self.moments.std())
+
+        # Compute the shared timestamp threshold from the head & tail
+        # timestamp of each file
+        followed_files = [followed_file for followed_file in self.files \
+                if followed_file.head is not None]
+        file_bounds = [FileData(followed_file.file_id, \
+                numpy.array([followed_file.head, followed_file.tail])) \
+                for followed_file in followed_files]
+        threshold, tail_threshold = \
+                LoadAnalysisLib.compute_common_thresholds(file_bounds)
+
+        # A new file starting later raises the threshold, so the deltas
+        # already read have to be trimmed again. This rereads the files, but
+        # only happens while files are still being added
+        if threshold != self.threshold:
+            self.threshold = threshold
+            self.retrim(previous_offsets)
+
+        for followed_file, new_blocks in zip(self.files, all_new_blocks):
+            for timestamps, deltas in new_blocks:
+                followed_file.trimmed_moments.add(\
+                        deltas[timestamps >= threshold])
+
+        self.log_mean_of_stds(followed_files)
+        Diagnostics.flush("refresh")
+        ResultsWriter.flush()
+
+#-------------------------------------------------------------------------------
+    def retrim(self, previous_offsets):
+        # Rebuilds the trimmed moments of each file from the data read
+        # before this refresh
+
+        logging.debug("Trimming the data read so far to the new threshold")
+
+        for followed_file, offset in zip(self.files, previous_offsets):
+            followed_file.trimmed_moments = MomentAccumulator()
+            if offset == 0:
+                continue
+
+            try:
+                for timestamps, deltas, headers, end_offset in \
+                        DataParser.iter_appended_blocks(\
+                        followed_file.file_id, 0, offset):
+                    followed_file.trimmed_moments.add(\
+                            deltas[timestamps >= self.threshold])
+            except (IOError, OSError) as e:
+                logging.warning("Could not read %s: %s" % \
+                        (followed_file.file_id, e))
+
+#-------------------------------------------------------------------------------
+    def report_extra_headers(self):
+        # Reports the files with extra headers, once per file
+
+        extra_headers_found = False
+
+        for followed_file in self.files:
+            if followed_file.headers_reported:
+                continue
+
+            if LoadAnalysisLib.report_extra_headers(followed_file.file_id, \
+                    followed_file.total_headers_found):
+                followed_file.headers_reported = True
+                extra_headers_found = True
+
+        if extra_headers_found:
+            LoadAnalysisLib.report_extra_headers_error()
+
+#-------------------------------------------------------------------------------
+    def log_mean_of_stds(self, followed_files):
+        # Logs the mean of the stds of the trimmed deltas of each file. Files
+        # without data past the threshold yet are left out until they catch
+        # up, instead of ending the run like the batch analysis does
+
+        all_stds = []
+        for followed_file in followed_files:
+            if followed_file.trimmed_moments.count:
+                all_stds.append(followed_file.trimmed_moments.std())
+            else:
+                logging.warning("No data past the timestamp threshold " + \
+                        "yet: %s" % followed_file.file_id)
+
+        if all_stds:
+            LoadAnalysisLib.log_mean_of_stds(numpy.mean(all_stds))
+
+#-------------------------------------------------------------------------------
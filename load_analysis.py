@@ -2,10 +2,16 @@
 #-------------------------------------------------------------------------------
 import optparse
 import logging
-import logging_colorer
 import sys
+import numpy
 from utils import Utils
 from load_analysis_lib import LoadAnalysisLib
+from profiler import Profiler
+from results_writer import ResultsWriter
+
+# The modules of the other modes (streaming, follow, windows, run index,
+# server) & the colored logging are imported when used, keeping startup
+# short
 
 LOGGING_LEVELS = {'critical': logging.CRITICAL,
                   'error': logging.ERROR,
@@ -24,22 +30,225 @@ def setup_parser_options():
             "\ndirector(y/ies) provided & trims the file data so that " + \
             "\nonly data with a common timestamp threshold is " + \
             "\nused in a mathematical analysis." + \
+            "\n\nData files may be gzip, xz or zstd (.gz, .xz, .zst) " + \
+            "\ncompressed & tar archives of data directories may be " + \
+            "\ngiven in place of directories." + \
             "\n\nFor help, use %prog -h or %prog --help")
     parser.add_option('-c', '--cleanup-level', dest="cleanup_level",
             help='Clean up the file data by eliminating ' \
                     '+/- this amount of standard deviations from the median')
+    parser.add_option('--cleanup-strategy', dest="cleanup_strategy",
+            type="choice", choices=LoadAnalysisLib.cleanup_strategies,
+            default="std",
+            help="How the cleanup level is applied. 'std' (default): " + \
+                "+/- level stds from the median, 'mad': +/- level " + \
+                "median absolute deviations from the median, 'iqr': " + \
+                "level interquartile ranges beyond the quartiles, " + \
+                "'percentile': outside of the level to (100 - level) " + \
+                "percentiles")
+    parser.add_option('--cleanup-iterations', dest="cleanup_iterations",
+            default="1",
+            help="Repeat the cleanup against the median & standard " + \
+                "deviation of the clean data until no more outliers are " + \
+                "found, at most this amount of times. Default is 1")
     parser.add_option("-p","--plot", \
             dest='plot_filename', \
             help="Plot the trimmed file data and save it to the " + \
             "graphs/ directory using the " + \
             "specified filename. Default extension is .png, if none " + \
             "provided. Options to be used with filename: .png, .pdf, .svg")
+    parser.add_option("--plot-mode", \
+            dest='plot_mode', type="choice", \
+            choices=["auto", "dots", "density", "minmax"], default="auto", \
+            help="How the data is plotted: 'dots' draws every point, " + \
+            "'density' draws the amount of points per pixel, 'minmax' " + \
+            "draws the min & max of each pixel column. Default 'auto' " + \
+            "uses dots for up to 100000 points & density past that")
+    parser.add_option("-t","--trim-tail", \
+            dest='trim_tail', action="store_true", \
+            help="Also trim the file data to the smallest timestamp " + \
+            "found at the tail of the files, bounding the common " + \
+            "timestamp window on both sides")
+    parser.add_option("-w","--window", \
+            dest='window', \
+            help="Aggregate the trimmed deltas of all files into time " + \
+            "windows of this many timestamp units & write the count, " + \
+            "mean, std & percentiles of each to the results/ directory")
+    parser.add_option("--window-step", \
+            dest='window_step', \
+            help="Start a window every this many timestamp units, making " + \
+            "them sliding windows if smaller than --window, which it " + \
+            "must divide. Default is --window (fixed windows)")
+    parser.add_option("--window-percentiles", \
+            dest='window_percentiles', default="50,90,99", \
+            help="Comma separated percentiles computed for each window. " + \
+            "Default is 50,90,99")
+    parser.add_option("--window-output", \
+            dest='window_output', default="windows.csv", \
+            help="Filename of the windowed statistics in the results/ " + \
+            "directory. Default is windows.csv")
+    parser.add_option("--window-plot", \
+            dest='window_plot', \
+            help="Plot the windowed statistics & save it to the graphs/ " + \
+            "directory using the specified filename")
+    parser.add_option("--percentiles", \
+            dest='percentiles', \
+            help="Log these comma separated percentiles (e.g. " + \
+            "50,99,99.9) of the original, clean & trimmed deltas, read " + \
+            "off of log-linear histograms of fixed memory")
+    parser.add_option("--histogram-error", \
+            dest='histogram_error', \
+            help="Relative error of the --percentiles & distribution " + \
+            "plots. Default is 0.001")
+    parser.add_option("--cdf-plot", \
+            dest='cdf_plot', \
+            help="Plot the CDFs of the original, clean & trimmed deltas " + \
+            "& save it to the graphs/ directory using the specified " + \
+            "filename")
+    parser.add_option("--percentile-plot", \
+            dest='percentile_plot', \
+            help="Plot the deltas at each percentile of the original, " + \
+            "clean & trimmed data, stretched towards the tail, & save " + \
+            "it to the graphs/ directory using the specified filename")
     parser.add_option("-o","--output-to-file", \
             dest='output_to_file', \
             help="Write output to the results/ directory using the " + \
             "specified filename. *Note: output is done in an appended " + \
             "mode per write, so remove files beforehand, " + \
             "if you plan on reusing the same filename.")
+    parser.add_option("--results", \
+            dest='results_filename', \
+            help="Append structured records of every statistic (analysis, " + \
+            "thresholds, cleanup, per file statistics) to the specified " + \
+            "file in the results/ directory, tagged with the run so the " + \
+            "records of many runs can be compared")
+    parser.add_option("--results-format", \
+            dest='results_format', type="choice", \
+            choices=ResultsWriter.formats, \
+            help="Format of the --results records: 'json' (one JSON " + \
+            "object per line) or 'csv' (one statistic per row). Default " + \
+            "is csv for .csv filenames & json otherwise")
+    parser.add_option("--save-run", \
+            dest='save_run', action="store_true", \
+            help="Save a summary of the run (global & per file " + \
+            "statistics, threshold, quantile sketch) to the run index, " + \
+            "replacing the summary of a run over the same data " + \
+            "directories with the same parameters")
+    parser.add_option("--run-name", \
+            dest='run_name', \
+            help="Name the run saved with --save-run, to compare it by name")
+    parser.add_option("--compare-runs", \
+            dest='compare_runs', \
+            help="Compare the comma separated runs (ids or names) of the " + \
+            "run index against the first one, without reading any data")
+    parser.add_option("--list-runs", \
+            dest='list_runs', action="store_true", \
+            help="List the runs of the run index")
+    parser.add_option("--run-index", \
+            dest='run_index', \
+            help="SQLite file of the run index. Default is " + \
+            "results/runs.sqlite")
+    parser.add_option('-j', '--jobs', dest="jobs", default="1",
+            help="Amount of processes used to parse the data files & " + \
+                "compute their statistics in parallel. Default is 1, use " + \
+                "0 for one process per CPU")
+    parser.add_option('--file-stats', dest="file_stats", action="store_true",
+            help="Log the count, mean, std, min, max & median of the " + \
+                "deltas of each file, for the original & trimmed data")
+    parser.add_option('-m', '--mmap', dest="use_mmap", action="store_true",
+            help="Read the data files through memory maps, keeping memory " + \
+                "use flat regardless of the file sizes")
+    parser.add_option('--no-cache', dest="no_cache", action="store_true",
+            help="Do not read or write the cache of parsed data files " + \
+                "kept in each data directory")
+    parser.add_option('--rebuild-cache', dest="rebuild_cache",
+            action="store_true",
+            help="Reparse every data file & replace its cache entry")
+    parser.add_option('--cache-size', dest="cache_size",
+            help="Cap the cache of each data directory to this amount " + \
+                "of MB, evicting the least recently used entries")
+    parser.add_option('-r', '--recursive', dest="recursive",
+            action="store_true",
+            help="Also process the files found in the subdirectories of " + \
+                "the data directories, skipping hidden ones")
+    parser.add_option('--io-threads', dest="io_threads",
+            help="Read the data files with this amount of threads while " + \
+                "they are parsed, overlapping the I/O of slow (e.g. " + \
+                "network) storage with the parsing. Not used with " + \
+                "--jobs, --mmap or --streaming")
+    parser.add_option('--io-buffer', dest="io_buffer",
+            help="Cap the data read ahead of the parser with --io-threads " + \
+                "to this amount of MB. Default is 256")
+    parser.add_option('-s', '--streaming', dest="streaming",
+            action="store_true",
+            help="Stream the data files in blocks instead of loading " + \
+                "them, so memory scales with the amount of files rather " + \
+                "than rows. Medians are approximated, --plot is not " + \
+                "supported")
+    parser.add_option('--sketch-error', dest="sketch_error",
+            help="Rank error of the medians approximated in streaming " + \
+                "& sharded mode. Default is 0.001")
+    parser.add_option('-f', '--follow', dest="follow", action="store_true",
+            help="Keep following the data files of a running test, only " + \
+                "reading the rows appended to them & logging the " + \
+                "refreshed analysis. Medians are approximated, cleanup, " + \
+                "--trim-tail & --plot are not supported")
+    parser.add_option('--interval', dest="interval",
+            help="Amount of seconds between refreshes in follow mode. " + \
+                "Default is 5")
+    parser.add_option('--shard', dest="shard",
+            help="Only analyze shard i/N (i from 0) of the sorted data " + \
+                "files & write its partial results, to be combined with " + \
+                "--merge. Medians are approximated, --trim-tail, " + \
+                "--cleanup-iterations & --plot are not supported")
+    parser.add_option('--partial', dest="partial",
+            help="Where --shard writes its partial results. Default is " + \
+                "results/shard-<i>-of-<N>.json")
+    parser.add_option('--shard-plan', dest="shard_plan",
+            help="Cleanup boundaries for the second round of --shard " + \
+                "runs, written by the --merge of the first round. " + \
+                "Default is results/shard-plan.json, applied if it was " + \
+                "made for the same cleanup, shards & data files")
+    parser.add_option('--merge', dest="merge", action="store_true",
+            help="Merge the partial results of every --shard run, given " + \
+                "as arguments, into the analysis. With a cleanup, the " + \
+                "first merge writes the --shard-plan to run the shards " + \
+                "with again, the second one finishes the analysis")
+    parser.add_option('--serve', dest="serve",
+            help="Run an analysis server on this [host:]port (e.g. " + \
+                "127.0.0.1:8765), which keeps the file data of the " + \
+                "data directories analyzed in memory, reparsing only the " + \
+                "files changed since, for the commands sent with --server. " + \
+                "Requests need the token the server writes to " + \
+                "~/.load_analysis/server-<port>.token")
+    parser.add_option('--server', dest="server",
+            help="Run the command on the analysis server at this URL " + \
+                "(e.g. http://127.0.0.1:8765) against its warm file data, " + \
+                "instead of parsing the data directories. Paths are " + \
+                "relative to the current directory, as usual")
+    parser.add_option('--server-memory', dest="server_memory",
+            help="Cap the file data the analysis server keeps in memory " + \
+                "to this amount of MB, dropping the least recently " + \
+                "used data directories first. Default is 4096")
+    parser.add_option('--profile', dest="profile", action="store_true",
+            help="Log the wall time, CPU time, peak memory & rows " + \
+                "processed of each phase of the run")
+    parser.add_option('--profile-json', dest="profile_json",
+            help="Write the profile of the run as JSON to this file " + \
+                "instead of logging it")
+    parser.add_option('--profile-memory', dest="profile_memory",
+            action="store_true",
+            help="Report the peak memory allocated within each phase, " + \
+                "traced with tracemalloc (slower), instead of the peak RSS")
+    parser.add_option('--cprofile', dest="cprofile", type="choice",
+            choices=Profiler.phase_names,
+            help="Run this phase under cProfile & dump its stats to " + \
+                "results/<phase>.prof. Options: " + \
+                ", ".join(Profiler.phase_names))
+    parser.add_option('--color', dest="color", type="choice",
+            choices=["auto", "always", "never"], default="auto",
+            help="Color the log by level: 'always', 'never' or 'auto' " + \
+                "(default) to only color it when logging to a terminal")
     parser.add_option('-l', '--logging-level', dest="logging_level",
             help="Logging level to use. Default level is set to 'info'. " + \
                 "Options (ascendingly inclusive): " + \
@@ -62,6 +271,21 @@ def setup_logging(options):
     Utils.set_logging(logging_level)
     LoadAnalysisLib.set_logging(logging_level)
 
+    # Color the log by level, by default only when logging to a terminal
+    if options.color == "always" or \
+            (options.color == "auto" and sys.stderr.isatty()):
+        import logging_colorer
+        logging_colorer.install()
+
+#-------------------------------------------------------------------------------
+def parse_number(value):
+    # Parse an int, falling back to a float (e.g. cleanup levels of 1.5)
+
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
 #-------------------------------------------------------------------------------
 def main():
 
@@ -72,46 +296,456 @@ def main():
     # Setup logging if requested
     setup_logging(options)
 
+    # Keep the file data in memory & serve analyses, if requested
+    if options.serve:
+        serve(parser, options)
+        return
+
+    # Run the analysis on a running analysis server, if requested
+    if options.server:
+        run_on_server(parser, options)
+        return
+
+    run_command(parser, options, args)
+
+#-------------------------------------------------------------------------------
+def run_command(parser, options, args, load_file_data=None):
+    # Run the command given, loading the file data with load_file_data
+    # (parse_file_data by default)
+
+    # Compare or list the runs of the index, if requested
+    if options.compare_runs or options.list_runs:
+        run_index_mode(parser, options)
+        return
+
     # Check for arguments, in this case, directories containing file data
     if len(args) < 1:
         parser.error("no arguments given.")
 
+    # Check the amount of processes, 0 being one per CPU
+    if not str(options.jobs).isdigit():
+        parser.error("--jobs must be a whole number of 0 or more: %s" % \
+                options.jobs)
+
+    # Check the percentiles & the relative error of their histograms
+    if options.percentiles:
+        for percentile in options.percentiles.split(","):
+            try:
+                valid = 0 <= parse_number(percentile) <= 100
+            except ValueError:
+                valid = False
+            if not valid:
+                parser.error("percentiles must be numbers within " + \
+                        "[0, 100]: %s" % percentile)
+    if options.histogram_error:
+        try:
+            valid = 0 < float(options.histogram_error) < 1
+        except ValueError:
+            valid = False
+        if not valid:
+            parser.error("--histogram-error must be within (0, 1): %s" % \
+                    options.histogram_error)
+
+    # Check the cleanup level against the cleanup strategy
+    if options.cleanup_level:
+        try:
+            cleanup_level = parse_number(options.cleanup_level)
+        except ValueError:
+            parser.error("invalid cleanup level: %s" % options.cleanup_level)
+        try:
+            LoadAnalysisLib.check_cleanup_level(cleanup_level, \
+                    options.cleanup_strategy)
+        except ValueError as e:
+            parser.error(str(e))
+
+    # Record the wall time, CPU time & memory of each phase, if requested
+    if options.profile or options.profile_json or options.profile_memory \
+            or options.cprofile:
+        Profiler.enable(options.profile_memory, options.cprofile)
+
+    try:
+        run_analysis(parser, options, args, load_file_data)
+    finally:
+        if Profiler.enabled:
+            report_profile(options)
+        ResultsWriter.close()
+
+#-------------------------------------------------------------------------------
+def serve(parser, options):
+    # Serve the analyses sent with --server, keeping the file data of their
+    # data directories in memory
+
+    from analysis_server import AnalysisServer
+
+    memory_limit = None
+    if options.server_memory:
+        memory_limit = int(float(options.server_memory) * 1024 * 1024)
+
+    try:
+        host, port = AnalysisServer.parse_address(options.serve)
+    except ValueError as e:
+        parser.error(str(e))
+
+    analysis_server = AnalysisServer(run_server_command, parse_file_data, \
+            memory_limit)
+    analysis_server.serve(host, port)
+
+#-------------------------------------------------------------------------------
+def run_server_command(analysis_server, argv):
+    # Run a command line sent to the analysis server against its warm data
+
+    parser = setup_parser_options()
+    (options, args) = parser.parse_args(argv)
+
+    # --server is left in by the client & ignored here
+    if options.serve or options.follow or options.streaming or \
+            options.shard or options.merge:
+        parser.error("--serve, --follow, --streaming, --shard & --merge " + \
+                "are not supported by the analysis server.")
+
+    logging_level = LOGGING_LEVELS.get(options.logging_level, logging.INFO)
+    logging.getLogger().setLevel(logging_level)
+    LoadAnalysisLib.set_logging(logging_level)
+
+    run_command(parser, options, args, analysis_server.load_file_data)
+
+#-------------------------------------------------------------------------------
+def run_on_server(parser, options):
+    # Send the command line to the analysis server & log its output
+
+    from analysis_server import AnalysisServer
+
+    try:
+        response = AnalysisServer.send_command(options.server, sys.argv[1:])
+    except (IOError, OSError, ValueError) as e:
+        parser.error("could not run the analysis on %s: %s" % \
+                (options.server, e))
+
+    for line in response["log"]:
+        sys.stderr.write(line + "\n")
+    if response["status"]:
+        sys.exit(response["status"])
+
+#-------------------------------------------------------------------------------
+def run_index_mode(parser, options):
+    # List the runs of the index and/or compare some of them
+
+    from run_index import RunIndex
+
+    connection = RunIndex.connect(options.run_index)
+    try:
+        if options.list_runs:
+            RunIndex.list_runs(connection)
+
+        if options.compare_runs:
+            runs = []
+            for run_key in options.compare_runs.split(","):
+                run = RunIndex.load_run(connection, run_key.strip())
+                if run is None:
+                    parser.error("no run found in the index: %s" % run_key)
+                runs.append(run)
+
+            RunIndex.compare_runs(runs)
+    finally:
+        connection.close()
+
+#-------------------------------------------------------------------------------
+def save_run(options, args, summary, all_file_stats):
+    # Save the summary of the run to the run index
+
+    from run_index import RunIndex
+
+    parameters = {"cleanup_level": options.cleanup_level, \
+            "cleanup_strategy": options.cleanup_strategy, \
+            "cleanup_iterations": options.cleanup_iterations, \
+            "trim_tail": bool(options.trim_tail), \
+            "recursive": bool(options.recursive)}
+
+    connection = RunIndex.connect(options.run_index)
+    try:
+        RunIndex.save_run(connection, options.run_name, args, parameters, \
+                summary, all_file_stats)
+    finally:
+        connection.close()
+
+#-------------------------------------------------------------------------------
+def run_sharded_analysis(parser, options, args):
+    # Analyze a shard of the file data or merge the partial results of the
+    # shards
+
+    if options.shard and options.merge:
+        parser.error("--shard & --merge cannot be used together.")
+    if options.follow or options.streaming or options.save_run or \
+            options.plot_filename or options.trim_tail or options.window or \
+            int(options.cleanup_iterations) > 1 or \
+            get_histogram_error(options) is not None:
+        parser.error("--follow, --streaming, --save-run, --plot, " + \
+                "--trim-tail, --window, --cleanup-iterations, " + \
+                "--percentiles & the distribution plots are not " + \
+                "supported with --shard or --merge.")
+
+    from sharded_analysis import ShardedAnalysis
+
+    if options.merge:
+        with Profiler.phase("merge"):
+            ShardedAnalysis.merge(args, options.file_stats, \
+                    options.shard_plan)
+        return
+
+    try:
+        shard_index, total_shards = ShardedAnalysis.parse_shard(options.shard)
+    except ValueError as e:
+        parser.error(str(e))
+
+    cleanup_level = None
+    if options.cleanup_level:
+        cleanup_level = parse_number(options.cleanup_level)
+
+    relative_error = None
+    if options.sketch_error:
+        relative_error = float(options.sketch_error)
+
+    cache_size = None
+    if options.cache_size:
+        cache_size = int(float(options.cache_size) * 1024 * 1024)
+
+    with Profiler.phase("shard"):
+        ShardedAnalysis.run_shard(args, shard_index, total_shards, \
+                options.partial, cleanup_level, options.cleanup_strategy, \
+                options.shard_plan, relative_error, options.recursive, \
+                jobs=int(options.jobs), use_mmap=options.use_mmap, \
+                use_cache=not options.no_cache, \
+                rebuild_cache=options.rebuild_cache, cache_size=cache_size)
+
+#-------------------------------------------------------------------------------
+def get_histogram_error(options):
+    # Relative error of the delta histograms, or None if no percentiles or
+    # distribution plots were requested
+
+    if not (options.percentiles or options.cdf_plot or \
+            options.percentile_plot):
+        return None
+    if options.histogram_error:
+        return float(options.histogram_error)
+
+    return LoadAnalysisLib.histogram_error
+
+#-------------------------------------------------------------------------------
+def report_distributions(options, histograms):
+    # Log the percentiles & plot the distributions of the (dataset name,
+    # histogram) pairs, as requested
+
+    if options.percentiles:
+        percentiles = [parse_number(percentile) \
+                for percentile in options.percentiles.split(",")]
+        for dataset_name, histogram in histograms:
+            LoadAnalysisLib.log_percentiles(dataset_name, histogram, \
+                    percentiles)
+
+    if options.cdf_plot:
+        Utils.plot_distributions(histograms, "Load Analysis - CDF", \
+                '/'.join(['graphs', options.cdf_plot]))
+    if options.percentile_plot:
+        Utils.plot_distributions(histograms, \
+                "Load Analysis - Percentiles", \
+                '/'.join(['graphs', options.percentile_plot]), False)
+
+#-------------------------------------------------------------------------------
+def report_profile(options):
+    # Log the profile of the run as a table and/or write it as JSON
+
+    if options.profile_json:
+        Profiler.write_report(options.profile_json)
+    else:
+        Profiler.log_report()
+
+#-------------------------------------------------------------------------------
+def parse_file_data(parser, options, args):
+    # Parse out all of the file data in the data directories given, as
+    # requested by the options
+
+    cache_size = None
+    if options.cache_size:
+        cache_size = int(float(options.cache_size) * 1024 * 1024)
+
+    io_threads = None
+    io_buffer_size = None
+    if options.io_threads:
+        io_threads = int(options.io_threads)
+        if int(options.jobs) != 1 or options.use_mmap:
+            parser.error("--io-threads cannot be used with --jobs or --mmap.")
+    if options.io_buffer:
+        io_buffer_size = int(float(options.io_buffer) * 1024 * 1024)
+
+    return LoadAnalysisLib.parse_data_files(args, int(options.jobs), \
+            options.use_mmap, not options.no_cache, options.rebuild_cache, \
+            cache_size, options.recursive, io_threads, io_buffer_size)
+
+#-------------------------------------------------------------------------------
+def run_analysis(parser, options, args, load_file_data=None):
+    # Run the analysis requested over the data directories given, loading
+    # the file data with load_file_data (parse_file_data by default)
+
+    if load_file_data is None:
+        load_file_data = parse_file_data
+
     # Setup the output file to write the results to, if requested
     if options.output_to_file:
         LoadAnalysisLib.output_to_file = True
         Utils.filepath = 'results/' + options.output_to_file
 
+    # Setup the structured records of the run, if requested
+    if options.results_filename:
+        run_info = {"data_dirs": ";".join(args), \
+                "cleanup_level": options.cleanup_level, \
+                "cleanup_strategy": options.cleanup_strategy, \
+                "trim_tail": bool(options.trim_tail)}
+        ResultsWriter.open_records('results/' + options.results_filename, \
+                options.results_format, run_info)
+
+    if options.save_run and (options.follow or options.streaming):
+        parser.error("--save-run is not supported in follow or streaming " + \
+                "mode.")
+
+    # Analyze a shard of the file data or merge the partial results of the
+    # shards, if requested
+    if options.shard or options.merge:
+        run_sharded_analysis(parser, options, args)
+        return
+
+    # Follow the file data of a running test, if requested
+    if options.follow:
+        if options.plot_filename or options.cleanup_level or \
+                options.trim_tail or get_histogram_error(options) is not None:
+            parser.error("--plot, --cleanup-level, --trim-tail, " + \
+                    "--percentiles & the distribution plots are not " + \
+                    "supported in follow mode.")
+
+        relative_error = None
+        if options.sketch_error:
+            relative_error = float(options.sketch_error)
+
+        interval = None
+        if options.interval:
+            interval = float(options.interval)
+
+        from follow_analysis import FollowAnalysis
+
+        follow_analysis = FollowAnalysis(args, relative_error, \
+                options.recursive)
+        follow_analysis.run(interval)
+        return
+
+    # Stream the file data through the analysis, if requested
+    if options.streaming:
+        if options.plot_filename:
+            parser.error("--plot is not supported in streaming mode.")
+
+        cleanup_level = None
+        if options.cleanup_level:
+            cleanup_level = parse_number(options.cleanup_level)
+
+        relative_error = None
+        if options.sketch_error:
+            relative_error = float(options.sketch_error)
+
+        from streaming_analysis import StreamingAnalysis
+        with Profiler.phase("streaming"):
+            histograms = StreamingAnalysis.analyze(args, cleanup_level, \
+                    options.trim_tail, options.use_mmap, relative_error, \
+                    int(options.cleanup_iterations), \
+                    options.cleanup_strategy, options.recursive, \
+                    get_histogram_error(options))
+        report_distributions(options, histograms)
+        return
+
     # Parse out all of the file data provided
-    all_file_data = LoadAnalysisLib.parse_data_files(args)
+    with Profiler.phase("parse") as record:
+        all_file_data = load_file_data(parser, options, args)
+        record["rows"] = Profiler.count_rows(all_file_data)
 
     # Print debug info about all of the original file data, if requested
     if options.logging_level == 'debug':
         LoadAnalysisLib.log_debug_file_data("original", all_file_data)
 
+    # The per file medians, which take a loop over the files, are only
+    # computed when the per file statistics are logged, recorded or saved
+    keep_file_stats = bool(options.file_stats or options.save_run or \
+            ResultsWriter.records_file is not None)
+
     # Analyze all of the original file data and log it
-    title, log = "original", True
-    LoadAnalysisLib.analyze(all_file_data, title, log)
+    # (the global std comes along with the per file statistics)
+    jobs = int(options.jobs)
+    with Profiler.phase("analyze") as record:
+        file_stats, moments = LoadAnalysisLib.compute_file_statistics(\
+                all_file_data, jobs, keep_file_stats)
+        all_deltas = LoadAnalysisLib.collect_all_deltas(all_file_data)
+        median = numpy.median(all_deltas) if len(all_deltas) else numpy.nan
+        std = moments.std()
+        LoadAnalysisLib.log_analysis("original", median, std)
+        record["rows"] = Profiler.count_rows(all_file_data)
+
+    if options.file_stats:
+        LoadAnalysisLib.log_file_statistics("original", file_stats)
+    ResultsWriter.record_file_statistics("original", file_stats)
+
+    # Bin the deltas of each dataset for their percentiles & distribution
+    # plots, if requested
+    histogram_error = get_histogram_error(options)
+    histograms = []
+    if histogram_error is not None:
+        with Profiler.phase("histogram") as record:
+            histograms.append(("original", LoadAnalysisLib.compute_histogram(\
+                    all_file_data, histogram_error)))
+            record["rows"] = Profiler.count_rows(all_file_data)
+
+    # Summarize the original file data for the run index, if requested
+    summary = {"count": moments.count, "median": median, "std": std}
+    if options.save_run:
+        from run_index import RunIndex
+        from accumulators import QuantileSketch
+
+        summary["sketch"] = QuantileSketch(RunIndex.relative_error)
+        summary["sketch"].add(LoadAnalysisLib.collect_all_deltas(\
+                all_file_data))
     
     # Clean up outliers if requested & reset the file data to be the clean data
     if options.cleanup_level:
-        cleanup_level = int(options.cleanup_level)
+        cleanup_level = parse_number(options.cleanup_level)
 
-        # Clean the original file data
-        all_file_data_cleaned = \
-                LoadAnalysisLib.cleanup_file_data(all_file_data, \
-                cleanup_level)
+        # Clean the original file data, reusing its analysis
+        with Profiler.phase("cleanup") as record:
+            all_file_data_cleaned = \
+                    LoadAnalysisLib.cleanup_file_data(all_file_data, \
+                    cleanup_level, median, std, \
+                    int(options.cleanup_iterations), options.cleanup_strategy)
+            record["rows"] = Profiler.count_rows(all_file_data)
 
         # Reset the original file data to now be the clean file data
         all_file_data = all_file_data_cleaned
 
         # Analyze all of the clean file data and log it
         title, log = "clean", True
-        LoadAnalysisLib.analyze(all_file_data, title, log)
+        with Profiler.phase("analyze_clean") as record:
+            summary["clean_median"], summary["clean_std"] = \
+                    LoadAnalysisLib.analyze(all_file_data, title, log)
+            record["rows"] = Profiler.count_rows(all_file_data)
+
+        if histogram_error is not None:
+            with Profiler.phase("histogram") as record:
+                histograms.append(("clean", \
+                        LoadAnalysisLib.compute_histogram(all_file_data, \
+                        histogram_error)))
+                record["rows"] = Profiler.count_rows(all_file_data)
 
     # Trim the file data (original or clean) based off of a shared timestamp
     # threshold
-    all_file_data_trimmed = \
-        LoadAnalysisLib.trim_lists_by_common_threshold(all_file_data)
+    with Profiler.phase("trim") as record:
+        # Counted first, the file data is trimmed in place
+        record["rows"] = Profiler.count_rows(all_file_data)
+        all_file_data_trimmed = \
+            LoadAnalysisLib.trim_lists_by_common_threshold(all_file_data, \
+                    options.trim_tail)
 
     # Print debug info about the trimmed file data (original or clean),
     # if requested
@@ -120,22 +754,75 @@ def main():
 
     # Find the mean of all delta standard deviations found (from the trimmed
     # file data)
-    LoadAnalysisLib.compute_mean_of_file_data_stds(\
-            all_file_data_trimmed)
+    with Profiler.phase("stds") as record:
+        trimmed_file_stats, trimmed_moments = \
+                LoadAnalysisLib.compute_file_statistics(\
+                all_file_data_trimmed, jobs, keep_file_stats)
+        mean_of_stds = LoadAnalysisLib.compute_mean_of_file_data_stds(\
+                all_file_data_trimmed, trimmed_file_stats)
+        record["rows"] = Profiler.count_rows(all_file_data_trimmed)
+
+    if options.file_stats:
+        LoadAnalysisLib.log_file_statistics("trimmed", trimmed_file_stats)
+    ResultsWriter.record_file_statistics("trimmed", trimmed_file_stats)
+
+    # Save the summary of the run, if requested. The threshold is the
+    # earliest timestamp left after trimming
+    if options.save_run:
+        summary["threshold"] = min(file_data.timestamps[0] \
+                for file_data in all_file_data_trimmed)
+        summary["mean_of_stds"] = mean_of_stds
+        save_run(options, args, summary, {"original": file_stats, \
+                "trimmed": trimmed_file_stats})
     
+    # Aggregate the trimmed file data (original or clean) into time windows
+    if options.window:
+        window = parse_number(options.window)
+        window_step = None
+        if options.window_step:
+            window_step = parse_number(options.window_step)
+        percentiles = [parse_number(percentile) \
+                for percentile in options.window_percentiles.split(",")]
+
+        from windowed_analysis import WindowedAnalysis
+        with Profiler.phase("window") as record:
+            try:
+                window_stats = WindowedAnalysis.aggregate(\
+                        all_file_data_trimmed, window, window_step, \
+                        percentiles)
+            except ValueError as e:
+                parser.error(str(e))
+            WindowedAnalysis.write_csv(window_stats, \
+                    '/'.join(['results', options.window_output]))
+            record["rows"] = Profiler.count_rows(all_file_data_trimmed)
+
+        if options.window_plot:
+            Utils.plot_windows(window_stats, "Load Analysis - Windows", \
+                    '/'.join(['graphs', options.window_plot]))
+
+    # Report the percentiles & distributions of every dataset
+    if histogram_error is not None:
+        with Profiler.phase("histogram") as record:
+            histograms.append(("trimmed", \
+                    LoadAnalysisLib.compute_histogram(all_file_data_trimmed, \
+                    histogram_error)))
+            record["rows"] = Profiler.count_rows(all_file_data_trimmed)
+        report_distributions(options, histograms)
+
     # Plot the trimmed file data (original or clean)
     if options.plot_filename:
         filepath = '/'.join(['graphs', options.plot_filename])
 
-        # Collect all of the timestamps and deltas
-        all_timestamps = \
-            LoadAnalysisLib.collect_all_timestamps(all_file_data_trimmed)
-        all_deltas = \
-            LoadAnalysisLib.collect_all_deltas(all_file_data_trimmed)
+        with Profiler.phase("plot") as record:
+            # Collect all of the timestamps and deltas, in time order
+            all_timestamps, all_deltas, file_indexes = \
+                LoadAnalysisLib.merge_timelines(all_file_data_trimmed)
 
-        # Plot the data
-        plot_title = "Load Analysis"
-        Utils.plot_data(all_timestamps, all_deltas, plot_title, filepath)
+            # Plot the data
+            plot_title = "Load Analysis"
+            Utils.plot_data(all_timestamps, all_deltas, plot_title, \
+                    filepath, options.plot_mode)
+            record["rows"] = len(all_deltas)
 
 #-------------------------------------------------------------------------------
 if __name__ == "__main__":
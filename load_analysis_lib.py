@@ -3,16 +3,35 @@
 # Email: mdmetra@sandia.gov
 # Date: 03/14/12
 
+import os
 import sys
 import numpy
+import heapq
+import functools
+import concurrent.futures
 import logging
-import logging_colorer
 from utils import Utils
-from objects import FileData
+from objects import FileData, FileDataSet, FileStatistics
+from accumulators import MomentAccumulator, LogLinearHistogram
+from data_parser import DataParser
+from data_cache import DataCache
+from compressed_input import CompressedInput
+from results_writer import ResultsWriter
+from diagnostics import Diagnostics
 
 class LoadAnalysisLib:
     line_break = "-------------------------------------------------"
     output_to_file = False
+
+    # Outlier cleanup strategies, see compute_cleanup_boundaries
+    cleanup_strategies = ["std", "mad", "iqr", "percentile"]
+    # Scales the median absolute deviation of normally distributed data to
+    # its std
+    mad_scale = 1.4826
+    # Relative error of the percentiles read off of the delta histograms &
+    # amount of deltas binned at a time
+    histogram_error = 0.001
+    histogram_chunk_size = 1024 * 1024
 #-------------------------------------------------------------------------------
     @staticmethod
     def set_logging(logging_level):
@@ -21,68 +40,133 @@ class LoadAnalysisLib:
         logging.basicConfig(level=logging_level,
             format='%(asctime)s %(levelname)s: %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S')
+        Diagnostics.refresh()
 #-------------------------------------------------------------------------------
     @staticmethod
-    def parse_data_files(args):
-        # Parse & process the data given
-
-        all_file_data = []
+    def parse_data_files(args, jobs=1, use_mmap=False, use_cache=False, \
+            rebuild_cache=False, cache_size=None, recursive=False, \
+            io_threads=None, io_buffer_size=None):
+        # Parse & process the data given. When jobs is not 1 the files are
+        # parsed by a pool of that many processes (0 for one per CPU), but
+        # still reported & stored in directory listing order. use_mmap reads
+        # the files through memory maps instead of buffered reads. use_cache
+        # reuses the columns cached by previous runs (see DataCache), where
+        # rebuild_cache reparses every file & cache_size caps each
+        # directory's cache in bytes. recursive also lists the files of
+        # subdirectories. io_threads reads the files of each directory through
+        # an AsyncReader with that many threads, holding at most
+        # io_buffer_size bytes of unparsed data, instead of jobs & use_mmap.
+        # gzip, xz & zstd compressed files are decompressed on the fly & the
+        # files of tar archives (given or listed) are parsed in one pass
+        # over each archive, without extracting them (see CompressedInput)
+
+        # Columns of each file, packed into a single FileDataSet at the end
+        file_ids = []
+        timestamp_columns = []
+        delta_columns = []
         extra_headers_found = False
 
-        # Get the file listing for each directory
-        for arg in args:
-            dir_listing = Utils.get_dir_listing(arg)
-            logging.debug(LoadAnalysisLib.line_break)
-            logging.debug("All files found:")
-            logging.debug("----------------")
-            logging.debug("%s", dir_listing)
-
-            # Process each file in the directory
-            for file_entry in dir_listing:
-                dirname, filename = file_entry
-                file_input = open("%s/%s" % (dirname, filename), "r")
-
-                # Data to collect
-                timestamps = []
-                deltas = []
-                total_headers_found = 0
-
-                # Fix the filepath and make that the file_id
-                filepath = Utils.fix_filepath(dirname, filename)
-                file_id = filepath
-
-                # Parses the columns of the file input
-                for column in file_input:
-                    column_data = column.split();
-                    try:
-                        timestamp = int(column_data[0])
-                        delta = int(column_data[1])
-                        
-                        timestamps.append(timestamp)
-                        deltas.append(delta)
-                    except:
-                        total_headers_found += 1
-
-                # Report if extra headers are found aside from the initial one
-                if total_headers_found > 1:
-                    extra_headers_found = True
-                    logging.error(LoadAnalysisLib.line_break)
-                    logging.error("%s extra header(s) found in file: %s" % \
-                            (total_headers_found-1, file_id))
-
-                file_data = FileData(file_id, timestamps, deltas)
-                all_file_data.append(file_data)
-
-            if extra_headers_found:
-                # Exit as there is an error with the data collectected
-
-                logging.error(LoadAnalysisLib.line_break)
-                logging.error("Fix the error with the extra header(s) " + \
-                        "before you can proceed")
-                #sys.exit(0)
+        parse_file = DataParser.parse_file
+        if use_mmap:
+            parse_file = DataParser.parse_mapped_file
+        if use_cache:
+            parse_file = functools.partial(DataCache.parse_file, \
+                    parse_file=parse_file, rebuild=rebuild_cache)
+
+        pool = None
+        if jobs != 1:
+            pool = concurrent.futures.ProcessPoolExecutor(jobs or None)
+
+        try:
+            # Get the file listing for each directory
+            for arg in args:
+                dir_listing = Utils.get_dir_listing(arg, recursive)
+                logging.debug(LoadAnalysisLib.line_break)
+                logging.debug("All files found:")
+                logging.debug("----------------")
+                logging.debug("%s", dir_listing)
+
+                # Fix the filepaths and make those the file_ids
+                filepaths = [Utils.fix_filepath(dirname, filename) \
+                        for dirname, filename in dir_listing]
+
+                # Archives are expanded below, the other files go through
+                # the parsing pool or reader
+                data_filepaths = [filepath for filepath in filepaths \
+                        if not CompressedInput.is_archive(filepath)]
+
+                # Parses the columns of each file input into typed arrays
+                if io_threads:
+                    from async_reader import AsyncReader
+                    parsed_files = AsyncReader.parse_files(data_filepaths, \
+                            io_threads, io_buffer_size, use_cache, \
+                            rebuild_cache)
+                elif pool:
+                    parsed_files = pool.map(parse_file, data_filepaths)
+                else:
+                    parsed_files = map(parse_file, data_filepaths)
+                parsed_files = iter(parsed_files)
+
+                # Process each file in the directory
+                for filepath in filepaths:
+                    if CompressedInput.is_archive(filepath):
+                        parsed_members = [(Utils.fix_filepath(filepath, \
+                                member_name), parsed_file) for member_name, \
+                                parsed_file in \
+                                CompressedInput.iter_archive(filepath)]
+                    else:
+                        parsed_members = [(filepath, next(parsed_files))]
+
+                    for file_id, parsed_file in parsed_members:
+                        timestamps, deltas, total_headers_found = parsed_file
+
+                        # Report if extra headers are found aside from the
+                        # initial one
+                        if LoadAnalysisLib.report_extra_headers(file_id, \
+                                total_headers_found):
+                            extra_headers_found = True
+
+                        file_ids.append(file_id)
+                        timestamp_columns.append(timestamps)
+                        delta_columns.append(deltas)
+
+                if use_cache and cache_size is not None:
+                    for dirname in set(dirname \
+                            for dirname, filename in dir_listing):
+                        DataCache.evict(dirname, cache_size)
+
+                if extra_headers_found:
+                    LoadAnalysisLib.report_extra_headers_error()
+        finally:
+            if pool:
+                pool.shutdown()
+
+        return FileDataSet.from_columns(file_ids, timestamp_columns, \
+                delta_columns)
 
-        return all_file_data
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def report_extra_headers(file_id, total_headers_found):
+        # Report if extra headers are found in a file aside from the initial
+        # one & return whether there were any
+
+        if total_headers_found > 1:
+            logging.error(LoadAnalysisLib.line_break)
+            logging.error("%s extra header(s) found in file: %s" % \
+                    (total_headers_found-1, file_id))
+            return True
+
+        return False
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def report_extra_headers_error():
+        # Exit as there is an error with the data collectected
 
+        logging.error(LoadAnalysisLib.line_break)
+        logging.error("Fix the error with the extra header(s) " + \
+                "before you can proceed")
+        #sys.exit(0)
 
 #-------------------------------------------------------------------------------
     @staticmethod
@@ -102,67 +186,85 @@ class LoadAnalysisLib:
         # Find the biggest timestamp at the head of each list - this will be our
         # threshold
         for file_data in file_data_list:
-            file_id = file_data.file_id
-            timestamps = file_data.timestamps
-            deltas = file_data.deltas
-
-            head_timestamp = timestamps[0]
-
-            logging.debug("")
-            logging.debug("viewing head timestamp: " + str(head_timestamp))
+            head_timestamp = file_data.timestamps[0]
 
             if biggest_timestamp < head_timestamp:
                 biggest_timestamp = head_timestamp
-                biggest_timestamp_file_id = file_id
+                biggest_timestamp_file_id = file_data.file_id
+
+        if Diagnostics.enabled:
+            Diagnostics.count("head timestamps viewed", len(file_data_list))
 
-            logging.debug("current biggest timestamp: " + \
-                    str(biggest_timestamp))
-        
         return biggest_timestamp, biggest_timestamp_file_id
 
 #-------------------------------------------------------------------------------
     @staticmethod
-    def trim_lists_by_common_threshold(all_file_data):
+    def compute_tail_timestamp_threshold(file_data_list):
+        # Computes the tail counterpart of compute_timestamp_threshold: the
+        # smallest timestamp at the tail of the file data
+        # *Note*: Requires each set of file data in file_data_list to be
+        # independently sorted in ascending order
+
+        # Init values to store smallest timestamp
+        smallest_timestamp = None
+        smallest_timestamp_file_id = None
+
+        logging.info(LoadAnalysisLib.line_break)
+        msg = "Computing tail timestamp threshold amongst file data ..."
+        logging.info(msg)
+
+        # Find the smallest timestamp at the tail of each list - this will be
+        # our tail threshold
+        for file_data in file_data_list:
+            tail_timestamp = file_data.timestamps[-1]
+
+            if smallest_timestamp is None or \
+                    smallest_timestamp > tail_timestamp:
+                smallest_timestamp = tail_timestamp
+                smallest_timestamp_file_id = file_data.file_id
+
+        if Diagnostics.enabled:
+            Diagnostics.count("tail timestamps viewed", len(file_data_list))
+
+        return smallest_timestamp, smallest_timestamp_file_id
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def trim_lists_by_common_threshold(all_file_data, trim_tail=False):
         # Trims each file's data using a timestamp threshold such that the
         # trimmed data has an equal or greater value relative to the 
-        # biggest head out of the file data 
+        # biggest head out of the file data. If trim_tail is set, the data
+        # is also trimmed to an equal or smaller value relative to the
+        # smallest tail out of the file data. The trimmed data are views of
+        # the original data
 
         if not all_file_data:
             return []
 
-        # Compute the timestamp threshold
-        threshold, threshold_file_id = \
-                LoadAnalysisLib.compute_timestamp_threshold(all_file_data)
-
-        logging.info(LoadAnalysisLib.line_break)
-        msg = "Timestamp threshold set at: %s by file: %s" \
-                %  (str(threshold), threshold_file_id)
-        logging.info(msg)
-        if LoadAnalysisLib.output_to_file: Utils.write_to_file("\n\n" + msg)
-
-        debug_iterations = 0
+        threshold, tail_threshold = \
+                LoadAnalysisLib.compute_common_thresholds(all_file_data, \
+                trim_tail)
 
         # Track any empty trimmed file data sets as a result of the threshold
         empty_trimmed_file_data_by_file_data_id = []
 
         # Iterate through each list & trim out timestamp/delta entries that do
-        # not meet the threshold
+        # not meet the threshold(s). As the timestamps are sorted, the cut
+        # points are found by binary search
         for file_data_index, file_data in enumerate(all_file_data):
-            debug_iterations += 1
-            trimmed_timestamps = []
-            trimmed_deltas = []
-
             file_id = file_data.file_id
             timestamps = file_data.timestamps
             deltas = file_data.deltas
 
-            for timestamp_index, timestamp in enumerate(timestamps):
-                debug_iterations += 1
-                if timestamp >= threshold:
-                    # trim the timestamp & deltas list from this point forward
-                    trimmed_timestamps = timestamps[timestamp_index:]
-                    trimmed_deltas = deltas[timestamp_index:]
-                    break
+            start = numpy.searchsorted(timestamps, threshold, side="left")
+            stop = len(timestamps)
+            if tail_threshold is not None:
+                stop = numpy.searchsorted(timestamps, tail_threshold, \
+                        side="right")
+
+            # trim the timestamp & deltas list to the window found
+            trimmed_timestamps = timestamps[start:stop]
+            trimmed_deltas = deltas[start:stop]
 
             # If the trimmed file data is empty track it, else store it
             if len(trimmed_timestamps) == 0 or len(trimmed_deltas) == 0:
@@ -172,49 +274,158 @@ class LoadAnalysisLib:
                 file_data.deltas = trimmed_deltas
                 all_file_data[file_data_index] = file_data
 
-        logging.debug(LoadAnalysisLib.line_break)
-        logging.debug("total debug iterations: " + str(debug_iterations))
+        if Diagnostics.enabled:
+            Diagnostics.count("files trimmed", len(all_file_data))
+            Diagnostics.count("rows kept after trimming", \
+                    sum(len(file_data.deltas) for file_data in all_file_data))
 
         # Report any empty lists and quit
         if len(empty_trimmed_file_data_by_file_data_id) > 0:
-            logging.error(LoadAnalysisLib.line_break)
-            logging.error("Trimming the file data by " + \
-                "the timestamp threshold resulted in an empty data set " + \
-                "for files: ")
+            LoadAnalysisLib.report_empty_trimmed_file_data(\
+                    empty_trimmed_file_data_by_file_data_id)
 
-            for file_id in empty_trimmed_file_data_by_file_data_id:
-                logging.error("File: " + file_id)
-            logging.error("Revise those files, or exclude them to " + \
-                    "continue analyzing the data")
+        return all_file_data
 
-            sys.exit(0)
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def compute_common_thresholds(file_data_list, trim_tail=False):
+        # Computes & logs the timestamp threshold shared amongst the file
+        # data, plus the tail timestamp threshold if trim_tail is set (None
+        # otherwise)
 
-        return all_file_data
+        # Compute the timestamp threshold
+        threshold, threshold_file_id = \
+                LoadAnalysisLib.compute_timestamp_threshold(file_data_list)
+
+        logging.info(LoadAnalysisLib.line_break)
+        msg = "Timestamp threshold set at: %s by file: %s" \
+                %  (str(threshold), threshold_file_id)
+        logging.info(msg)
+        if LoadAnalysisLib.output_to_file: Utils.write_to_file("\n\n" + msg)
+        ResultsWriter.record("threshold", file_id=threshold_file_id, \
+                threshold=threshold)
+
+        # Compute the tail timestamp threshold, if requested
+        tail_threshold = None
+        if trim_tail:
+            tail_threshold, tail_threshold_file_id = \
+                LoadAnalysisLib.compute_tail_timestamp_threshold(file_data_list)
+
+            logging.info(LoadAnalysisLib.line_break)
+            msg = "Tail timestamp threshold set at: %s by file: %s" \
+                    %  (str(tail_threshold), tail_threshold_file_id)
+            logging.info(msg)
+            if LoadAnalysisLib.output_to_file:
+                Utils.write_to_file("\n\n" + msg)
+            ResultsWriter.record("tail_threshold", \
+                    file_id=tail_threshold_file_id, \
+                    tail_threshold=tail_threshold)
+
+        return threshold, tail_threshold
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def report_empty_trimmed_file_data(file_ids):
+        # Report the files left empty by trimming and quit
+
+        logging.error(LoadAnalysisLib.line_break)
+        logging.error("Trimming the file data by " + \
+            "the timestamp threshold resulted in an empty data set " + \
+            "for files: ")
+
+        for file_id in file_ids:
+            logging.error("File: " + file_id)
+        logging.error("Revise those files, or exclude them to " + \
+                "continue analyzing the data")
+
+        sys.exit(0)
 
 #-------------------------------------------------------------------------------
     @staticmethod
     def collect_all_timestamps(file_data_list):
-        # Collect the timestamps from each file input
+        # Collect the timestamps from each file input. Untouched file data
+        # sets already hold them in one column, which is returned as is
 
-        all_timestamps = []
+        if isinstance(file_data_list, FileDataSet) and \
+                file_data_list.is_packed():
+            return file_data_list.timestamps
 
-        for file_data in file_data_list:
-            timestamps = file_data.timestamps
-            all_timestamps += timestamps
+        all_timestamps = [file_data.timestamps for file_data in file_data_list]
 
-        return all_timestamps
+        if not all_timestamps:
+            return numpy.empty(0, dtype=numpy.int64)
+
+        return numpy.concatenate(all_timestamps)
 #-------------------------------------------------------------------------------
     @staticmethod
     def collect_all_deltas(file_data_list):
-        # Collect the deltas from each file input
+        # Collect the deltas from each file input. Untouched file data sets
+        # already hold them in one column, which is returned as is
 
-        all_deltas = []
+        if isinstance(file_data_list, FileDataSet) and \
+                file_data_list.is_packed():
+            return file_data_list.deltas
 
-        for file_data in file_data_list:
-            deltas = file_data.deltas
-            all_deltas += deltas
+        all_deltas = [file_data.deltas for file_data in file_data_list]
+
+        if not all_deltas:
+            return numpy.empty(0, dtype=numpy.int64)
+
+        return numpy.concatenate(all_deltas)
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def merge_timelines(file_data_list):
+        # Merges the timelines of the files into one sorted by timestamp.
+        # Returns the timestamps, deltas & index of the file (in
+        # file_data_list) of every value. Values sharing a timestamp keep the
+        # file order. *Note*: Requires the timestamps of each file to be
+        # sorted in ascending order
+        # The stable sort (timsort) finds the file's sorted runs in the
+        # concatenated column & merges them, so this costs O(n log k) for k
+        # files rather than a full O(n log n) sort
+
+        timestamps = LoadAnalysisLib.collect_all_timestamps(file_data_list)
+        deltas = LoadAnalysisLib.collect_all_deltas(file_data_list)
+
+        lengths = [len(file_data.timestamps) for file_data in file_data_list]
+        file_indexes = numpy.repeat(numpy.arange(len(lengths), \
+                dtype=numpy.int32), lengths)
+
+        order = numpy.argsort(timestamps, kind="stable")
+
+        return timestamps[order], deltas[order], file_indexes[order]
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def iter_merged_timeline(file_data_list, chunk_size=65536):
+        # Lazy version of merge_timelines, yielding a (timestamp, delta,
+        # file index) tuple per value through a heap of the k files, so
+        # only chunk_size values per file are converted at a time
+        # *Note*: Requires the timestamps of each file to be sorted in
+        # ascending order
+
+        file_timelines = [LoadAnalysisLib.iter_file_timeline(file_data, \
+                file_index, chunk_size) \
+                for file_index, file_data in enumerate(file_data_list)]
+
+        # Tuples compare by timestamp, then file index
+        for timestamp, file_index, delta in heapq.merge(*file_timelines):
+            yield timestamp, delta, file_index
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def iter_file_timeline(file_data, file_index, chunk_size):
+        # Yields the (timestamp, file index, delta) tuples of a file, turning
+        # its columns into Python ints a chunk at a time
+
+        for start in range(0, len(file_data.timestamps), chunk_size):
+            stop = start + chunk_size
+            timestamps = file_data.timestamps[start:stop].tolist()
+            deltas = file_data.deltas[start:stop].tolist()
+
+            for timestamp, delta in zip(timestamps, deltas):
+                yield timestamp, file_index, delta
 
-        return all_deltas
 #-------------------------------------------------------------------------------
     @staticmethod
     def analyze(file_data_list, dataset_name, log=False):
@@ -227,109 +438,419 @@ class LoadAnalysisLib:
         std = numpy.std(all_deltas)
 
         if log:
-            logging.info(LoadAnalysisLib.line_break)
-            msg = "Analysis - (%s) data: median = %s, std = %s" \
-                    % (dataset_name, str(median), str(std))
-            logging.info(msg)
-
-            if LoadAnalysisLib.output_to_file:
-                if dataset_name == "original":
-                    Utils.write_to_file("\n" + msg)
-                else:
-                    Utils.write_to_file("\n\n" + msg)
+            LoadAnalysisLib.log_analysis(dataset_name, median, std)
 
         return median, std
 #-------------------------------------------------------------------------------
     @staticmethod
-    def cleanup_file_data(all_file_data, cleanup_level):
-        # Clean up the file data by removing any data values that are not +/-
-        # the level of stds indicated by cleanup_level
+    def log_analysis(dataset_name, median, std):
+        # Log the analysis of a dataset
 
         logging.info(LoadAnalysisLib.line_break)
-        msg = "Cleaning up outliers in the data that " + \
-                "are not within +/- (%s) standard deviation(s) ..." % \
-                str(cleanup_level)
+        msg = "Analysis - (%s) data: median = %s, std = %s" \
+                % (dataset_name, str(median), str(std))
         logging.info(msg)
-        if LoadAnalysisLib.output_to_file: Utils.write_to_file("\n\n" + msg)
 
-        # Analyze data & set up cleaning boundaries
-        median, std = LoadAnalysisLib.analyze(all_file_data, "original")
-        lower_boundary = median - (std * cleanup_level)
-        upper_boundary = median + (std * cleanup_level)
-
-        all_file_data_cleaned = []
+        if LoadAnalysisLib.output_to_file:
+            if dataset_name == "original":
+                Utils.write_to_file("\n" + msg)
+            else:
+                Utils.write_to_file("\n\n" + msg)
+        ResultsWriter.record("analysis", dataset_name, median=median, std=std)
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def cleanup_file_data(all_file_data, cleanup_level, median=None, \
+            std=None, max_iterations=1, strategy="std"):
+        # Clean up the file data by removing any data values that are outside
+        # of the boundaries set by strategy & cleanup_level (see
+        # compute_cleanup_boundaries). The median & std of the file data are
+        # computed unless given. With max_iterations above 1 the clipping is
+        # repeated against the boundaries of what is left, until no more
+        # values are removed or the cap is reached
+
+        LoadAnalysisLib.log_cleanup_level(cleanup_level, strategy)
+
+        # Analyze data, unless already done
+        if strategy == "std" and (median is None or std is None):
+            median, std = LoadAnalysisLib.analyze(all_file_data, "original")
+
+        all_file_data = FileDataSet.pack(all_file_data)
+        deltas = all_file_data.deltas
+        keep = numpy.ones(len(deltas), dtype=bool)
+        total_kept = len(deltas)
 
         # Scrub the file data for values that are not within the cleaning
         # boundaries
-        for file_data_index, file_data in enumerate(all_file_data):
-            clean_file_data = FileData()
-            clean_timestamps = []
-            clean_deltas = []
+        for iteration in range(1, max(max_iterations, 1) + 1):
+            kept_deltas = deltas
+            if iteration > 1:
+                kept_deltas = deltas[keep]
+                median, std = None, None
+
+            # Set up cleaning boundaries
+            lower_boundary, upper_boundary = \
+                    LoadAnalysisLib.compute_cleanup_boundaries(kept_deltas, \
+                    cleanup_level, strategy, median, std)
+            del kept_deltas
+
+            keep &= deltas >= lower_boundary
+            keep &= deltas <= upper_boundary
+
+            previously_kept = total_kept
+            total_kept = int(numpy.count_nonzero(keep))
+            logging.debug("cleanup iteration %s: removed %s value(s)", \
+                    iteration, previously_kept - total_kept)
+
+            if total_kept == previously_kept or total_kept == 0:
+                break
+
+        if max_iterations > 1:
+            logging.info(LoadAnalysisLib.line_break)
+            logging.info("Cleanup stopped after %s iteration(s)" % iteration)
 
-            file_id = file_data.file_id
-            timestamps = file_data.timestamps
-            deltas = file_data.deltas
+        # Report the values removed from each file
+        total_removed = numpy.zeros(len(keep) + 1, dtype=numpy.int64)
+        numpy.cumsum(~keep, out=total_removed[1:])
+        LoadAnalysisLib.log_removed_values(strategy, \
+                [file_data.file_id for file_data in all_file_data], \
+                numpy.diff(total_removed[all_file_data.offsets]))
 
-            for delta_index, delta in enumerate(deltas):
-                if delta >= lower_boundary and delta <= upper_boundary:
-                    clean_timestamps.append(timestamps[delta_index])
-                    clean_deltas.append(deltas[delta_index])
-            
-            # If the clean timestamps & deltas are not empty lists, store them
-            if clean_timestamps and clean_deltas:
-                clean_file_data.file_id = file_id
-                clean_file_data.timestamps = clean_timestamps
-                clean_file_data.deltas = clean_deltas
-                all_file_data_cleaned.append(clean_file_data)
-
-        # If debug set, print clean up logs
-        logging_level = \
-                logging.getLevelName(logging.getLogger().getEffectiveLevel())
-        if logging_level == 'DEBUG':
-            for clean_file_data in all_file_data_cleaned:
-                timestamps_len = len(clean_file_data.timestamps)
-                deltas_len = len(clean_file_data.deltas)
-
-                logging.debug("cleanup-file: " + clean_file_data.file_id + \
-                " -- total timestamps: " + str(timestamps_len) + \
-                " -- total deltas: " + str(deltas_len))
+        # Only keep the files whose clean data is not empty
+        all_file_data_cleaned = all_file_data.select(keep)
+
+        if Diagnostics.enabled:
+            Diagnostics.count("cleanup iterations", iteration)
+            Diagnostics.count("files kept after cleanup", \
+                    len(all_file_data_cleaned))
+            Diagnostics.count("rows kept after cleanup", total_kept)
 
         return all_file_data_cleaned
 
 #-------------------------------------------------------------------------------
     @staticmethod
-    def compute_mean_of_file_data_stds(file_data_list):
-        all_stds = []
+    def compute_cleanup_boundaries(deltas, cleanup_level, strategy="std", \
+            median=None, std=None):
+        # Computes the (lower, upper) boundaries of the deltas kept by a
+        # cleanup strategy:
+        #   std:        median +/- cleanup_level stds
+        #   mad:        median +/- cleanup_level median absolute deviations,
+        #               scaled to match the std of normally distributed data
+        #   iqr:        quartiles -/+ cleanup_level interquartile ranges
+        #   percentile: the cleanup_level to (100 - cleanup_level) percentiles
+        # The median & std are computed from deltas unless given
+
+        if strategy == "std":
+            if median is None:
+                median = numpy.median(deltas)
+            if std is None:
+                std = numpy.std(deltas)
+
+            return median - (std * cleanup_level), \
+                    median + (std * cleanup_level)
+
+        if strategy == "mad":
+            if median is None:
+                median = LoadAnalysisLib.compute_quantiles(deltas, [0.5])[0]
+            mad = LoadAnalysisLib.compute_quantiles(\
+                    numpy.abs(deltas - median), [0.5])[0] * \
+                    LoadAnalysisLib.mad_scale
+
+            return median - (mad * cleanup_level), \
+                    median + (mad * cleanup_level)
+
+        if strategy == "iqr":
+            first_quartile, third_quartile = \
+                    LoadAnalysisLib.compute_quantiles(deltas, [0.25, 0.75])
+            iqr = third_quartile - first_quartile
+
+            return first_quartile - (iqr * cleanup_level), \
+                    third_quartile + (iqr * cleanup_level)
+
+        if strategy == "percentile":
+            LoadAnalysisLib.check_cleanup_level(cleanup_level, strategy)
+            lower_boundary, upper_boundary = \
+                    LoadAnalysisLib.compute_quantiles(deltas, \
+                    [cleanup_level / 100.0, 1 - cleanup_level / 100.0])
+
+            return lower_boundary, upper_boundary
+
+        raise ValueError("Unknown cleanup strategy: %s" % strategy)
 
-        # Compute the std of the deltas for each file input & collect it
-        for index, file_data in enumerate(file_data_list):
-            deltas = file_data.deltas
-            std = numpy.std(deltas)
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def check_cleanup_level(cleanup_level, strategy):
+        # Raises a ValueError for a cleanup level the strategy can't apply.
+        # The percentile strategy keeps the values between the level & the
+        # (100 - level) percentiles, which are inverted from 50 on
+
+        if strategy == "percentile" and not 0 <= cleanup_level < 50:
+            raise ValueError("The percentile cleanup level must be " + \
+                    "within [0, 50): %s" % cleanup_level)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def compute_quantiles(values, quantiles):
+        # Computes quantiles with linear interpolation, like numpy.quantile,
+        # selecting the ranks needed with numpy.partition instead of sorting
+
+        if len(values) == 0:
+            return numpy.full(len(quantiles), numpy.nan)
+
+        positions = numpy.asarray(quantiles, dtype=numpy.float64) * \
+                (len(values) - 1)
+        lower = numpy.floor(positions).astype(numpy.intp)
+        upper = numpy.ceil(positions).astype(numpy.intp)
+
+        partitioned = numpy.partition(values, \
+                numpy.union1d(lower, upper))
+        fraction = positions - lower
+
+        return partitioned[lower] * (1 - fraction) + \
+                partitioned[upper] * fraction
 
-            all_stds.append(std)
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def log_cleanup_level(cleanup_level, strategy="std"):
+        # Log the cleanup about to be performed
+
+        logging.info(LoadAnalysisLib.line_break)
+        if strategy == "mad":
+            msg = "Cleaning up outliers in the data that " + \
+                    "are not within +/- (%s) median absolute " \
+                    "deviation(s) ..." % str(cleanup_level)
+        elif strategy == "iqr":
+            msg = "Cleaning up outliers in the data that " + \
+                    "are not within (%s) interquartile range(s) " \
+                    "of the quartiles ..." % str(cleanup_level)
+        elif strategy == "percentile":
+            msg = "Cleaning up outliers in the data that " + \
+                    "are not within the (%s) to (%s) percentiles ..." % \
+                    (str(cleanup_level), str(100 - cleanup_level))
+        else:
+            msg = "Cleaning up outliers in the data that " + \
+                    "are not within +/- (%s) standard deviation(s) ..." % \
+                    str(cleanup_level)
+        logging.info(msg)
+        if LoadAnalysisLib.output_to_file: Utils.write_to_file("\n\n" + msg)
+        ResultsWriter.record("cleanup", strategy=strategy, \
+                cleanup_level=cleanup_level)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def log_removed_values(strategy, file_ids, removed_counts):
+        # Log the amount of values the cleanup removed from each file
+
+        removed_counts = numpy.asarray(removed_counts)
+
+        logging.info(LoadAnalysisLib.line_break)
+        logging.info("Cleanup (%s) removed %s value(s) in total" % \
+                (strategy, str(int(numpy.sum(removed_counts)))))
+
+        # Only the files that lost values are listed
+        for index in numpy.flatnonzero(removed_counts):
+            logging.info("cleanup-file: %s -- removed: %s", file_ids[index], \
+                    removed_counts[index])
+
+        if ResultsWriter.records_file is not None:
+            for file_id, removed_count in zip(file_ids, \
+                    removed_counts.tolist()):
+                ResultsWriter.record("removed", file_id=file_id, \
+                        strategy=strategy, removed=removed_count)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def compute_mean_of_file_data_stds(file_data_list, file_stats=None):
+        # Computes & logs the mean of the std of the deltas of each file,
+        # taking the stds from file_stats (see compute_file_statistics) if
+        # already computed. Returns the mean
+
+        if file_stats is None:
+            file_stats, moments = LoadAnalysisLib.compute_file_statistics(\
+                    file_data_list, medians=False)
+
+        mean_of_all_stds = numpy.mean(file_stats.stds())
+        LoadAnalysisLib.log_mean_of_stds(mean_of_all_stds)
+
+        return mean_of_all_stds
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def compute_file_statistics(file_data_list, jobs=1, medians=True):
+        # Computes the count, mean, variance, min, max & median of the deltas
+        # of every file in one stage over the deltas column, without
+        # converting each file again. Returns them as a FileStatistics table
+        # along with the global moments merged from the per file ones. The
+        # medians, which take a loop over the files, are left nan unless
+        # medians is set. With jobs other than 1 the files are split among
+        # that many processes (0 for one per CPU)
+
+        if jobs < 0:
+            raise ValueError("The amount of jobs must be 0 or more: %s" % \
+                    jobs)
+
+        deltas = LoadAnalysisLib.collect_all_deltas(file_data_list)
+        offsets = numpy.zeros(len(file_data_list) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(file_data.deltas) for file_data in file_data_list], \
+                out=offsets[1:])
+        file_ids = [file_data.file_id for file_data in file_data_list]
+
+        total_groups = min(jobs or os.cpu_count() or 1, len(file_ids))
+        if total_groups > 1:
+            # Hand each process the columns of a contiguous group of files
+            groups = numpy.array_split(numpy.arange(len(file_ids)), \
+                    total_groups)
+            group_offsets = [offsets[group[0]:group[-1] + 2] \
+                    for group in groups]
+            group_deltas = [deltas[group_offset[0]:group_offset[-1]] \
+                    for group_offset in group_offsets]
+            group_offsets = [group_offset - group_offset[0] \
+                    for group_offset in group_offsets]
+
+            with concurrent.futures.ProcessPoolExecutor(total_groups) as pool:
+                partials = list(pool.map(\
+                        LoadAnalysisLib.compute_partial_statistics, \
+                        group_deltas, group_offsets, \
+                        [medians] * total_groups))
+
+            columns = [numpy.concatenate(column) for column in zip(*partials)]
+        else:
+            columns = LoadAnalysisLib.compute_partial_statistics(deltas, \
+                    offsets, medians)
+
+        counts, means, m2s, minimums, maximums, file_medians = columns
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            variances = m2s / counts
+
+        file_stats = FileStatistics(file_ids, counts, means, variances, \
+                minimums, maximums, file_medians)
+        moments = MomentAccumulator.from_partials(counts, means, m2s, \
+                minimums, maximums)
+
+        return file_stats, moments
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def compute_partial_statistics(deltas, offsets, medians=True):
+        # Computes the count, mean, sum of squared differences from the mean
+        # (m2), min, max & median of each file, whose deltas live in
+        # deltas[offsets[i]:offsets[i+1]]. Sums are reduced per file with
+        # numpy.add.reduceat, only the medians take a loop over the files
+        # (skipped, leaving them nan, unless medians is set)
+
+        counts = numpy.diff(offsets)
+        total_files = len(counts)
+
+        means = numpy.full(total_files, numpy.nan)
+        m2s = numpy.full(total_files, numpy.nan)
+        minimums = numpy.full(total_files, numpy.nan)
+        maximums = numpy.full(total_files, numpy.nan)
+        file_medians = numpy.full(total_files, numpy.nan)
+
+        # reduceat needs non empty segments, which then end where the next
+        # one starts
+        non_empty = counts > 0
+        if non_empty.any():
+            starts = offsets[:-1][non_empty]
+            values = deltas.astype(numpy.float64)
+
+            means[non_empty] = numpy.add.reduceat(values, starts) / \
+                    counts[non_empty]
+            values -= numpy.repeat(means[non_empty], counts[non_empty])
+            m2s[non_empty] = numpy.add.reduceat(numpy.square(values), starts)
+            minimums[non_empty] = numpy.minimum.reduceat(deltas, starts)
+            maximums[non_empty] = numpy.maximum.reduceat(deltas, starts)
+
+            if medians:
+                for index in numpy.flatnonzero(non_empty):
+                    file_medians[index] = numpy.median(\
+                            deltas[offsets[index]:offsets[index + 1]])
+
+        return counts, means, m2s, minimums, maximums, file_medians
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def log_file_statistics(dataset_name, file_stats):
+        # Log the statistics of each file as a table
+
+        logging.info(LoadAnalysisLib.line_break)
+        msg = "File statistics - (%s) data:\n" % dataset_name + \
+                "%12s %14s %14s %12s %12s %12s  %s" % ("count", "mean", \
+                "std", "min", "max", "median", "file")
+
+        for index, std in enumerate(file_stats.stds()):
+            msg += "\n%12d %14.4f %14.4f %12g %12g %12g  %s" % \
+                    (file_stats.counts[index], file_stats.means[index], \
+                    std, file_stats.minimums[index], \
+                    file_stats.maximums[index], file_stats.medians[index], \
+                    file_stats.file_ids[index])
+
+        for line in msg.split("\n"):
+            logging.info(line)
+        if LoadAnalysisLib.output_to_file: Utils.write_to_file("\n\n" + msg)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def log_mean_of_stds(mean_of_all_stds):
+        # Log the mean of all delta standard deviations
 
-        mean_of_all_stds = numpy.mean(all_stds)
         logging.info(LoadAnalysisLib.line_break)
         msg = "Mean of all delta standard deviations found " + \
                 "(from all file data): %s" % str(mean_of_all_stds)
         logging.info(msg)
         if LoadAnalysisLib.output_to_file: Utils.write_to_file("\n\n" + msg)
+        ResultsWriter.record("mean_of_stds", mean_of_stds=mean_of_all_stds)
         
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def compute_histogram(file_data_list, relative_error=None):
+        # Bins the deltas of the file data into a LogLinearHistogram, a chunk
+        # at a time so the temporary arrays stay small
+
+        if relative_error is None:
+            relative_error = LoadAnalysisLib.histogram_error
+
+        histogram = LogLinearHistogram(relative_error)
+        chunk_size = LoadAnalysisLib.histogram_chunk_size
+
+        for file_data in file_data_list:
+            for start in range(0, len(file_data.deltas), chunk_size):
+                histogram.add(file_data.deltas[start:start + chunk_size])
+
+        return histogram
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def log_percentiles(dataset_name, histogram, percentiles):
+        # Log the percentiles of a dataset read off of its histogram
+
+        values = histogram.quantiles(numpy.asarray(percentiles, \
+                dtype=numpy.float64) / 100.0)
+        names = ["p%g" % percentile for percentile in percentiles]
+
+        logging.info(LoadAnalysisLib.line_break)
+        msg = "Percentiles - (%s) data: " % dataset_name + ", ".join(\
+                "%s = %s" % (name, str(value)) \
+                for name, value in zip(names, values))
+        logging.info(msg)
+        if LoadAnalysisLib.output_to_file: Utils.write_to_file("\n\n" + msg)
+        ResultsWriter.record("percentiles", dataset_name, \
+                **dict(zip(names, values)))
+
 #-------------------------------------------------------------------------------
     @staticmethod
     def log_debug_file_data(title, file_data_list):
-        # Prints the file data provided
+        # Prints the file data provided, if debug logging is on
+
+        if not Diagnostics.enabled:
+            return
 
         logging.debug(LoadAnalysisLib.line_break)
-        logging.debug(title + " data:")
+        logging.debug("%s data:", title)
         logging.debug("---------------")
 
-        for index, file_data in enumerate(file_data_list):
-            timestamps_len = len(file_data.timestamps)
-            deltas_len = len(file_data.deltas)
-
-            logging.debug("file: " + file_data.file_id + \
-            " -- total timestamps: " + str(timestamps_len) + \
-            " -- total deltas: " + str(deltas_len))
+        for file_data in file_data_list:
+            logging.debug("file: %s -- total timestamps: %s -- total " \
+                    "deltas: %s", file_data.file_id, \
+                    len(file_data.timestamps), len(file_data.deltas))
             
 #-------------------------------------------------------------------------------
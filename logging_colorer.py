@@ -94,13 +94,21 @@ def add_coloring_to_emit_ansi(fn):
     return new
 
 import platform
-if platform.system()=='Windows':
-    # Windows does not support ANSI escapes and we are using API calls to set the console color
-    logging.StreamHandler.emit = add_coloring_to_emit_windows(logging.StreamHandler.emit)
-else:
-    # all non-Windows platforms are supporting ANSI escapes so we use them
-    logging.StreamHandler.emit = add_coloring_to_emit_ansi(logging.StreamHandler.emit)
-    #log = logging.getLogger()
-    #log.addFilter(log_filter())
-    #//hdlr = logging.StreamHandler()
-    #//hdlr.setFormatter(formatter())
+
+def install():
+    # Patches logging.StreamHandler to color its records by level. Only done
+    # on request (e.g. when logging to a terminal) & at most once
+    if getattr(logging.StreamHandler, '_colored', False):
+        return
+    logging.StreamHandler._colored = True
+
+    if platform.system()=='Windows':
+        # Windows does not support ANSI escapes and we are using API calls to set the console color
+        logging.StreamHandler.emit = add_coloring_to_emit_windows(logging.StreamHandler.emit)
+    else:
+        # all non-Windows platforms are supporting ANSI escapes so we use them
+        logging.StreamHandler.emit = add_coloring_to_emit_ansi(logging.StreamHandler.emit)
+        #log = logging.getLogger()
+        #log.addFilter(log_filter())
+        #//hdlr = logging.StreamHandler()
+        #//hdlr.setFormatter(formatter())
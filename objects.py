@@ -1,7 +1,165 @@
+import numpy
+
 class FileData:
     # Class to store the data from each file input
 
+    __slots__ = ("file_id", "timestamps", "deltas")
+
     def __init__(self, file_id=None, timestamps=None, deltas=None):
         self.file_id = file_id
         self.timestamps = timestamps
         self.deltas = deltas
+
+class FileDataSet(list):
+    # List of the FileData of a run, where the timestamps & deltas of each
+    # file are views into one pair of contiguous columns shared by all files.
+    # The data of file i lives in columns[offsets[i]:offsets[i+1]]
+
+    __slots__ = ("timestamps", "deltas", "offsets")
+
+    def __init__(self, file_ids=(), timestamps=None, deltas=None, \
+            offsets=None):
+        list.__init__(self)
+
+        if timestamps is None:
+            timestamps = numpy.empty(0, dtype=numpy.int64)
+            deltas = numpy.empty(0, dtype=numpy.int64)
+            offsets = numpy.zeros(1, dtype=numpy.int64)
+
+        self.timestamps = timestamps
+        self.deltas = deltas
+        self.offsets = offsets
+
+        for index, file_id in enumerate(file_ids):
+            start, stop = offsets[index], offsets[index + 1]
+            self.append(FileData(file_id, timestamps[start:stop], \
+                    deltas[start:stop]))
+
+    @staticmethod
+    def from_columns(file_ids, timestamp_columns, delta_columns):
+        # Packs the per file columns into a new FileDataSet
+
+        lengths = [len(timestamps) for timestamps in timestamp_columns]
+        offsets = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+
+        if lengths:
+            timestamps = numpy.concatenate(timestamp_columns)
+            deltas = numpy.concatenate(delta_columns)
+        else:
+            timestamps = numpy.empty(0, dtype=numpy.int64)
+            deltas = numpy.empty(0, dtype=numpy.int64)
+
+        return FileDataSet(file_ids, timestamps, deltas, offsets)
+
+    @staticmethod
+    def pack(file_data_list):
+        # Returns the file data as a packed FileDataSet, as is if it already
+        # is one
+
+        if isinstance(file_data_list, FileDataSet) and \
+                file_data_list.is_packed():
+            return file_data_list
+
+        return FileDataSet.from_columns(\
+                [file_data.file_id for file_data in file_data_list], \
+                [file_data.timestamps for file_data in file_data_list], \
+                [file_data.deltas for file_data in file_data_list])
+
+    def select(self, keep):
+        # Returns a new FileDataSet holding the values flagged in the boolean
+        # mask keep, which spans the shared columns. Files left without
+        # values are dropped
+
+        total_kept = numpy.zeros(len(keep) + 1, dtype=numpy.int64)
+        numpy.cumsum(keep, out=total_kept[1:])
+        counts = numpy.diff(total_kept[self.offsets])
+
+        non_empty = counts > 0
+        offsets = numpy.zeros(numpy.count_nonzero(non_empty) + 1, \
+                dtype=numpy.int64)
+        numpy.cumsum(counts[non_empty], out=offsets[1:])
+        file_ids = [file_data.file_id \
+                for file_data, kept in zip(self, non_empty) if kept]
+
+        return FileDataSet(file_ids, self.timestamps[keep], \
+                self.deltas[keep], offsets)
+
+    def is_packed(self):
+        # Checks whether every FileData still views its own slice of the
+        # shared columns, in which case the columns hold exactly their data
+
+        if len(self) != len(self.offsets) - 1:
+            return False
+
+        for index, file_data in enumerate(self):
+            start, stop = self.offsets[index], self.offsets[index + 1]
+            if not FileDataSet.is_view(file_data.timestamps, \
+                    self.timestamps, start, stop) or \
+                    not FileDataSet.is_view(file_data.deltas, \
+                    self.deltas, start, stop):
+                return False
+
+        return True
+
+    @staticmethod
+    def is_view(array, column, start, stop):
+        # Checks whether array is exactly column[start:stop]
+
+        if not isinstance(array, numpy.ndarray) or len(array) != stop - start:
+            return False
+        if len(array) == 0:
+            return True
+
+        address = array.__array_interface__["data"][0]
+        column_address = column.__array_interface__["data"][0]
+
+        return address == column_address + int(start) * column.itemsize and \
+                array.strides == column.strides
+
+class FileStatistics:
+    # Table of the statistics of the deltas of each file of a run, one
+    # array per column, row i describing file_ids[i]. Variances are
+    # population variances & files without deltas hold nan
+
+    __slots__ = ("file_ids", "counts", "means", "variances", "minimums", \
+            "maximums", "medians")
+
+    def __init__(self, file_ids, counts, means, variances, minimums, \
+            maximums, medians):
+        self.file_ids = file_ids
+        self.counts = counts
+        self.means = means
+        self.variances = variances
+        self.minimums = minimums
+        self.maximums = maximums
+        self.medians = medians
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def stds(self):
+        # Population standard deviation of each file, like numpy.std
+
+        return numpy.sqrt(self.variances)
+
+class WindowStatistics:
+    # Table of the statistics of the deltas falling into each time window
+    # [starts[i], ends[i]) of a run. percentile_values[i, j] holds the
+    # percentiles[j] percentile of window i
+
+    __slots__ = ("starts", "ends", "counts", "means", "stds", \
+            "percentiles", "percentile_values")
+
+    def __init__(self, starts, ends, counts, means, stds, percentiles, \
+            percentile_values):
+        self.starts = starts
+        self.ends = ends
+        self.counts = counts
+        self.means = means
+        self.stds = stds
+        self.percentiles = percentiles
+        self.percentile_values = percentile_values
+
+    def __len__(self):
+        return len(self.starts)
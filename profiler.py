@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import logging
+import tracemalloc
+import contextlib
+from diagnostics import Diagnostics
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is then left out
+    resource = None
+
+class Profiler:
+    # Records the wall time, CPU time, peak memory & rows processed of each
+    # phase of a run, for the --profile report. Phases are only measured
+    # once enabled is set, so the instrumentation costs nothing otherwise
+
+    enabled = False
+    # Also trace the peak of the Python & numpy allocations made in each
+    # phase with tracemalloc, which slows the run down
+    trace_memory = False
+    # Name of the phase to run under cProfile, if any, & where its stats
+    # are dumped
+    cprofile_phase = None
+    cprofile_directory = "results"
+    # Phases of a run, in order
+    phase_names = ["parse", "analyze", "cleanup", "analyze_clean", "trim", \
+            "stds", "window", "histogram", "plot", "streaming", "shard", \
+            "merge"]
+    # Records of the phases measured so far
+    phases = []
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def enable(trace_memory=False, cprofile_phase=None):
+        # Starts recording the phases of the run
+
+        Profiler.enabled = True
+        Profiler.trace_memory = trace_memory
+        Profiler.cprofile_phase = cprofile_phase
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def disable():
+        # Stops recording & forgets the phases recorded, e.g. between the
+        # commands of the analysis server
+
+        Profiler.enabled = False
+        Profiler.cprofile_phase = None
+        Profiler.phases = []
+
+        if Profiler.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        Profiler.trace_memory = False
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    @contextlib.contextmanager
+    def phase(name):
+        # Measures the code run in the with block as one phase. Yields the
+        # phase's record, where the block can set the "rows" it processed.
+        # The diagnostic counters of the phase are logged at its end
+
+        record = {"phase": name, "rows": None}
+
+        if not Profiler.enabled:
+            try:
+                yield record
+            finally:
+                Diagnostics.flush(name)
+            return
+
+        profile = None
+        if Profiler.cprofile_phase == name:
+            profile = cProfile.Profile()
+        if Profiler.trace_memory:
+            tracemalloc.reset_peak()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profile:
+            profile.enable()
+
+        try:
+            yield record
+        finally:
+            if profile:
+                profile.disable()
+
+            record["wall_time"] = time.perf_counter() - wall_start
+            record["cpu_time"] = time.process_time() - cpu_start
+            record["peak_rss_mb"] = Profiler.get_peak_rss_mb()
+            if Profiler.trace_memory:
+                record["peak_traced_mb"] = \
+                        tracemalloc.get_traced_memory()[1] / 1024.0 ** 2
+            Profiler.phases.append(record)
+
+            if profile:
+                Profiler.dump_cprofile(profile, name)
+            Diagnostics.flush(name)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def get_peak_rss_mb():
+        # Peak resident set size of the process so far, in MB (None where
+        # unavailable)
+
+        if resource is None:
+            return None
+
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # Reported in bytes on macOS & in KB elsewhere
+        if sys.platform == "darwin":
+            return peak_rss / 1024.0 ** 2
+
+        return peak_rss / 1024.0
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def count_rows(file_data_list):
+        # Total amount of rows held by the file data
+
+        return sum(len(file_data.deltas) for file_data in file_data_list)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def dump_cprofile(profile, name):
+        # Dumps the cProfile stats of a phase, to be read with pstats or
+        # snakeviz
+
+        filepath = os.path.join(Profiler.cprofile_directory, \
+                "%s.prof" % name.replace(" ", "_"))
+
+        try:
+            profile.dump_stats(filepath)
+            logging.info("cProfile stats of phase '%s' written to: %s" % \
+                    (name, filepath))
+        except (IOError, OSError) as e:
+            logging.error("Could not write the cProfile stats: %s" % e)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def get_report():
+        # Returns the recorded phases along with their totals
+
+        total = {"phase": "total", "rows": None, \
+                "wall_time": sum(record["wall_time"] \
+                for record in Profiler.phases), \
+                "cpu_time": sum(record["cpu_time"] \
+                for record in Profiler.phases), \
+                "peak_rss_mb": Profiler.get_peak_rss_mb()}
+        if Profiler.trace_memory and Profiler.phases:
+            total["peak_traced_mb"] = max(record["peak_traced_mb"] \
+                    for record in Profiler.phases)
+
+        return {"phases": Profiler.phases, "total": total}
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def log_report():
+        # Logs the recorded phases as a table
+
+        line_break = "-" * 77
+        header = "%-20s %10s %10s %12s %10s %10s" % ("phase", "wall (s)", \
+                "cpu (s)", "rows", "rows/s", "peak MB")
+
+        report = Profiler.get_report()
+
+        logging.info(line_break)
+        logging.info("Profile:")
+        logging.info(header)
+        logging.info(line_break)
+
+        for record in report["phases"] + [report["total"]]:
+            rows = rows_per_second = "-"
+            if record["rows"] is not None:
+                rows = str(record["rows"])
+                if record["wall_time"] > 0:
+                    rows_per_second = "%.0f" % \
+                            (record["rows"] / record["wall_time"])
+
+            peak = "-"
+            if record.get("peak_traced_mb") is not None:
+                peak = "%.1f" % record["peak_traced_mb"]
+            elif record["peak_rss_mb"] is not None:
+                peak = "%.1f" % record["peak_rss_mb"]
+
+            logging.info("%-20s %10.3f %10.3f %12s %10s %10s" % \
+                    (record["phase"], record["wall_time"], \
+                    record["cpu_time"], rows, rows_per_second, peak))
+
+        if Profiler.trace_memory:
+            logging.info("Peak MB is the peak traced by tracemalloc " + \
+                    "within each phase")
+        else:
+            logging.info("Peak MB is the peak RSS of the process so far")
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def write_report(filepath):
+        # Writes the recorded phases as JSON
+
+        with open(filepath, "w") as report_file:
+            json.dump(Profiler.get_report(), report_file, indent=2)
+            report_file.write("\n")
+
+        logging.info("Profile written to: %s" % filepath)
+
+#-------------------------------------------------------------------------------
@@ -0,0 +1,173 @@
+import os
+import csv
+import json
+import datetime
+import atexit
+import numpy
+
+class ResultsWriter:
+    # Writes the results of a run through handles kept open (& buffered)
+    # for the whole run: the free-form text of --output-to-file & the
+    # structured records of every statistic computed. Records go out as
+    # JSON lines or as long format CSV rows (one statistic per row), each
+    # tagged with the run's info so the files of many runs can be
+    # concatenated & compared without scraping logs
+
+    formats = ["json", "csv"]
+    # The run's info leads every CSV row, like it is part of every JSON line
+    run_info_columns = ["run_id", "data_dirs", "cleanup_level", \
+            "cleanup_strategy", "trim_tail"]
+    csv_columns = run_info_columns + ["record", "dataset", "file_id", \
+            "statistic", "value"]
+    buffer_size = 1024 * 1024
+
+    text_file = None
+    text_filepath = None
+    records_file = None
+    records_format = None
+    csv_writer = None
+    run_info = {}
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def write_text(filepath, data):
+        # Appends text to filepath, opening it on first use
+
+        if ResultsWriter.text_filepath != filepath:
+            ResultsWriter.close_text()
+            ResultsWriter.text_file = open(filepath, "a", \
+                    ResultsWriter.buffer_size)
+            ResultsWriter.text_filepath = filepath
+
+        ResultsWriter.text_file.write(data)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def open_records(filepath, records_format=None, run_info=None):
+        # Starts writing the structured records of the run to filepath (in
+        # append mode). The format defaults to csv for .csv files & json
+        # otherwise
+
+        if records_format is None:
+            records_format = "json"
+            if filepath.endswith(".csv"):
+                records_format = "csv"
+        if records_format not in ResultsWriter.formats:
+            raise ValueError("Unknown results format: %s" % records_format)
+
+        ResultsWriter.close_records()
+        ResultsWriter.records_file = open(filepath, "a", \
+                ResultsWriter.buffer_size, newline="")
+        ResultsWriter.records_format = records_format
+        ResultsWriter.run_info = dict(run_info or {})
+        # Runs started within the same second still get their own id
+        ResultsWriter.run_info.setdefault("run_id", "%s-%s" % \
+                (datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%f"), \
+                os.getpid()))
+
+        if records_format == "csv":
+            ResultsWriter.csv_writer = csv.writer(ResultsWriter.records_file)
+            # Only new files get a header, so runs can share a file
+            if ResultsWriter.records_file.tell() == 0:
+                ResultsWriter.csv_writer.writerow(ResultsWriter.csv_columns)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def record(record, dataset=None, file_id=None, **statistics):
+        # Writes a record of statistics, e.g. record("analysis",
+        # dataset="original", median=101.0, std=435.9). Does nothing unless
+        # open_records was called
+
+        if ResultsWriter.records_file is None:
+            return
+
+        statistics = dict((name, ResultsWriter.to_builtin(value)) \
+                for name, value in statistics.items())
+
+        if ResultsWriter.records_format == "json":
+            line = dict(ResultsWriter.run_info, record=record)
+            if dataset is not None:
+                line["dataset"] = dataset
+            if file_id is not None:
+                line["file_id"] = file_id
+            line.update(statistics)
+
+            ResultsWriter.records_file.write(json.dumps(line) + "\n")
+        else:
+            run_info = [ResultsWriter.run_info.get(column) \
+                    for column in ResultsWriter.run_info_columns]
+            for name in sorted(statistics):
+                ResultsWriter.csv_writer.writerow(run_info + [record, \
+                        dataset, file_id, name, statistics[name]])
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def record_file_statistics(dataset, file_stats):
+        # Writes a record per file of a FileStatistics table
+
+        if ResultsWriter.records_file is None:
+            return
+
+        columns = zip(file_stats.file_ids, file_stats.counts.tolist(), \
+                file_stats.means.tolist(), file_stats.stds().tolist(), \
+                file_stats.minimums.tolist(), file_stats.maximums.tolist(), \
+                file_stats.medians.tolist())
+
+        for file_id, count, mean, std, minimum, maximum, median in columns:
+            ResultsWriter.record("file_stats", dataset, file_id, \
+                    count=count, mean=mean, std=std, min=minimum, \
+                    max=maximum, median=median)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def to_builtin(value):
+        # Turns numpy scalars into Python numbers, which json can write.
+        # nan & infinities become None (null)
+
+        if isinstance(value, numpy.generic):
+            value = value.item()
+        if isinstance(value, float) and not numpy.isfinite(value):
+            return None
+
+        return value
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def flush():
+        # Pushes the buffered output to the files, e.g. between the
+        # refreshes of a long running analysis
+
+        for output_file in (ResultsWriter.text_file, \
+                ResultsWriter.records_file):
+            if output_file is not None:
+                output_file.flush()
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def close_text():
+        # Flushes & closes the text output, if open
+
+        if ResultsWriter.text_file is not None:
+            ResultsWriter.text_file.close()
+            ResultsWriter.text_file = None
+            ResultsWriter.text_filepath = None
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def close_records():
+        # Flushes & closes the structured records, if open
+
+        if ResultsWriter.records_file is not None:
+            ResultsWriter.records_file.close()
+            ResultsWriter.records_file = None
+            ResultsWriter.csv_writer = None
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def close():
+        # Flushes & closes every output, also run at exit
+
+        ResultsWriter.close_text()
+        ResultsWriter.close_records()
+
+#-------------------------------------------------------------------------------
+atexit.register(ResultsWriter.close)
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import numpy
+from accumulators import QuantileSketch
+from load_analysis_lib import LoadAnalysisLib
+
+class RunIndex:
+    # SQLite index of compact run summaries: the global & per file
+    # aggregates, the timestamp threshold & a quantile sketch of the deltas
+    # of each run, keyed by its data directories & parameters. Comparing
+    # runs reads the summaries back instead of reparsing the data
+
+    default_path = "results/runs.sqlite"
+    # Rank error of the sketches stored
+    relative_error = 0.001
+    # Quantiles shown when comparing runs
+    quantiles = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+    schema = [
+        "CREATE TABLE IF NOT EXISTS runs (" + \
+            "id INTEGER PRIMARY KEY, name TEXT, data_dirs TEXT NOT NULL, " + \
+            "parameters TEXT NOT NULL, created TEXT NOT NULL, " + \
+            "count INTEGER, median REAL, std REAL, clean_median REAL, " + \
+            "clean_std REAL, threshold INTEGER, mean_of_stds REAL, " + \
+            "sketch BLOB, UNIQUE (data_dirs, parameters))",
+        "CREATE TABLE IF NOT EXISTS file_stats (" + \
+            "run_id INTEGER NOT NULL REFERENCES runs (id) " + \
+            "ON DELETE CASCADE, dataset TEXT NOT NULL, " + \
+            "file_id TEXT NOT NULL, count INTEGER, mean REAL, std REAL, " + \
+            "min REAL, max REAL, median REAL)",
+        "CREATE INDEX IF NOT EXISTS file_stats_run ON file_stats (run_id)",
+        "CREATE INDEX IF NOT EXISTS runs_name ON runs (name)"]
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def connect(path=None):
+        # Opens the index, creating it if needed
+
+        if path is None:
+            path = RunIndex.default_path
+
+        connection = sqlite3.connect(path)
+        connection.execute("PRAGMA foreign_keys = ON")
+        for statement in RunIndex.schema:
+            connection.execute(statement)
+
+        return connection
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def save_run(connection, name, data_dirs, parameters, summary, \
+            all_file_stats):
+        # Stores the summary of a run, replacing the one of an earlier run
+        # over the same data directories with the same parameters. summary
+        # holds the global statistics & sketch, all_file_stats maps each
+        # dataset name to its FileStatistics. Returns the id of the run
+
+        data_dirs = ";".join(os.path.abspath(data_dir) \
+                for data_dir in data_dirs)
+        parameters = json.dumps(parameters, sort_keys=True)
+
+        with connection:
+            connection.execute("DELETE FROM runs WHERE data_dirs = ? AND " + \
+                    "parameters = ?", (data_dirs, parameters))
+
+            cursor = connection.execute("INSERT INTO runs (name, " + \
+                    "data_dirs, parameters, created, count, median, std, " + \
+                    "clean_median, clean_std, threshold, mean_of_stds, " + \
+                    "sketch) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", \
+                    (name, data_dirs, parameters, \
+                    time.strftime("%Y-%m-%d %H:%M:%S"), \
+                    RunIndex.to_builtin(summary["count"]), \
+                    RunIndex.to_builtin(summary["median"]), \
+                    RunIndex.to_builtin(summary["std"]), \
+                    RunIndex.to_builtin(summary.get("clean_median")), \
+                    RunIndex.to_builtin(summary.get("clean_std")), \
+                    RunIndex.to_builtin(summary["threshold"]), \
+                    RunIndex.to_builtin(summary["mean_of_stds"]), \
+                    summary["sketch"].serialize()))
+            run_id = cursor.lastrowid
+
+            # Files are stored by absolute path, like the data directories,
+            # to find the data directory of each when comparing runs
+            for dataset, file_stats in all_file_stats.items():
+                connection.executemany("INSERT INTO file_stats VALUES " + \
+                        "(?, ?, ?, ?, ?, ?, ?, ?, ?)", [(run_id, dataset) + \
+                        row for row in zip([os.path.abspath(file_id) \
+                        for file_id in file_stats.file_ids], \
+                        file_stats.counts.tolist(), \
+                        file_stats.means.tolist(), \
+                        file_stats.stds().tolist(), \
+                        file_stats.minimums.tolist(), \
+                        file_stats.maximums.tolist(), \
+                        file_stats.medians.tolist())])
+
+        logging.info(LoadAnalysisLib.line_break)
+        logging.info("Run summary saved as run %s in the index" % run_id)
+
+        return run_id
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def to_builtin(value):
+        # Turns numpy scalars into Python numbers, which sqlite3 can store
+
+        if isinstance(value, numpy.generic):
+            return value.item()
+
+        return value
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def load_run(connection, run_key):
+        # Loads a run by id, or the latest run by that name. Returns a dict
+        # of its summary, or None if there is no such run
+
+        columns = "id, name, data_dirs, parameters, created, count, " + \
+                "median, std, clean_median, clean_std, threshold, " + \
+                "mean_of_stds, sketch"
+
+        row = None
+        if run_key.isdigit():
+            row = connection.execute("SELECT %s FROM runs WHERE id = ?" % \
+                    columns, (int(run_key),)).fetchone()
+        if row is None:
+            row = connection.execute("SELECT %s FROM runs WHERE name = ? " \
+                    "ORDER BY id DESC LIMIT 1" % columns, \
+                    (run_key,)).fetchone()
+        if row is None:
+            return None
+
+        run = dict(zip([column.strip() for column in columns.split(",")], \
+                row))
+        run["sketch"] = QuantileSketch.deserialize(run["sketch"])
+        data_dirs = run["data_dirs"].split(";")
+        run["file_stats"] = dict(((dataset,) + RunIndex.get_file_key(\
+                file_id, data_dirs), (median, std)) \
+                for dataset, file_id, median, std in \
+                connection.execute("SELECT dataset, file_id, median, std " + \
+                "FROM file_stats WHERE run_id = ?", (run["id"],)))
+
+        return run
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def get_file_key(file_id, data_dirs):
+        # Key matching the files of runs over different data directories:
+        # the position of the file's data directory among those of its run
+        # & its path relative to it (its name for a file given on its own).
+        # Files of runs saved with relative paths only have their name
+
+        if os.path.isabs(file_id):
+            for position, data_dir in enumerate(data_dirs):
+                if file_id == data_dir:
+                    return position, os.path.basename(file_id)
+                if file_id.startswith(data_dir.rstrip("/") + "/"):
+                    return position, os.path.relpath(file_id, data_dir)
+
+        return 0, os.path.basename(file_id)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def list_runs(connection):
+        # Logs the runs in the index
+
+        logging.info(LoadAnalysisLib.line_break)
+        logging.info("%5s  %-19s  %-16s %12s %12s  %s" % ("id", "created", \
+                "name", "median", "std", "data dirs & parameters"))
+
+        for run_id, created, name, median, std, data_dirs, parameters in \
+                connection.execute("SELECT id, created, name, median, " + \
+                "std, data_dirs, parameters FROM runs ORDER BY id"):
+            logging.info("%5s  %-19s  %-16s %12.4g %12.4g  %s %s" % (run_id, \
+                    created, name or "-", median, std, data_dirs, \
+                    parameters))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def distribution_shift(baseline_sketch, sketch):
+        # Kolmogorov-Smirnov distance between the distributions of two
+        # sketches: the largest gap between their CDFs
+
+        points = numpy.concatenate(baseline_sketch.levels + sketch.levels)
+        if len(points) == 0:
+            return numpy.nan
+
+        return float(numpy.max(numpy.abs(baseline_sketch.cdf(points) - \
+                sketch.cdf(points))))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def compare_runs(runs):
+        # Logs the summaries of the runs side by side, along with their
+        # differences to the first one
+
+        baseline = runs[0]
+
+        logging.info(LoadAnalysisLib.line_break)
+        logging.info("Run comparison (against run %s):" % baseline["id"])
+        for run in runs:
+            logging.info("run %s: %s %s %s (%s)" % (run["id"], \
+                    run["name"] or "-", run["data_dirs"], run["parameters"], \
+                    run["created"]))
+
+        logging.info(LoadAnalysisLib.line_break)
+        header = "%-16s" % "statistic" + "".join("%16s" % ("run %s" % \
+                run["id"]) for run in runs)
+        logging.info(header)
+
+        rows = [("count", "count"), ("median", "median"), ("std", "std"), \
+                ("clean median", "clean_median"), ("clean std", "clean_std"), \
+                ("threshold", "threshold"), ("mean of stds", "mean_of_stds")]
+        for label, key in rows:
+            logging.info("%-16s" % label + "".join("%16s" % \
+                    RunIndex.format_value(run[key]) for run in runs))
+
+        for quantile in RunIndex.quantiles:
+            logging.info("%-16s" % ("p%g" % (quantile * 100)) + \
+                    "".join("%16s" % RunIndex.format_value(\
+                    run["sketch"].quantile(quantile)) for run in runs))
+
+        # Differences to the baseline
+        logging.info(LoadAnalysisLib.line_break)
+        for run in runs[1:]:
+            logging.info("run %s vs run %s: median %s (%s), std %s (%s), " \
+                    "distribution shift (KS) %.4f" % (run["id"], \
+                    baseline["id"], \
+                    RunIndex.format_change(baseline["median"], run["median"]), \
+                    RunIndex.format_change(baseline["median"], run["median"], \
+                    True), \
+                    RunIndex.format_change(baseline["std"], run["std"]), \
+                    RunIndex.format_change(baseline["std"], run["std"], True), \
+                    RunIndex.distribution_shift(baseline["sketch"], \
+                    run["sketch"])))
+
+            # Files found in both runs, matched by their path within their
+            # data directory (see get_file_key), named after the baseline's
+            data_dirs = baseline["data_dirs"].split(";")
+            for key in sorted(run["file_stats"]):
+                if key not in baseline["file_stats"] or key[0] != "trimmed":
+                    continue
+
+                file_name = key[2]
+                if len(data_dirs) > 1:
+                    file_name = os.path.join(os.path.basename(\
+                            data_dirs[key[1]]), file_name)
+
+                baseline_median, baseline_std = baseline["file_stats"][key]
+                median, std = run["file_stats"][key]
+                logging.info("    %s: median %s, std %s" % (file_name, \
+                        RunIndex.format_change(baseline_median, median), \
+                        RunIndex.format_change(baseline_std, std)))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def format_value(value):
+        # Formats a summary value for the comparison table
+
+        if value is None:
+            return "-"
+        if isinstance(value, float):
+            return "%.6g" % value
+
+        return str(value)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def format_change(baseline, value, relative=False):
+        # Formats the change from baseline to value, in percent if relative
+
+        if baseline is None or value is None:
+            return "-"
+        if relative:
+            if baseline == 0:
+                return "-"
+            return "%+.2f%%" % ((value - baseline) * 100.0 / abs(baseline))
+
+        return "%+.6g" % (value - baseline)
+
+#-------------------------------------------------------------------------------
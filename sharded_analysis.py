@@ -0,0 +1,577 @@
+import os
+import sys
+import json
+import base64
+import hashlib
+import logging
+import numpy
+from utils import Utils
+from objects import FileData, FileDataSet, FileStatistics
+from data_parser import DataParser
+from accumulators import MomentAccumulator, QuantileSketch
+from compressed_input import CompressedInput
+from load_analysis_lib import LoadAnalysisLib
+from streaming_analysis import StreamingAnalysis
+from results_writer import ResultsWriter
+
+class ShardedAnalysis:
+    # Splits the analysis in load_analysis.py across hosts. A shard run
+    # (--shard i/N) parses every Nth file of the sorted listing of the data
+    # directories & writes a partial: the moments, median, head & tail of
+    # each of its files before & after trimming, plus a sketch of all its
+    # deltas. Merging the partials of all N shards (--merge) logs the same
+    # analysis, with the global median approximated by the merged sketches.
+    # Extra headers are reported by the shard that parsed the file.
+    #
+    # The timestamp threshold depends on the heads of every file, so each
+    # shard also reads the first rows of the files of the other shards. The
+    # cleanup boundaries depend on the whole data, so a cleanup takes two
+    # rounds: merging the first round's partials writes a plan holding the
+    # boundaries, which the shards of the second round apply. Partials &
+    # plans hold a hash of the data files they were made from
+
+    # Format of the partials & plans
+    version = 2
+    default_partial = "results/shard-%s-of-%s.json"
+    default_plan = "results/shard-plan.json"
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def parse_shard(shard):
+        # Parses a "i/N" shard spec into (i, N), raising ValueError if it is
+        # malformed
+
+        try:
+            shard_index, total_shards = [int(part) \
+                    for part in shard.split("/")]
+        except ValueError:
+            raise ValueError("shard must look like i/N: %s" % shard)
+
+        if total_shards < 1 or not 0 <= shard_index < total_shards:
+            raise ValueError("shard index must be within [0, N): %s" % shard)
+
+        return shard_index, total_shards
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def list_data_files(args, recursive=False):
+        # Lists the filepaths of the files of every data directory, sorted
+        # within each directory so every host lists them in the same order
+
+        filepaths = []
+
+        for arg in args:
+            filepaths.extend(sorted(Utils.fix_filepath(dirname, filename) \
+                    for dirname, filename in \
+                    Utils.get_dir_listing(arg, recursive)))
+
+        return filepaths
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def run_shard(args, shard_index, total_shards, partial_path=None, \
+            cleanup_level=None, strategy="std", plan_path=None, \
+            relative_error=None, recursive=False, **parse_options):
+        # Analyzes the files of a shard & writes its partial. A cleanup
+        # needs the plan of a first round merge (see find_plan): without it
+        # only the original data is summarized. parse_options are passed on
+        # to parse_data_files
+
+        if relative_error is None:
+            relative_error = StreamingAnalysis.relative_error
+        if partial_path is None:
+            partial_path = ShardedAnalysis.default_partial % \
+                    (shard_index, total_shards)
+
+        parameters = {"cleanup_level": cleanup_level, "strategy": strategy, \
+                "relative_error": relative_error}
+        filepaths = ShardedAnalysis.list_data_files(args, recursive)
+        shard_filepaths = filepaths[shard_index::total_shards]
+
+        data_hash = ShardedAnalysis.hash_data_files(filepaths)
+        boundaries = None
+        if cleanup_level is not None:
+            plan = ShardedAnalysis.find_plan(plan_path, parameters, \
+                    total_shards, data_hash)
+            if plan is not None:
+                boundaries = plan["boundaries"]
+
+        logging.info(LoadAnalysisLib.line_break)
+        logging.info("Shard %s/%s: analyzing %s of %s data file(s)" % \
+                (shard_index, total_shards, len(shard_filepaths), \
+                len(filepaths)))
+
+        all_file_data = LoadAnalysisLib.parse_data_files(shard_filepaths, \
+                recursive=False, **parse_options)
+        sources = ShardedAnalysis.find_sources(all_file_data, \
+                shard_filepaths, range(shard_index, len(filepaths), \
+                total_shards))
+
+        sketch = QuantileSketch(relative_error)
+        sketch.add(all_file_data.deltas)
+        partial = {"version": ShardedAnalysis.version, \
+                "shard": shard_index, "shards": total_shards, \
+                "total_files": len(filepaths), "data_hash": data_hash, \
+                "parameters": parameters, \
+                "complete": cleanup_level is None or boundaries is not None, \
+                "sketch": ShardedAnalysis.encode_sketch(sketch)}
+        file_entries = [{"file_id": file_data.file_id, "source": source} \
+                for file_data, source in zip(all_file_data, sources)]
+        ShardedAnalysis.add_statistics(file_entries, "original", \
+                all_file_data)
+
+        if partial["complete"]:
+            # Clean up the values outside of the planned boundaries
+            if boundaries is not None:
+                keep = (all_file_data.deltas >= boundaries[0]) & \
+                        (all_file_data.deltas <= boundaries[1])
+                total_kept = numpy.zeros(len(keep) + 1, dtype=numpy.int64)
+                numpy.cumsum(keep, out=total_kept[1:])
+                all_file_data = FileDataSet([file_data.file_id \
+                        for file_data in all_file_data], \
+                        all_file_data.timestamps[keep], \
+                        all_file_data.deltas[keep], \
+                        total_kept[all_file_data.offsets])
+
+                sketch = QuantileSketch(relative_error)
+                sketch.add(all_file_data.deltas)
+                partial["clean_sketch"] = \
+                        ShardedAnalysis.encode_sketch(sketch)
+                ShardedAnalysis.add_statistics(file_entries, "clean", \
+                        all_file_data)
+
+            threshold = ShardedAnalysis.find_threshold(all_file_data, \
+                    filepaths, set(shard_filepaths), boundaries)
+            partial["threshold"] = threshold
+            partial["boundaries"] = boundaries
+
+            trimmed_file_data = ShardedAnalysis.trim(all_file_data, \
+                    threshold, file_entries)
+            ShardedAnalysis.add_statistics(file_entries, "trimmed", \
+                    trimmed_file_data)
+
+        partial["files"] = file_entries
+
+        # Encoded up front, so a failure doesn't leave a partial partial
+        data = json.dumps(partial)
+        with open(partial_path, "w") as partial_file:
+            partial_file.write(data)
+
+        logging.info(LoadAnalysisLib.line_break)
+        logging.info("Partial results of shard %s/%s written to: %s" % \
+                (shard_index, total_shards, partial_path))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def hash_data_files(filepaths):
+        # Hash of the path, size & modification time of each data file,
+        # telling whether a plan was made from the same data
+
+        data_hash = hashlib.sha1()
+        for filepath in filepaths:
+            stat = os.stat(filepath)
+            data_hash.update(("%s\0%s\0%s\n" % (os.path.abspath(filepath), \
+                    stat.st_size, stat.st_mtime_ns)).encode())
+
+        return data_hash.hexdigest()
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def find_sources(all_file_data, filepaths, indexes):
+        # Matches each parsed file to the index in the listing of the
+        # filepath it came from, the files of an archive being named after
+        # the archive
+
+        sources = []
+        position = 0
+
+        for file_data in all_file_data:
+            while file_data.file_id != filepaths[position] and \
+                    not file_data.file_id.startswith(filepaths[position] + "/"):
+                position += 1
+            sources.append(indexes[position])
+
+        return sources
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def add_statistics(file_entries, dataset_name, file_data_list):
+        # Stores the count, mean, sum of squared differences from the mean,
+        # min, max & median of the deltas of each file, along with its head
+        # & tail timestamps, under dataset_name in its entry
+
+        all_file_data = FileDataSet.pack(file_data_list)
+        columns = LoadAnalysisLib.compute_partial_statistics(\
+                all_file_data.deltas, all_file_data.offsets)
+
+        for file_entry, file_data, statistics in zip(file_entries, \
+                all_file_data, zip(*[column.tolist() for column in columns])):
+            head = tail = None
+            if len(file_data.timestamps):
+                head = int(file_data.timestamps[0])
+                tail = int(file_data.timestamps[-1])
+
+            file_entry[dataset_name] = list(statistics) + [head, tail]
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def find_threshold(all_file_data, filepaths, shard_filepaths, \
+            boundaries=None):
+        # Computes the timestamp threshold shared by every file listed: the
+        # biggest head out of the (clean) file data of this shard & the
+        # first rows within the boundaries of the other files
+
+        heads = [file_data.timestamps[0] for file_data in all_file_data \
+                if len(file_data.timestamps)]
+
+        for filepath in filepaths:
+            if filepath not in shard_filepaths:
+                heads.extend(ShardedAnalysis.find_heads(filepath, boundaries))
+
+        heads = [head for head in heads if head is not None]
+        if not heads:
+            return None
+
+        return int(max(heads))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def find_heads(filepath, boundaries=None):
+        # Returns the first timestamp whose delta lies within the boundaries
+        # of a data file (of each file of an archive), reading no further
+        # than needed. None stands for a file without such a row. Archives
+        # are read whole, as their members can only be found in order
+
+        lower_boundary, upper_boundary = -numpy.inf, numpy.inf
+        if boundaries is not None:
+            lower_boundary, upper_boundary = boundaries
+
+        if CompressedInput.is_archive(filepath):
+            heads = []
+            for member_name, parsed_file in \
+                    CompressedInput.iter_archive(filepath):
+                timestamps, deltas, total_headers_found = parsed_file
+                keep = (deltas >= lower_boundary) & (deltas <= upper_boundary)
+                heads.append(timestamps[keep][0] if keep.any() else None)
+            return heads
+
+        blocks = DataParser.iter_blocks(filepath)
+        try:
+            for timestamps, deltas, headers in blocks:
+                keep = (deltas >= lower_boundary) & (deltas <= upper_boundary)
+                if keep.any():
+                    return [timestamps[keep][0]]
+        finally:
+            blocks.close()
+
+        return [None]
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def trim(all_file_data, threshold, file_entries):
+        # Trims each file to the timestamps at or past the threshold, like
+        # trim_lists_by_common_threshold: files left empty keep their data &
+        # are flagged in their entry
+
+        timestamp_columns = []
+        delta_columns = []
+
+        for file_data, file_entry in zip(all_file_data, file_entries):
+            start = 0
+            if threshold is not None:
+                start = numpy.searchsorted(file_data.timestamps, threshold, \
+                        side="left")
+
+            file_entry["empty_trimmed"] = bool(len(file_data.timestamps) \
+                    and start == len(file_data.timestamps))
+            if file_entry["empty_trimmed"]:
+                start = 0
+
+            timestamp_columns.append(file_data.timestamps[start:])
+            delta_columns.append(file_data.deltas[start:])
+
+        return FileDataSet.from_columns([file_data.file_id \
+                for file_data in all_file_data], timestamp_columns, \
+                delta_columns)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def merge(partial_paths, file_stats=False, plan_path=None):
+        # Merges the partials of every shard into the analysis. Partials of
+        # a first cleanup round yield the plan of the second one instead
+
+        if plan_path is None:
+            plan_path = ShardedAnalysis.default_plan
+
+        partials = ShardedAnalysis.load_partials(partial_paths)
+        parameters = partials[0]["parameters"]
+        file_entries = sorted((file_entry for partial in partials \
+                for file_entry in partial["files"]), \
+                key=lambda file_entry: file_entry["source"])
+        file_ids = [file_entry["file_id"] for file_entry in file_entries]
+
+        # Analyze all of the original file data and log it
+        original_stats = ShardedAnalysis.get_file_statistics(file_entries, \
+                "original")
+        moments = ShardedAnalysis.merge_moments(file_entries, "original")
+        sketch = ShardedAnalysis.merge_sketches(partials, "sketch")
+        median, std = sketch.median(), moments.std()
+        LoadAnalysisLib.log_analysis("original", median, std)
+
+        if file_stats:
+            LoadAnalysisLib.log_file_statistics("original", original_stats)
+        ResultsWriter.record_file_statistics("original", original_stats)
+
+        cleanup_level = parameters["cleanup_level"]
+        strategy = parameters["strategy"]
+
+        if not partials[0]["complete"]:
+            boundaries = ShardedAnalysis.compute_cleanup_boundaries(\
+                    cleanup_level, strategy, moments, sketch)
+            ShardedAnalysis.write_plan(plan_path, partials[0], boundaries)
+            return
+
+        # Analyze the clean file data & log it, if cleaned up
+        dataset_name = "original"
+        if cleanup_level is not None:
+            dataset_name = "clean"
+            LoadAnalysisLib.log_cleanup_level(cleanup_level, strategy)
+
+            clean_counts = numpy.array([file_entry["clean"][0] \
+                    for file_entry in file_entries], dtype=numpy.int64)
+            LoadAnalysisLib.log_removed_values(strategy, file_ids, \
+                    original_stats.counts - clean_counts)
+
+            moments = ShardedAnalysis.merge_moments(file_entries, "clean")
+            sketch = ShardedAnalysis.merge_sketches(partials, "clean_sketch")
+            LoadAnalysisLib.log_analysis("clean", sketch.median(), \
+                    moments.std())
+
+            # Files left without data by the cleanup are dropped
+            file_entries = [file_entry for file_entry in file_entries \
+                    if file_entry["clean"][0] > 0]
+
+        # Log the shared timestamp threshold, found from the head of each
+        # file
+        file_bounds = [FileData(file_entry["file_id"], \
+                numpy.array(file_entry[dataset_name][-2:])) \
+                for file_entry in file_entries \
+                if file_entry[dataset_name][0] > 0]
+        if not file_bounds:
+            logging.error(LoadAnalysisLib.line_break)
+            logging.error("No file data left after the cleanup, were the " + \
+                    "shards run with a plan made from other data?")
+            sys.exit(0)
+        threshold, tail_threshold = \
+                LoadAnalysisLib.compute_common_thresholds(file_bounds)
+
+        if any(partial["threshold"] != threshold for partial in partials):
+            logging.warning(LoadAnalysisLib.line_break)
+            logging.warning("The shards trimmed the data with different " + \
+                    "thresholds, did the data change between their runs?")
+
+        empty_file_ids = [file_entry["file_id"] \
+                for file_entry in file_entries if file_entry["empty_trimmed"]]
+        if empty_file_ids:
+            LoadAnalysisLib.report_empty_trimmed_file_data(empty_file_ids)
+
+        # Find the mean of all delta standard deviations found (from the
+        # trimmed file data)
+        trimmed_stats = ShardedAnalysis.get_file_statistics(file_entries, \
+                "trimmed")
+        LoadAnalysisLib.log_mean_of_stds(numpy.mean(trimmed_stats.stds()))
+
+        if file_stats:
+            LoadAnalysisLib.log_file_statistics("trimmed", trimmed_stats)
+        ResultsWriter.record_file_statistics("trimmed", trimmed_stats)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def load_partials(partial_paths):
+        # Loads the partials of every shard of a run, checking that none is
+        # missing, repeated or from another run. Ends the run if so
+
+        partials = []
+        for partial_path in partial_paths:
+            with open(partial_path) as partial_file:
+                partials.append(json.load(partial_file))
+
+        errors = []
+        first = partials[0]
+        for partial_path, partial in zip(partial_paths, partials):
+            if partial.get("version") != ShardedAnalysis.version:
+                errors.append("Not a partial of this version: %s" % \
+                        partial_path)
+            elif any(partial.get(key) != first[key] for key in ("shards", \
+                    "total_files", "data_hash", "parameters", "complete")):
+                errors.append("Partial of another run or round: %s" % \
+                        partial_path)
+
+        if not errors:
+            shards = sorted(partial["shard"] for partial in partials)
+            if shards != list(range(first["shards"])):
+                errors.append("Expected the partials of shards 0 to %s, " \
+                        "got: %s" % (first["shards"] - 1, \
+                        ", ".join(str(shard) for shard in shards)))
+
+        if errors:
+            logging.error(LoadAnalysisLib.line_break)
+            for error in errors:
+                logging.error(error)
+            sys.exit(0)
+
+        return partials
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def write_plan(plan_path, partial, boundaries):
+        # Writes the cleanup boundaries for the second round of shards
+
+        plan = {"version": ShardedAnalysis.version, \
+                "shards": partial["shards"], \
+                "total_files": partial["total_files"], \
+                "data_hash": partial["data_hash"], \
+                "parameters": partial["parameters"], \
+                "boundaries": [float(boundary) for boundary in boundaries]}
+
+        with open(plan_path, "w") as plan_file:
+            json.dump(plan, plan_file)
+
+        logging.info(LoadAnalysisLib.line_break)
+        logging.info("Cleanup boundaries [%s, %s] written to: %s" % \
+                (boundaries[0], boundaries[1], plan_path))
+        # The shards apply the default plan unless given another one
+        msg = "Run the shards again"
+        if plan_path != ShardedAnalysis.default_plan:
+            msg += " with --shard-plan %s" % plan_path
+        logging.info(msg + " & merge their partials to finish the analysis")
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def find_plan(plan_path, parameters, total_shards, data_hash):
+        # Returns the plan of a second cleanup round: the one at plan_path
+        # if given, or else the one at default_plan if it was made from the
+        # same data files with the same parameters & shards. None without a
+        # plan
+
+        if plan_path is not None:
+            return ShardedAnalysis.load_plan(plan_path, parameters, \
+                    total_shards, data_hash)
+        if not os.path.exists(ShardedAnalysis.default_plan):
+            return None
+
+        with open(ShardedAnalysis.default_plan) as plan_file:
+            plan = json.load(plan_file)
+
+        logging.info(LoadAnalysisLib.line_break)
+        if not ShardedAnalysis.is_plan_for(plan, parameters, total_shards, \
+                data_hash):
+            logging.info("Ignoring the shard plan made for another run: " + \
+                    ShardedAnalysis.default_plan)
+            return None
+
+        logging.info("Applying the shard plan: " + \
+                ShardedAnalysis.default_plan)
+        return plan
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def is_plan_for(plan, parameters, total_shards, data_hash):
+        # Checks whether a plan was made from these data files, for these
+        # parameters & shards
+
+        return plan.get("version") == ShardedAnalysis.version and \
+                plan["parameters"] == parameters and \
+                plan["shards"] == total_shards and \
+                plan["data_hash"] == data_hash
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def load_plan(plan_path, parameters, total_shards, data_hash):
+        # Loads the plan written by a first round merge, ending the run if it
+        # was made from other data files or for other parameters
+
+        with open(plan_path) as plan_file:
+            plan = json.load(plan_file)
+
+        if not ShardedAnalysis.is_plan_for(plan, parameters, total_shards, \
+                data_hash):
+            logging.error(LoadAnalysisLib.line_break)
+            logging.error("The shard plan was made for another run: %s" % \
+                    plan_path)
+            sys.exit(0)
+
+        return plan
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def compute_cleanup_boundaries(cleanup_level, strategy, moments, sketch):
+        # Cleanup boundaries from the merged moments & sketch. The median
+        # absolute deviation comes from the deviations of the sketch itself
+
+        if strategy == "mad":
+            median = sketch.median()
+            mad = sketch.deviations(median).median() * \
+                    LoadAnalysisLib.mad_scale
+
+            return median - (mad * cleanup_level), \
+                    median + (mad * cleanup_level)
+
+        return StreamingAnalysis.compute_cleanup_boundaries(cleanup_level, \
+                strategy, moments, sketch, None, False, None, None, None)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def get_file_statistics(file_entries, dataset_name):
+        # Returns the statistics of a dataset of the files as a
+        # FileStatistics table
+
+        columns = list(zip(*[file_entry[dataset_name][:6] \
+                for file_entry in file_entries]))
+        counts, means, m2s, minimums, maximums, medians = [numpy.array(\
+                column, dtype=numpy.float64) for column in columns]
+
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            variances = m2s / counts
+
+        return FileStatistics([file_entry["file_id"] \
+                for file_entry in file_entries], counts.astype(numpy.int64), \
+                means, variances, minimums, maximums, medians)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def merge_moments(file_entries, dataset_name):
+        # Merges the moments of a dataset of the files
+
+        counts, means, m2s, minimums, maximums = zip(*[\
+                file_entry[dataset_name][:5] for file_entry in file_entries])
+
+        return MomentAccumulator.from_partials(counts, means, m2s, \
+                numpy.array(minimums, dtype=numpy.float64), \
+                numpy.array(maximums, dtype=numpy.float64))
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def merge_sketches(partials, key):
+        # Merges a sketch of every partial
+
+        sketch = ShardedAnalysis.decode_sketch(partials[0][key])
+        for partial in partials[1:]:
+            sketch.merge(ShardedAnalysis.decode_sketch(partial[key]))
+
+        return sketch
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def encode_sketch(sketch):
+        # Sketch as text for the JSON partials
+
+        return base64.b64encode(sketch.serialize()).decode("ascii")
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def decode_sketch(data):
+        # Rebuilds a sketch encoded by encode_sketch
+
+        return QuantileSketch.deserialize(base64.b64decode(data))
+
+#-------------------------------------------------------------------------------
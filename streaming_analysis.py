@@ -0,0 +1,294 @@
+import sys
+import numpy
+import logging
+from utils import Utils
+from objects import FileData
+from data_parser import DataParser
+from accumulators import MomentAccumulator, QuantileSketch, \
+        LogLinearHistogram
+from load_analysis_lib import LoadAnalysisLib
+from compressed_input import CompressedInput
+
+class StreamingAnalysis:
+    # Out-of-core version of the analysis in load_analysis.py. The data files
+    # are streamed block by block through a generator pipeline, once per
+    # dataset (original, clean & trimmed), so memory scales with the amount
+    # of files instead of the amount of rows. Medians come from a
+    # QuantileSketch & are approximate, standard deviations are exact
+
+    # Normalized rank error of the median
+    relative_error = 0.001
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def analyze(args, cleanup_level=None, trim_tail=False, use_mmap=False, \
+            relative_error=None, max_iterations=1, strategy="std", \
+            recursive=False, histogram_error=None):
+        # Runs the whole analysis over the data directories given. Like
+        # cleanup_file_data, max_iterations repeats the cleanup (one more
+        # pass over the data each) until no more values are removed &
+        # strategy selects the cleanup boundaries. The quantiles used by the
+        # strategies come from the sketch, the mad strategy costs one more
+        # pass per iteration. recursive also streams the files of
+        # subdirectories. Given a histogram_error, the deltas of each dataset
+        # are also binned into a LogLinearHistogram along the way, returned
+        # as a list of (dataset name, histogram)
+
+        if relative_error is None:
+            relative_error = StreamingAnalysis.relative_error
+
+        data_files = StreamingAnalysis.list_data_files(args, recursive)
+        file_ids = [filepath for filepaths in data_files \
+                for filepath in filepaths]
+
+        # Analyze all of the original file data and log it
+        blocks = StreamingAnalysis.iter_blocks(data_files, use_mmap, True)
+        moments, sketch, heads, tails, counts, histogram = \
+                StreamingAnalysis.scan(blocks, len(file_ids), \
+                relative_error, histogram_error)
+        median, std = sketch.median(), moments.std()
+        LoadAnalysisLib.log_analysis("original", median, std)
+        histograms = [("original", histogram)]
+
+        # Clean up outliers if requested & analyze the clean file data
+        lower_boundary = upper_boundary = None
+        if cleanup_level is not None:
+            LoadAnalysisLib.log_cleanup_level(cleanup_level, strategy)
+            original_counts = counts
+            lower_boundary, upper_boundary = -numpy.inf, numpy.inf
+
+            for iteration in range(1, max(max_iterations, 1) + 1):
+                # Boundaries only ever narrow, as with the batch cleanup
+                boundaries = StreamingAnalysis.compute_cleanup_boundaries(\
+                        cleanup_level, strategy, moments, sketch, \
+                        data_files, use_mmap, lower_boundary, \
+                        upper_boundary, relative_error)
+                lower_boundary = max(boundaries[0], lower_boundary)
+                upper_boundary = min(boundaries[1], upper_boundary)
+
+                previously_kept = moments.count
+                blocks = StreamingAnalysis.filter_blocks(\
+                        StreamingAnalysis.iter_blocks(data_files, use_mmap), \
+                        lower_boundary, upper_boundary)
+                moments, sketch, heads, tails, counts, histogram = \
+                        StreamingAnalysis.scan(blocks, len(file_ids), \
+                        relative_error, histogram_error)
+                median, std = sketch.median(), moments.std()
+
+                if moments.count in (previously_kept, 0):
+                    break
+
+            if max_iterations > 1:
+                logging.info(LoadAnalysisLib.line_break)
+                logging.info("Cleanup stopped after %s iteration(s)" % \
+                        iteration)
+
+            LoadAnalysisLib.log_removed_values(strategy, file_ids, \
+                    original_counts - counts)
+            LoadAnalysisLib.log_analysis("clean", median, std)
+            histograms.append(("clean", histogram))
+
+        # Files left without data by the cleanup are dropped, like the
+        # batch cleanup does
+        file_indexes = [file_index for file_index, head in enumerate(heads) \
+                if head is not None]
+        if not file_indexes:
+            return StreamingAnalysis.list_histograms(histograms)
+
+        # Compute the shared timestamp threshold(s) from the head & tail
+        # timestamp of each file
+        file_bounds = [FileData(file_ids[file_index], \
+                numpy.array([heads[file_index], tails[file_index]])) \
+                for file_index in file_indexes]
+        threshold, tail_threshold = \
+                LoadAnalysisLib.compute_common_thresholds(file_bounds, \
+                trim_tail)
+
+        # Compute the std of the trimmed deltas of each file
+        blocks = StreamingAnalysis.filter_blocks(\
+                StreamingAnalysis.iter_blocks(data_files, use_mmap), \
+                lower_boundary, upper_boundary, threshold, tail_threshold)
+        file_moments = [MomentAccumulator() for file_id in file_ids]
+        histogram = None
+        if histogram_error is not None:
+            histogram = LogLinearHistogram(histogram_error)
+        for file_index, timestamps, deltas in blocks:
+            file_moments[file_index].add(deltas)
+            if histogram is not None:
+                histogram.add(deltas)
+        histograms.append(("trimmed", histogram))
+
+        empty_file_ids = [file_ids[file_index] for file_index in file_indexes \
+                if file_moments[file_index].count == 0]
+        if empty_file_ids:
+            LoadAnalysisLib.report_empty_trimmed_file_data(empty_file_ids)
+
+        all_stds = [file_moments[file_index].std() \
+                for file_index in file_indexes]
+        LoadAnalysisLib.log_mean_of_stds(numpy.mean(all_stds))
+
+        return StreamingAnalysis.list_histograms(histograms)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def list_histograms(histograms):
+        # The (dataset name, histogram) pairs that were binned, if any
+
+        return [(name, histogram) for name, histogram in histograms \
+                if histogram is not None]
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def list_data_files(args, recursive=False):
+        # Lists the filepaths of the files in each data directory. Tar
+        # archives would have to be decompressed on each pass, so they are
+        # only supported by the in memory analysis
+
+        data_files = []
+
+        for arg in args:
+            dir_listing = Utils.get_dir_listing(arg, recursive)
+            data_files.append([Utils.fix_filepath(dirname, filename) \
+                    for dirname, filename in dir_listing])
+
+            for filepath in data_files[-1]:
+                if CompressedInput.is_archive(filepath):
+                    logging.error(LoadAnalysisLib.line_break)
+                    logging.error("Tar archives can't be streamed, " + \
+                            "extract it or run without --streaming: %s" % \
+                            filepath)
+                    sys.exit(0)
+
+        return data_files
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def iter_blocks(data_files, use_mmap=False, report_headers=False):
+        # Streams the files of each data directory block by block, yielding
+        # the index of the file along with the timestamps & deltas of each
+        # block. Extra headers are reported like parse_data_files does if
+        # report_headers is set
+
+        if use_mmap:
+            iter_file_blocks = DataParser.iter_mapped_blocks
+        else:
+            iter_file_blocks = DataParser.iter_blocks
+
+        file_index = 0
+        extra_headers_found = False
+
+        for filepaths in data_files:
+            for filepath in filepaths:
+                total_headers_found = 0
+
+                for timestamps, deltas, headers in iter_file_blocks(filepath):
+                    total_headers_found += headers
+                    yield file_index, timestamps, deltas
+
+                if report_headers and LoadAnalysisLib.report_extra_headers(\
+                        filepath, total_headers_found):
+                    extra_headers_found = True
+                file_index += 1
+
+            if report_headers and extra_headers_found:
+                LoadAnalysisLib.report_extra_headers_error()
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def filter_blocks(blocks, lower_boundary=None, upper_boundary=None, \
+            threshold=None, tail_threshold=None):
+        # Drops the values outside of the cleaning boundaries & the timestamp
+        # window from each block. None disables a bound
+
+        for file_index, timestamps, deltas in blocks:
+            keep = numpy.ones(len(deltas), dtype=bool)
+
+            if lower_boundary is not None:
+                keep &= deltas >= lower_boundary
+            if upper_boundary is not None:
+                keep &= deltas <= upper_boundary
+            if threshold is not None:
+                keep &= timestamps >= threshold
+            if tail_threshold is not None:
+                keep &= timestamps <= tail_threshold
+
+            yield file_index, timestamps[keep], deltas[keep]
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def scan(blocks, total_files, relative_error, histogram_error=None):
+        # Accumulates the moments & median sketch of all deltas, along with
+        # the head & tail timestamp of each file (None for files without
+        # data). The deltas are also binned into a histogram if a
+        # histogram_error is given (None otherwise)
+
+        moments = MomentAccumulator()
+        sketch = QuantileSketch(relative_error)
+        heads = [None] * total_files
+        tails = [None] * total_files
+        counts = numpy.zeros(total_files, dtype=numpy.int64)
+        histogram = None
+        if histogram_error is not None:
+            histogram = LogLinearHistogram(histogram_error)
+
+        for file_index, timestamps, deltas in blocks:
+            if len(timestamps) == 0:
+                continue
+
+            moments.add(deltas)
+            sketch.add(deltas)
+            if histogram is not None:
+                histogram.add(deltas)
+
+            if heads[file_index] is None:
+                heads[file_index] = timestamps[0]
+            tails[file_index] = timestamps[-1]
+            counts[file_index] += len(deltas)
+
+        return moments, sketch, heads, tails, counts, histogram
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def compute_cleanup_boundaries(cleanup_level, strategy, moments, sketch, \
+            data_files, use_mmap, lower_boundary, upper_boundary, \
+            relative_error):
+        # Streaming counterpart of LoadAnalysisLib.compute_cleanup_boundaries,
+        # working off of the moments & sketch of the data between the current
+        # boundaries
+
+        median = sketch.median()
+
+        if strategy == "std":
+            std = moments.std()
+
+            return median - (std * cleanup_level), \
+                    median + (std * cleanup_level)
+
+        if strategy == "mad":
+            # Sketch the absolute deviations from the median in another pass
+            deviations = QuantileSketch(relative_error)
+            blocks = StreamingAnalysis.filter_blocks(\
+                    StreamingAnalysis.iter_blocks(data_files, use_mmap), \
+                    lower_boundary, upper_boundary)
+            for file_index, timestamps, deltas in blocks:
+                deviations.add(numpy.abs(deltas - median))
+            mad = deviations.median() * LoadAnalysisLib.mad_scale
+
+            return median - (mad * cleanup_level), \
+                    median + (mad * cleanup_level)
+
+        if strategy == "iqr":
+            first_quartile = sketch.quantile(0.25)
+            third_quartile = sketch.quantile(0.75)
+            iqr = third_quartile - first_quartile
+
+            return first_quartile - (iqr * cleanup_level), \
+                    third_quartile + (iqr * cleanup_level)
+
+        if strategy == "percentile":
+            LoadAnalysisLib.check_cleanup_level(cleanup_level, strategy)
+            return sketch.quantile(cleanup_level / 100.0), \
+                    sketch.quantile(1 - cleanup_level / 100.0)
+
+        raise ValueError("Unknown cleanup strategy: %s" % strategy)
+
+#-------------------------------------------------------------------------------
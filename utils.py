@@ -1,17 +1,33 @@
 import os
 import sys
 import logging
-import logging_colorer
+import numpy
+from results_writer import ResultsWriter
+from diagnostics import Diagnostics
 
-import matplotlib
+class Utils:
+    filepath = None
+    # Points beyond which the auto plot mode stops drawing individual dots
+    plot_points_limit = 100000
+    # matplotlib.pyplot, only imported once something is plotted
+    pyplot = None
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def get_pyplot():
+        # Imports & sets up matplotlib.pyplot on first use, so runs that do
+        # not plot skip its (slow) import
 
-# Agg allows plot creation if $DISPLAY env variable isn't set
-matplotlib.use("Agg")
+        if Utils.pyplot is None:
+            import matplotlib
 
-import matplotlib.pyplot as plt
+            # Agg allows plot creation if $DISPLAY env variable isn't set
+            matplotlib.use("Agg")
+
+            import matplotlib.pyplot
+            Utils.pyplot = matplotlib.pyplot
+
+        return Utils.pyplot
 
-class Utils:
-    filepath = None
 #-------------------------------------------------------------------------------
     @staticmethod
     def set_logging(logging_level):
@@ -23,20 +39,40 @@ class Utils:
 
 #-------------------------------------------------------------------------------
     @staticmethod
-    def get_dir_listing(directory):
-        # Iterates through the directory, extracting the filename of its files
+    def get_dir_listing(directory, recursive=False):
+        # Iterates through the directory, extracting the filename of its files.
+        # os.scandir gets the type of each entry along with its name, saving
+        # a stat per entry. If recursive is set, the files of subdirectories
+        # follow those of their parent, skipping hidden directories (e.g. the
+        # parse cache). A file given instead of a directory (e.g. a tar
+        # archive of one) is listed on its own
+
+        if not os.path.isdir(directory):
+            dirname, filename = os.path.split(directory)
+            return [[dirname or ".", filename]]
 
         logging.debug("-------------------------------------------------")
-        logging.debug("Listing directory: %s" % (directory))
+        logging.debug("Listing directory: %s", directory)
         logging.debug("-----------------------------")
 
-        dirlist = os.listdir(directory)
         filelist = []
+        subdirectories = []
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    filelist.append([directory, entry.name])
+                elif recursive and entry.is_dir(follow_symlinks=False) and \
+                        not entry.name.startswith('.'):
+                    subdirectories.append(Utils.fix_filepath(directory, \
+                            entry.name))
 
-        for i in dirlist:
-            if os.path.isfile("%s/%s" % (directory,i)):
-                logging.debug("Found file: %s%s", directory, i)
-                filelist.append([directory, i])
+        if Diagnostics.enabled:
+            Diagnostics.count("directories listed")
+            Diagnostics.count("files found", len(filelist))
+
+        for subdirectory in subdirectories:
+            filelist.extend(Utils.get_dir_listing(subdirectory, recursive))
 
         return filelist
 
@@ -58,35 +94,55 @@ class Utils:
 #-------------------------------------------------------------------------------
     @staticmethod
     def write_to_file(data):
-        f = open(Utils.filepath, 'a+')
-        f.write(data)
-        f.close()
+        # Appends data to Utils.filepath, through a buffered handle kept open
+        # for the whole run (see ResultsWriter)
+
+        ResultsWriter.write_text(Utils.filepath, data)
 
 #-------------------------------------------------------------------------------
     @staticmethod
-    def plot_data(x_axis, y_axis, plot_title, filepath):
-        # Creates dot plot
-
-        dot_pairs = []
-    
-        if len(x_axis) == len(y_axis):
-            for i in range(0, len(x_axis)):
-                dot = [ x_axis[i], y_axis[i] ]
-                dot_pairs.append(dot)
-        else:
+    def plot_data(x_axis, y_axis, plot_title, filepath, plot_mode="auto"):
+        # Creates a plot of the data in a new figure, in one of the modes:
+        #   dots:    every point is drawn as a dot
+        #   density: points are binned into the pixels of the graph & drawn
+        #            as an image colored by the amount of points per pixel
+        #   minmax:  the min & max of the points falling into each pixel
+        #            column are drawn as an envelope
+        #   auto:    dots, or density beyond Utils.plot_points_limit points
+        # Past the dots mode, rendering cost & output size depend on the
+        # graph's resolution rather than on the amount of points
+
+        if len(x_axis) != len(y_axis):
             logging.error("-------------------------------------------------")
             logging.error("Mismatch in creating dot pairs!")
             sys.exit(0)
 
+        x_axis = numpy.asarray(x_axis)
+        y_axis = numpy.asarray(y_axis)
+
+        if plot_mode == "auto":
+            plot_mode = "dots"
+            if len(x_axis) > Utils.plot_points_limit:
+                plot_mode = "density"
+
         logging.info("-------------------------------------------------")
         logging.info("Plotting data ...")
 
+        plt = Utils.get_pyplot()
+        plt.figure()
         plt.xlabel("Timestamps")
         plt.ylabel("Trimmed Deltas")
         plt.title(plot_title)
 
-        # Create a dot plot
-        plt.plot(*zip(*dot_pairs), marker='o', color='r', ls='')
+        if plot_mode == "dots" or len(x_axis) == 0:
+            # Create a dot plot
+            plt.plot(x_axis, y_axis, marker='o', color='r', ls='')
+        elif plot_mode == "density":
+            Utils.plot_density(x_axis, y_axis)
+        elif plot_mode == "minmax":
+            Utils.plot_min_max(x_axis, y_axis)
+        else:
+            raise ValueError("Unknown plot mode: %s" % plot_mode)
 
         # Append .png if no extension given
         if not filepath.endswith('.png') and \
@@ -97,5 +153,181 @@ class Utils:
         logging.info("-------------------------------------------------")
         logging.info("Saving graph to: " + filepath) 
         plt.savefig(filepath)
+        plt.close()
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def get_plot_resolution():
+        # Returns the width & height in pixels of the current graph's axes
+
+        extent = Utils.get_pyplot().gca().get_window_extent()
+        width, height = extent.width, extent.height
+
+        return max(int(width), 1), max(int(height), 1)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def bin_axis(values, total_bins):
+        # Maps each value to one of total_bins equally sized bins spanning
+        # the values. Returns the bins along with the span
+
+        minimum, maximum = values.min(), values.max()
+        span = float(maximum - minimum) or 1.0
+
+        bins = ((values - minimum) * (total_bins / span)).astype(numpy.intp)
+        numpy.minimum(bins, total_bins - 1, out=bins)
+
+        return bins, minimum, minimum + span
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def plot_density(x_axis, y_axis):
+        # Bins the points into the pixels of the graph & draws the amount of
+        # points per pixel as an image
+
+        plt = Utils.get_pyplot()
+        import matplotlib.colors
+
+        width, height = Utils.get_plot_resolution()
+        x_bins, x_min, x_max = Utils.bin_axis(x_axis, width)
+        y_bins, y_min, y_max = Utils.bin_axis(y_axis, height)
+
+        counts = numpy.bincount(y_bins * width + x_bins, \
+                minlength=width * height).reshape(height, width)
+        counts = numpy.ma.masked_equal(counts, 0)
+
+        # Skip the lightest reds, so pixels holding a single point still show
+        colormap = matplotlib.colors.ListedColormap(\
+                plt.get_cmap('Reds')(numpy.linspace(0.4, 1.0, 256)))
+
+        image = plt.imshow(counts, origin='lower', aspect='auto', \
+                extent=(x_min, x_max, y_min, y_max), cmap=colormap, \
+                norm=matplotlib.colors.LogNorm(), interpolation='nearest')
+        plt.colorbar(image, label="Points per pixel")
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def plot_min_max(x_axis, y_axis):
+        # Draws the min & max of the points falling into each pixel column of
+        # the graph as an envelope
+
+        width, height = Utils.get_plot_resolution()
+        x_bins, x_min, x_max = Utils.bin_axis(x_axis, width)
+
+        minimums = numpy.full(width, numpy.inf)
+        maximums = numpy.full(width, -numpy.inf)
+        numpy.minimum.at(minimums, x_bins, y_axis)
+        numpy.maximum.at(maximums, x_bins, y_axis)
+
+        # Leave gaps in the columns without points
+        empty = numpy.isinf(minimums)
+        minimums[empty] = numpy.nan
+        maximums[empty] = numpy.nan
+
+        columns = x_min + (numpy.arange(width) + 0.5) * \
+                ((x_max - x_min) / float(width))
+        Utils.get_pyplot().fill_between(columns, minimums, maximums, \
+                color='r', linewidth=0.5, edgecolor='r')
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def plot_windows(window_stats, plot_title, filepath):
+        # Plots the median of each time window along with a band spanning
+        # the lowest & highest of its other percentiles, in a new figure
+
+        plt = Utils.get_pyplot()
+        plt.figure()
+        plt.xlabel("Timestamps")
+        plt.ylabel("Trimmed Deltas")
+        plt.title(plot_title)
+
+        percentiles = window_stats.percentiles
+        centers = (window_stats.starts + window_stats.ends) / 2.0
+
+        if 50 in percentiles:
+            plt.plot(centers, window_stats.percentile_values[:, \
+                    percentiles.index(50)], color='r', label="median")
+        if len(percentiles) > 1:
+            lowest = numpy.argmin(percentiles)
+            highest = numpy.argmax(percentiles)
+            plt.fill_between(centers, \
+                    window_stats.percentile_values[:, lowest], \
+                    window_stats.percentile_values[:, highest], color='r', \
+                    alpha=0.25, linewidth=0, label="p%g - p%g" % \
+                    (percentiles[lowest], percentiles[highest]))
+        plt.legend()
+
+        # Append .png if no extension given
+        if not filepath.endswith('.png') and \
+            not filepath.endswith('.pdf') and \
+            not filepath.endswith('.svg') :
+                filepath += '.png'
+
+        logging.info("-------------------------------------------------")
+        logging.info("Saving windowed graph to: " + filepath)
+        plt.savefig(filepath)
+        plt.close()
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def plot_distributions(histograms, plot_title, filepath, cumulative=True):
+        # Plots the distribution of the deltas of each (name, histogram)
+        # pair in a new figure, either as CDFs (share of the deltas <= each
+        # value) or, unless cumulative, as percentile curves (value at each
+        # percentile, on an axis stretched towards the tail, where p90, p99,
+        # p99.9, ... are equally far apart)
+
+        plt = Utils.get_pyplot()
+        plt.figure()
+        plt.title(plot_title)
+
+        histograms = [(name, histogram) for name, histogram in histograms \
+                if histogram.count]
+        largest_count = 1
+        for name, histogram in histograms:
+            lowers, uppers, counts = histogram.get_buckets()
+            values = numpy.clip(uppers, histogram.minimum, histogram.maximum)
+            fractions = numpy.cumsum(counts) / float(histogram.count)
+            largest_count = max(largest_count, histogram.count)
+
+            if cumulative:
+                plt.step(values, fractions, where='post', label=name)
+            else:
+                # 1 / (1 - fraction) is 10 at p90, 100 at p99, ... & the
+                # last values are drawn as if one value was left
+                tails = numpy.maximum(1.0 - fractions, \
+                        1.0 / histogram.count)
+                plt.step(numpy.concatenate(([1.0], 1.0 / tails)), \
+                        numpy.concatenate(([values[0]], values)), \
+                        where='pre', label=name)
+
+        if cumulative:
+            plt.xlabel("Deltas")
+            plt.ylabel("Share of the deltas")
+            # Deltas usually span orders of magnitude
+            if histograms and all(histogram.minimum > 0 \
+                    for name, histogram in histograms):
+                plt.xscale('log')
+        else:
+            plt.xlabel("Percentile")
+            plt.ylabel("Deltas")
+            plt.xscale('log')
+            ticks = 10.0 ** numpy.arange(int(numpy.ceil(numpy.log10(\
+                    largest_count))) + 1)
+            plt.xticks(ticks, ["%g%%" % (100 - 100 / tick) \
+                    for tick in ticks])
+        if histograms:
+            plt.legend()
+
+        # Append .png if no extension given
+        if not filepath.endswith('.png') and \
+            not filepath.endswith('.pdf') and \
+            not filepath.endswith('.svg') :
+                filepath += '.png'
+
+        logging.info("-------------------------------------------------")
+        logging.info("Saving distribution graph to: " + filepath)
+        plt.savefig(filepath)
+        plt.close()
 
 #-------------------------------------------------------------------------------
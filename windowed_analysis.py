@@ -0,0 +1,175 @@
+import csv
+import logging
+import numpy
+from objects import WindowStatistics
+from load_analysis_lib import LoadAnalysisLib
+
+class WindowedAnalysis:
+    # Aggregates the (trimmed) deltas of all files into time windows by
+    # timestamp, to follow how the load drifts over a test. Windows are
+    # fixed (step == window) or sliding (step < window) & the statistics of
+    # every window are computed at once with a sort & numpy.add.reduceat
+    # group-by, without looping over the windows
+
+    # Percentiles computed for every window, the median included
+    percentiles = [50, 90, 99]
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def aggregate(file_data_list, window, step=None, percentiles=None):
+        # Returns the WindowStatistics of the windows holding data. Windows
+        # start at the smallest timestamp & every step timestamp units from
+        # there. step must divide window, as sliding windows are unions of
+        # window / step step sized buckets
+
+        if percentiles is None:
+            percentiles = WindowedAnalysis.percentiles
+        if step is None:
+            step = window
+        if window != int(window) or step != int(step):
+            raise ValueError("The window & its step must be whole " + \
+                    "amounts of timestamp units: window = %s, step = %s" % \
+                    (window, step))
+        window, step = int(window), int(step)
+        if window <= 0 or step <= 0 or window % step:
+            raise ValueError("The window step must be positive & divide " + \
+                    "the window: window = %s, step = %s" % (window, step))
+
+        timestamps = LoadAnalysisLib.collect_all_timestamps(file_data_list)
+        deltas = LoadAnalysisLib.collect_all_deltas(file_data_list)
+        if len(timestamps) == 0:
+            return WindowStatistics(*([numpy.empty(0)] * 5 + \
+                    [percentiles, numpy.empty((0, len(percentiles)))]))
+
+        # Group the values by bucket, a window then spans the values of
+        # window / step consecutive buckets
+        origin = timestamps.min()
+        buckets = (timestamps - origin) // step
+        order = numpy.argsort(buckets, kind="stable")
+        buckets = buckets[order]
+        deltas = deltas[order]
+
+        is_start = numpy.empty(len(buckets), dtype=bool)
+        is_start[0] = True
+        numpy.not_equal(buckets[1:], buckets[:-1], out=is_start[1:])
+        bucket_offsets = numpy.append(numpy.flatnonzero(is_start), \
+                len(buckets))
+        bucket_ids = buckets[bucket_offsets[:-1]]
+        del buckets, is_start
+
+        overlap = window // step
+        window_ids = WindowedAnalysis.find_windows(bucket_ids, overlap)
+        value_starts = bucket_offsets[numpy.searchsorted(bucket_ids, \
+                window_ids)]
+        counts = bucket_offsets[numpy.searchsorted(bucket_ids, \
+                window_ids + overlap)] - value_starts
+
+        means = numpy.empty(len(counts))
+        stds = numpy.empty(len(counts))
+        percentile_values = numpy.empty((len(counts), len(percentiles)))
+
+        # Sliding windows hold each value window / step times, so the values
+        # of the windows are gathered in batches of at most as many values
+        # as there are in total, keeping memory linear in the amount of
+        # values whatever the overlap
+        total_values = numpy.cumsum(counts)
+        batch_start = 0
+        while batch_start < len(counts):
+            previous_total = total_values[batch_start - 1] \
+                    if batch_start else 0
+            batch_end = max(batch_start + 1, int(numpy.searchsorted(\
+                    total_values, previous_total + len(deltas), \
+                    side="right")))
+
+            batch = slice(batch_start, batch_end)
+            WindowedAnalysis.compute_statistics(deltas, value_starts[batch], \
+                    counts[batch], percentiles, means[batch], stds[batch], \
+                    percentile_values[batch])
+            batch_start = batch_end
+
+        starts = origin + window_ids * step
+
+        return WindowStatistics(starts, starts + window, counts, means, \
+                stds, list(percentiles), percentile_values)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def find_windows(bucket_ids, overlap):
+        # Returns the (sorted) ids of the windows holding data, given the
+        # sorted ids of the buckets holding data. A bucket lands in its own
+        # window & in the overlap - 1 windows starting before it
+
+        if overlap == 1:
+            return bucket_ids
+
+        # Buckets closer than overlap share windows, each run of them spans
+        # the windows from overlap - 1 before its first bucket to its last
+        lowest = numpy.maximum(bucket_ids - (overlap - 1), 0)
+        is_run_start = numpy.empty(len(bucket_ids), dtype=bool)
+        is_run_start[0] = True
+        numpy.greater(lowest[1:], bucket_ids[:-1], out=is_run_start[1:])
+
+        run_starts = lowest[is_run_start]
+        run_ends = bucket_ids[numpy.append(\
+                numpy.flatnonzero(is_run_start)[1:] - 1, \
+                len(bucket_ids) - 1)] + 1
+        run_lengths = run_ends - run_starts
+
+        return numpy.arange(run_lengths.sum()) + numpy.repeat(run_starts - \
+                (numpy.cumsum(run_lengths) - run_lengths), run_lengths)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def compute_statistics(deltas, starts, counts, percentiles, means, stds, \
+            percentile_values):
+        # Fills in the means, stds & percentile_values of the windows whose
+        # (non empty) values are deltas[starts[i]:starts[i] + counts[i]]
+
+        group_starts = numpy.cumsum(counts) - counts
+        total_values = int(group_starts[-1] + counts[-1])
+
+        # Gather the values of every window, sorted within each window
+        groups = numpy.repeat(numpy.arange(len(counts)), counts)
+        values = deltas[numpy.arange(total_values) + \
+                numpy.repeat(starts - group_starts, counts)]
+        values = values[numpy.lexsort((values, groups))].astype(numpy.float64)
+        del groups
+
+        means[:] = numpy.add.reduceat(values, group_starts) / counts
+        m2s = numpy.add.reduceat(numpy.square(values - \
+                numpy.repeat(means, counts)), group_starts)
+        stds[:] = numpy.sqrt(m2s / counts)
+
+        # Percentiles interpolate linearly between the closest ranks, like
+        # numpy.percentile
+        for column, percentile in enumerate(percentiles):
+            positions = group_starts + (counts - 1) * (percentile / 100.0)
+            lower = numpy.floor(positions).astype(numpy.intp)
+            upper = numpy.ceil(positions).astype(numpy.intp)
+            percentile_values[:, column] = values[lower] + \
+                    (values[upper] - values[lower]) * (positions - lower)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def write_csv(window_stats, filepath):
+        # Writes the statistics of each window as CSV
+
+        with open(filepath, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["window_start", "window_end", "count", "mean", \
+                    "std"] + ["p%g" % percentile \
+                    for percentile in window_stats.percentiles])
+
+            # tolist() turns the values into Python numbers, written in full
+            columns = zip(window_stats.starts.tolist(), \
+                    window_stats.ends.tolist(), window_stats.counts.tolist(), \
+                    window_stats.means.tolist(), window_stats.stds.tolist(), \
+                    window_stats.percentile_values.tolist())
+            for start, end, count, mean, std, percentile_values in columns:
+                writer.writerow([start, end, count, mean, std] + \
+                        percentile_values)
+
+        logging.info(LoadAnalysisLib.line_break)
+        logging.info("Windowed statistics of %s window(s) written to: %s" % \
+                (len(window_stats), filepath))
+
+#-------------------------------------------------------------------------------